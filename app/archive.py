@@ -0,0 +1,334 @@
+"""
+Archive of old listening history in compressed columnar segment files.
+
+Rows older than the retention cutoff are moved out of listening_history into
+one segment per (user id range, month). A segment stores each column in
+blocks of ARCHIVE_BLOCK_ROWS rows, zlib-compressed, with the sorted user_id
+and listened_at columns delta-encoded first. A JSON header lists every
+block's user id range and byte ranges, so a reader memory-maps the file and
+decompresses only the blocks it needs. index.json lists the segments.
+
+    python -m app.archive run --retention-days 365
+    python -m app.archive list
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from app.cache import TTLCache
+from app.models import ListeningHistory
+
+ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', './history_archive')
+HISTORY_RETENTION_DAYS = int(os.getenv('HISTORY_RETENTION_DAYS', 365))
+ARCHIVE_USERS_PER_SEGMENT = int(os.getenv('ARCHIVE_USERS_PER_SEGMENT', 1000))
+ARCHIVE_BLOCK_ROWS = 65_536
+COMPRESSION_LEVEL = 6
+DELETE_BATCH_SIZE = 500
+# Users whose archived song ids are kept in memory; they only change when
+# archive() runs, which changes the index identity they are keyed by
+ARCHIVE_SONG_IDS_CACHE_SIZE = int(os.getenv('ARCHIVE_SONG_IDS_CACHE_SIZE', 10_000))
+ARCHIVE_SONG_IDS_CACHE_TTL = float(os.getenv('ARCHIVE_SONG_IDS_CACHE_TTL', 3600))
+
+MAGIC = b'LHSEG001'
+PREFIX = struct.Struct('<8sI')
+INDEX_FILE = 'index.json'
+
+COLUMNS = {
+    'id': '<i8',
+    'user_id': '<i8',
+    # -1 for a play without a song
+    'song_id': '<i8',
+    'completed': '|u1',
+    # Microseconds since 1970-01-01, naive like the listened_at column
+    'listened_at': '<i8',
+}
+# Sorted columns are stored as differences, which compress far better
+DELTA_COLUMNS = ('user_id', 'listened_at')
+
+
+def to_microseconds(moments: Iterable[datetime]) -> np.ndarray:
+    return np.array(list(moments), dtype='datetime64[us]').astype(np.int64)
+
+
+def to_datetimes(microseconds: np.ndarray) -> List[datetime]:
+    return microseconds.astype('datetime64[us]').tolist()
+
+
+def write_segment(path: str, columns: Dict[str, np.ndarray]):
+    """Write rows sorted by (user_id, listened_at, id) as a segment, atomically replacing `path`."""
+    n = len(columns['id'])
+    blocks, blobs, offset = [], [], 0
+    for start in range(0, n, ARCHIVE_BLOCK_ROWS):
+        end = min(start + ARCHIVE_BLOCK_ROWS, n)
+        users = columns['user_id'][start:end]
+        block = {'rows': end - start, 'user_min': int(users[0]), 'user_max': int(users[-1]), 'columns': {}}
+        for name, dtype in COLUMNS.items():
+            values = np.ascontiguousarray(columns[name][start:end], dtype=dtype)
+            if name in DELTA_COLUMNS:
+                values = np.diff(values, prepend=values.dtype.type(0))
+            blob = zlib.compress(values.tobytes(), COMPRESSION_LEVEL)
+            block['columns'][name] = [offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+        blocks.append(block)
+    header = json.dumps({'rows': n, 'columns': COLUMNS, 'blocks': blocks}).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.segment-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(PREFIX.pack(MAGIC, len(header)))
+            file.write(header)
+            for blob in blobs:
+                file.write(blob)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class Segment:
+    """Read-only, memory-mapped view of one segment file."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self._mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREFIX.unpack_from(self._mapped, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a history segment")
+        header = json.loads(self._mapped[PREFIX.size:PREFIX.size + header_length])
+        self.rows = header['rows']
+        self.blocks = header['blocks']
+        self._data_offset = PREFIX.size + header_length
+
+    def _column(self, block: Dict, name: str) -> np.ndarray:
+        offset, length = block['columns'][name]
+        start = self._data_offset + offset
+        raw = zlib.decompress(memoryview(self._mapped)[start:start + length])
+        values = np.frombuffer(raw, dtype=COLUMNS[name])
+        return np.cumsum(values, dtype=values.dtype) if name in DELTA_COLUMNS else values
+
+    def read(self, columns: Iterable[str] = COLUMNS, user_id: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Columns of every row, or of one user's rows; only blocks holding them are decompressed."""
+        columns = list(columns)
+        needed = columns if user_id is None or 'user_id' in columns else columns + ['user_id']
+        parts = {name: [] for name in needed}
+        for block in self.blocks:
+            if user_id is not None and not block['user_min'] <= user_id <= block['user_max']:
+                continue
+            values = {name: self._column(block, name) for name in needed}
+            if user_id is not None:
+                mine = values['user_id'] == user_id
+                values = {name: column[mine] for name, column in values.items()}
+            for name in needed:
+                parts[name].append(values[name])
+        return {
+            name: np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype=COLUMNS[name])
+            for name in columns
+        }
+
+    def close(self):
+        self._mapped.close()
+
+
+class HistoryArchive:
+    """The segment files of one archive directory and their index."""
+
+    def __init__(self, directory: str = ARCHIVE_DIR, users_per_segment: int = ARCHIVE_USERS_PER_SEGMENT):
+        self.directory = directory
+        self.users_per_segment = users_per_segment
+        self._lock = threading.Lock()
+        self._index = None
+        self._identity = None
+        self._segments: Dict[str, Segment] = {}
+        # Keyed by (index identity, user_id)
+        self._song_ids = TTLCache(maxsize=ARCHIVE_SONG_IDS_CACHE_SIZE, ttl=ARCHIVE_SONG_IDS_CACHE_TTL)
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def index(self) -> Dict:
+        """The archive index, re-read when the file has changed."""
+        with self._lock:
+            try:
+                stat = os.stat(self._index_path)
+            except FileNotFoundError:
+                self._index, self._identity = {'archived_before': None, 'segments': []}, None
+                return self._index
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity != self._identity:
+                with open(self._index_path) as file:
+                    self._index = json.load(file)
+                self._identity = identity
+                # Segments may have been rewritten along with the index
+                self._segments = {}
+            return self._index
+
+    def archived_before(self) -> Optional[datetime]:
+        """Plays listened before this have been moved into the archive."""
+        archived_before = self.index()['archived_before']
+        return datetime.fromisoformat(archived_before) if archived_before else None
+
+    def _segment(self, relative_path: str) -> Segment:
+        segment = self._segments.get(relative_path)
+        if segment is None:
+            segment = self._segments[relative_path] = Segment(os.path.join(self.directory, relative_path))
+        return segment
+
+    def scan(self, columns: Iterable[str] = COLUMNS, user_id: Optional[int] = None) -> Iterator[Dict[str, np.ndarray]]:
+        """Column arrays segment by segment; with a user_id, that user's rows oldest month first."""
+        columns = list(columns)
+        entries = self.index()['segments']
+        if user_id is not None:
+            entries = sorted(
+                (entry for entry in entries if entry['user_min'] <= user_id <= entry['user_max']),
+                key=lambda entry: entry['month']
+            )
+        for entry in entries:
+            values = self._segment(entry['path']).read(columns, user_id)
+            if len(values[columns[0]]):
+                yield values
+
+    def song_ids(self, user_id: int) -> np.ndarray:
+        """Sorted distinct ids of the songs in a user's archived plays, cached until the next archive run."""
+        if not self.index()['segments']:
+            return np.zeros(0, dtype=np.int64)
+
+        def read() -> np.ndarray:
+            parts = [values['song_id'] for values in self.scan(['song_id'], user_id=user_id)]
+            song_ids = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+            song_ids = song_ids[song_ids >= 0]
+            song_ids.flags.writeable = False
+            return song_ids
+
+        return self._song_ids.get_or_set((self._identity, user_id), read)
+
+    def _save_index(self, index: Dict):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.index-', dir=self.directory)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(index, file, indent=1)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self._index_path)
+
+    def archive(self, db: Session, cutoff: datetime) -> Dict[str, int]:
+        """
+        Move rows listened before the start of cutoff's month into segments,
+        one user id range at a time. Each range's segments are written
+        before its rows are deleted; rows already in a segment (e.g. after
+        an interrupted run) are merged by id rather than duplicated.
+        """
+        cutoff = datetime(cutoff.year, cutoff.month, 1)
+        low, high = db.execute(
+            select(func.min(ListeningHistory.user_id), func.max(ListeningHistory.user_id))
+            .where(ListeningHistory.listened_at < cutoff)
+        ).one()
+        index = dict(self.index())
+        by_path = {entry['path']: entry for entry in index['segments']}
+        archived, segments = 0, set()
+
+        if low is not None:
+            first = (low - 1) // self.users_per_segment * self.users_per_segment + 1
+            for user_min in range(first, high + 1, self.users_per_segment):
+                user_max = user_min + self.users_per_segment - 1
+                rows = db.execute(
+                    select(ListeningHistory.id, ListeningHistory.user_id, ListeningHistory.song_id,
+                           ListeningHistory.completed, ListeningHistory.listened_at)
+                    .where(ListeningHistory.user_id.between(user_min, user_max),
+                           ListeningHistory.listened_at < cutoff)
+                ).all()
+                if not rows:
+                    continue
+                columns = {
+                    'id': np.array([row[0] for row in rows], dtype=np.int64),
+                    'user_id': np.array([row[1] for row in rows], dtype=np.int64),
+                    'song_id': np.array([-1 if row[2] is None else row[2] for row in rows], dtype=np.int64),
+                    'completed': np.array([bool(row[3]) for row in rows], dtype=np.uint8),
+                    'listened_at': to_microseconds(row[4] for row in rows),
+                }
+                months = columns['listened_at'].astype('datetime64[us]').astype('datetime64[M]')
+                for month in np.unique(months):
+                    in_month = months == month
+                    path = f"users-{user_min:09d}-{user_max:09d}/{month}.seg"
+                    part = {name: values[in_month] for name, values in columns.items()}
+                    if path in by_path:
+                        existing = self._segment(path).read()
+                        part = {name: np.concatenate([existing[name], part[name]]) for name in COLUMNS}
+                    _, unique = np.unique(part['id'], return_index=True)
+                    part = {name: values[unique] for name, values in part.items()}
+                    order = np.lexsort((part['id'], part['listened_at'], part['user_id']))
+                    part = {name: values[order] for name, values in part.items()}
+
+                    stale = self._segments.pop(path, None)
+                    if stale is not None:
+                        stale.close()
+                    write_segment(os.path.join(self.directory, path), part)
+                    by_path[path] = {'path': path, 'user_min': user_min, 'user_max': user_max,
+                                     'month': str(month), 'rows': len(part['id'])}
+                    segments.add(path)
+
+                index = {**index, 'segments': sorted(by_path.values(), key=lambda e: (e['user_min'], e['month']))}
+                self._save_index(index)
+                ids = columns['id'].tolist()
+                for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                    db.execute(delete(ListeningHistory).where(
+                        ListeningHistory.id.in_(ids[start:start + DELETE_BATCH_SIZE])
+                    ))
+                db.commit()
+                archived += len(ids)
+
+        previous = self.archived_before()
+        index = {**index, 'archived_before': max(cutoff, previous or cutoff).isoformat()}
+        self._save_index(index)
+        return {'rows': archived, 'segments': len(segments)}
+
+
+history_archive = HistoryArchive()
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archive old listening history into segment files")
+    parser.add_argument('command', choices=['run', 'list'])
+    parser.add_argument('--retention-days', type=int, default=HISTORY_RETENTION_DAYS,
+                        help="Keep plays from this many days (rounded back to the start of the month)")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        index = history_archive.index()
+        for entry in index['segments']:
+            size = os.path.getsize(os.path.join(history_archive.directory, entry['path']))
+            print(f"{entry['path']}: {entry['rows']} rows, {size} bytes")
+        print(f"Archived before {index['archived_before']}")
+        return
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        result = history_archive.archive(db, datetime.now() - timedelta(days=args.retention_days))
+    finally:
+        db.close()
+    print(f"Archived {result['rows']} plays into {result['segments']} segments "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
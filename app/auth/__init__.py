@@ -5,8 +5,23 @@ from app.auth.google import google
 from app.auth.apple import apple
 from app.auth.spotify import spotify
 
-from fastapi import APIRouter, Depends, Response
-from app.auth.utils import create_access_token, create_refresh_token, get_current_user
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.client import oauth_client
+from app.auth.utils import (
+    create_access_token,
+    create_refresh_token,
+    get_refresh_principal,
+    get_token_principal,
+    optional_oauth2_scheme,
+    revoke_token,
+    token_claims
+)
+from app.database import get_async_db
+from app.internal import require_internal_caller
 
 
 class AuthProvider(StrEnum):
@@ -34,26 +49,40 @@ async def get_auth():
 
 
 @auth.get('/refresh')
-async def refresh(response: Response, current_user = Depends(get_current_user)):
+async def refresh(response: Response, current_user = Depends(get_refresh_principal)):
     # Create a new access token
-    access_token = create_access_token(data={"sub": current_user.username})
+    access_token = create_access_token(data=token_claims(current_user))
     response.set_cookie('access_token', access_token, httponly=True, secure=True)
     return {'msg': 'Success'}
 
 
 @auth.get('/logout')
-async def logout(response: Response):
+async def logout(
+        request: Request,
+        response: Response,
+        token: Optional[str] = Depends(optional_oauth2_scheme),
+        db: AsyncSession = Depends(get_async_db)
+):
+    # Logout works without a bearer token too, with the cookies or none
+    for token in {token or request.cookies.get('access_token'), request.cookies.get('refresh_token')} - {None}:
+        await revoke_token(db, token)
     response.delete_cookie('access_token')
     response.delete_cookie('refresh_token')
     return {'msg': 'Success'}
 
 
 @auth.get('/verify')
-async def verify(current_user = Depends(get_current_user)):
+async def verify(current_user = Depends(get_token_principal)):
     # If we get here, the user is authenticated
     return {'msg': 'Success', 'user': current_user.username}
 
 
+@auth.get('/provider-requests', dependencies=[Depends(require_internal_caller)])
+async def read_provider_request_stats():
+    """Get OAuth provider request counters and latency"""
+    return oauth_client.stats()
+
+
 auth.include_router(google)
 auth.include_router(apple)
 auth.include_router(spotify)
@@ -1,13 +1,13 @@
 from time import time
 import os
 
-from app.models import User
-from app.auth.utils import create_access_token, create_refresh_token
-from app.auth.utils import create_access_token
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import RedirectResponse
-from httpx import post
+from app.auth.utils import get_or_create_provider_user, login_response
+from app.database import get_async_db
+
+from fastapi import APIRouter, Depends, Request, HTTPException
+from app.auth.client import oauth_client
 import jwt
 
 apple = APIRouter(
@@ -33,14 +33,14 @@ async def login_apple():
 
 
 @apple.post('/')
-async def auth_apple(request: Request):
+async def auth_apple(request: Request, db: AsyncSession = Depends(get_async_db)):
     form = await request.form()
     code = form.get("code")
 
     with open(APPLE_PRIVATE_KEY_PATH, 'r') as file:
         private_key = file.read()
 
-    token_response = post('https://appleid.apple.com/auth/token', data={
+    token_response = await oauth_client.post('apple', 'https://appleid.apple.com/auth/token', data={
         'client_id': APPLE_CLIENT_ID,
         'code': code,
         'grant_type': 'authorization_code',
@@ -67,9 +67,6 @@ async def auth_apple(request: Request):
 
     user_info = jwt.decode(id_token, options={'verify_signature': False})
     # sub is Apple’s unique identifier
-    user = User.get_by('apple_id', user_info['sub'])
-    response = RedirectResponse(os.getenv('LOGIN_FINAL_ENDPOINT'))
-    response.set_cookie('access_token', create_access_token(user.id), httponly=True, secure=True)
-    response.set_cookie('refresh_token', create_refresh_token(user.id), httponly=True, secure=True)
-    return response
+    user = await get_or_create_provider_user(db, 'apple', user_info['sub'], email=user_info.get('email'))
+    return login_response(user)
 
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Connection pool shared by every provider, per worker process
+OAUTH_MAX_CONNECTIONS = int(os.getenv('OAUTH_MAX_CONNECTIONS', 100))
+OAUTH_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OAUTH_MAX_KEEPALIVE_CONNECTIONS', 20))
+OAUTH_KEEPALIVE_EXPIRY = float(os.getenv('OAUTH_KEEPALIVE_EXPIRY', 30))
+# Seconds before the first retry, doubled (with jitter) for each one after it
+OAUTH_RETRY_BACKOFF = float(os.getenv('OAUTH_RETRY_BACKOFF', 0.1))
+
+# Worth another attempt on a GET; POSTs exchange single-use codes and are only
+# retried when the request never reached the provider
+RETRY_STATUSES = {502, 503, 504}
+NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+@dataclass(frozen=True)
+class ProviderSettings:
+    # Seconds for the whole request, and for opening a connection
+    timeout: float
+    connect_timeout: float
+    # Attempts after the first one, per request
+    retries: int
+    # Retries allowed per request on average, so an outage doesn't double the load
+    retry_ratio: float
+    # Retries available before any request has paid for them
+    retry_reserve: float
+
+    @classmethod
+    def from_env(cls, provider: str) -> 'ProviderSettings':
+        """OAUTH_<PROVIDER>_TIMEOUT and so on, falling back to OAUTH_TIMEOUT and so on."""
+        def setting(name: str, default: str) -> str:
+            return os.getenv(f'OAUTH_{provider.upper()}_{name}', os.getenv(f'OAUTH_{name}', default))
+
+        return cls(
+            timeout=float(setting('TIMEOUT', '10')),
+            connect_timeout=float(setting('CONNECT_TIMEOUT', '3')),
+            retries=int(setting('RETRIES', '2')),
+            retry_ratio=float(setting('RETRY_RATIO', '0.2')),
+            retry_reserve=float(setting('RETRY_RESERVE', '10')),
+        )
+
+
+PROVIDERS = ['google', 'apple', 'github', 'spotify']
+
+
+class RetryBudget:
+    """
+    Every request deposits `ratio` of a retry and every retry withdraws a
+    whole one, up to a balance of `reserve`.
+    """
+
+    def __init__(self, ratio: float, reserve: float):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self._balance + self.ratio, self.reserve)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+
+class ProviderStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.budget_exhausted = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def record(self, latency: float):
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "budget_exhausted": self.budget_exhausted,
+            "latency_mean_ms": self._latency_total / self.requests * 1000 if self.requests else 0.0,
+            "latency_max_ms": self._latency_max * 1000,
+        }
+
+
+class OAuthClient:
+    """
+    One httpx.AsyncClient with a keep-alive pool for every OAuth provider,
+    opened and closed by the app lifespan. Requests name their provider,
+    which picks the timeouts, retries and retry budget. `transport`
+    replaces the network, e.g. with an httpx.ASGITransport around a stub
+    provider.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, ProviderSettings]] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.settings = settings or {provider: ProviderSettings.from_env(provider) for provider in PROVIDERS}
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._budgets = {provider: RetryBudget(s.retry_ratio, s.retry_reserve) for provider, s in self.settings.items()}
+        self._stats = {provider: ProviderStats() for provider in self.settings}
+
+    @property
+    def running(self) -> bool:
+        return self._client is not None
+
+    def start(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        if self.running:
+            return
+        limits = httpx.Limits(max_connections=OAUTH_MAX_CONNECTIONS,
+                              max_keepalive_connections=OAUTH_MAX_KEEPALIVE_CONNECTIONS,
+                              keepalive_expiry=OAUTH_KEEPALIVE_EXPIRY)
+        transport = transport or self.transport or httpx.AsyncHTTPTransport(limits=limits)
+        self._client = httpx.AsyncClient(transport=transport, limits=limits)
+
+    async def stop(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    async def request(self, provider: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request to `provider`, retrying failures its settings and budget allow."""
+        if not self.running:
+            # Outside the app lifespan, e.g. from a script
+            self.start()
+        settings, budget, stats = self.settings[provider], self._budgets[provider], self._stats[provider]
+        timeout = httpx.Timeout(settings.timeout, connect=settings.connect_timeout)
+        retry_all = method.upper() == 'GET'
+        stats.requests += 1
+        budget.deposit()
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                response = error = None
+                try:
+                    response = await self._client.request(method, url, timeout=timeout, **kwargs)
+                    if not (retry_all and response.status_code in RETRY_STATUSES):
+                        return response
+                except (httpx.TransportError if retry_all else NOT_SENT) as e:
+                    error = e
+                if attempt >= settings.retries or not budget.withdraw():
+                    if attempt < settings.retries:
+                        stats.budget_exhausted += 1
+                    if error is not None:
+                        raise error
+                    return response
+                attempt += 1
+                stats.retries += 1
+                failure = repr(error) if error is not None else f"status {response.status_code}"
+                logger.warning(f"{provider}: retrying {method} {url} after {failure}")
+                await asyncio.sleep(OAUTH_RETRY_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+        except httpx.HTTPError:
+            stats.failures += 1
+            raise
+        finally:
+            stats.record(time.perf_counter() - started)
+
+    async def get(self, provider: str, url: str, **kwargs) -> httpx.Response:
+        return await self.request(provider, 'GET', url, **kwargs)
+
+    async def post(self, provider: str, url: str, **kwargs) -> httpx.Response:
+        return await self.request(provider, 'POST', url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self.running, **{provider: stats.as_dict() for provider, stats in self._stats.items()}}
+
+
+oauth_client = OAuthClient()
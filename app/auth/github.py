@@ -1,9 +1,11 @@
 import os
 
-from app.models import User
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi import APIRouter, HTTPException
-from httpx import get, post
+from app.auth.utils import get_or_create_provider_user, login_response
+from app.database import get_async_db
+from fastapi import APIRouter, Depends, HTTPException
+from app.auth.client import oauth_client
 
 github = APIRouter(
     tags=['github'],
@@ -24,9 +26,9 @@ async def login_github():
 
 
 @github.get('/')
-async def auth_github(code: str):
-    token_response = post(
-        'https://github.com/login/oauth/access_token',
+async def auth_github(code: str, db: AsyncSession = Depends(get_async_db)):
+    token_response = await oauth_client.post(
+        'github', 'https://github.com/login/oauth/access_token',
         headers={'Accept': 'application/json'},
         data={
             'client_id': GITHUB_CLIENT_ID,
@@ -39,13 +41,11 @@ async def auth_github(code: str):
     if not access_token:
         raise HTTPException(detail='Failed to retrieve access token', status_code=400)
 
-    user_info = get(
-        'https://api.github.com/user',
+    user_info = await oauth_client.get(
+        'github', 'https://api.github.com/user',
         headers={'Authorization': f'token {access_token}'}
     )
+    profile = user_info.json()
     # id is GitHub’s unique identifier
-    user = User.get_by('github_id', user_info.json()['id'])
-    response = RedirectResponse(os.getenv('LOGIN_FINAL_ENDPOINT'))
-    response.set_cookie('access_token', create_access_token(user.id), httponly=True, secure=True)
-    response.set_cookie('refresh_token', create_refresh_token(user.id), httponly=True, secure=True)
-    return response
+    user = await get_or_create_provider_user(db, 'github', profile['id'], profile.get('login'), profile.get('email'))
+    return login_response(user)
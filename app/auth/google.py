@@ -1,11 +1,11 @@
 import os
 
-from app.models import User
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth.utils import create_access_token, create_refresh_token
-from fastapi.responses import RedirectResponse
-from fastapi import APIRouter, HTTPException
-from httpx import post, get
+from app.auth.utils import get_or_create_provider_user, login_response
+from app.database import get_async_db
+from fastapi import APIRouter, Depends, HTTPException
+from app.auth.client import oauth_client
 
 google = APIRouter(
     tags=['auth', 'google'],
@@ -28,8 +28,8 @@ async def login_google():
 
 
 @google.get('/')
-async def auth_google(code: str):
-    token_response = post('https://accounts.google.com/o/oauth2/token', data={
+async def auth_google(code: str, db: AsyncSession = Depends(get_async_db)):
+    token_response = await oauth_client.post('google', 'https://accounts.google.com/o/oauth2/token', data={
         'code': code,
         'client_id': GOOGLE_CLIENT_ID,
         'client_secret': GOOGLE_CLIENT_SECRET,
@@ -40,13 +40,11 @@ async def auth_google(code: str):
     if not access_token:
         raise HTTPException(detail='Failed to retrieve access token', status_code=400)
 
-    user_info = get(
-        'https://www.googleapis.com/oauth2/v1/userinfo',
+    user_info = await oauth_client.get(
+        'google', 'https://www.googleapis.com/oauth2/v1/userinfo',
         headers={'Authorization': f'Bearer {access_token}'}
     )
+    profile = user_info.json()
     # id is Google’s unique identifier
-    user = User.get_by('google_id', user_info.json()['id'])
-    response = RedirectResponse(os.getenv('LOGIN_FINAL_ENDPOINT'))
-    response.set_cookie('access_token', create_access_token(user.id), httponly=True, secure=True)
-    response.set_cookie('refresh_token', create_refresh_token(user.id), httponly=True, secure=True)
-    return response
+    user = await get_or_create_provider_user(db, 'google', profile['id'], email=profile.get('email'))
+    return login_response(user)
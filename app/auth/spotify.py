@@ -1,11 +1,11 @@
 import os
 
-from app.models import User
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth.utils import create_access_token, create_refresh_token
-from fastapi.responses import RedirectResponse
-from fastapi import APIRouter, HTTPException
-from httpx import get, post
+from app.auth.utils import get_or_create_provider_user, login_response
+from app.database import get_async_db
+from fastapi import APIRouter, Depends, HTTPException
+from app.auth.client import oauth_client
 
 spotify = APIRouter(
     tags=['spotify'],
@@ -27,11 +27,11 @@ async def login_spotify():
 
 
 @spotify.get('/')
-async def auth_spotify(code: str):
+async def auth_spotify(code: str, db: AsyncSession = Depends(get_async_db)):
     if not code:
         raise HTTPException(status_code=400, detail='No code provided')
 
-    token_response = post('https://accounts.spotify.com/api/token', data={
+    token_response = await oauth_client.post('spotify', 'https://accounts.spotify.com/api/token', data={
         'grant_type': 'authorization_code',
         'code': code,
         'redirect_uri': SPOTIFY_REDIRECT_URI,
@@ -43,13 +43,12 @@ async def auth_spotify(code: str):
     if not access_token:
         raise HTTPException(detail='Failed to retrieve access token', status_code=400)
 
-    user_info = get(
-        f'https://api.spotify.com/v1/me',
+    user_info = await oauth_client.get(
+        'spotify', 'https://api.spotify.com/v1/me',
         headers={'Authorization': f'Bearer {access_token}'}
     )
+    profile = user_info.json()
     # id is Spotify’s unique identifier
-    user = User.get_by('spotify_id', user_info.json()['id'])
-    response = RedirectResponse(os.getenv('LOGIN_FINAL_ENDPOINT'))
-    response.set_cookie('access_token', create_access_token(user.id), httponly=True, secure=True)
-    response.set_cookie('refresh_token', create_refresh_token(user.id), httponly=True, secure=True)
-    return response
+    user = await get_or_create_provider_user(db, 'spotify', profile['id'], profile.get('display_name'),
+                                             profile.get('email'))
+    return login_response(user)
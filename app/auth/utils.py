@@ -1,83 +1,211 @@
+import os
+import time
+import uuid
 from datetime import datetime, timedelta, UTC  # Import UTC
 from typing import Optional
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from app.models import User
-from app.schemas import TokenData  # This is the correct location
-
-from app.session import get_db
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.hashing import HashingOverloaded, password_hasher
+from app.database import get_async_read_db
+from app.models import OAuthIdentity, User
+from app.principals import Principal, get_principal
+from app.revocation import REFRESH_TOKEN_EXPIRE_DAYS, revocation_list
 
 # Security configuration
 SECRET_KEY = "YOUR_SECRET_KEY_HERE"  # Replace with a secure random string in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-# Password hashing
-pwd_context = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
+# Trust the uid and active claims of access tokens on identity-only routes
+# instead of looking the user up. A deactivated user keeps access until
+# their tokens expire or are revoked.
+AUTH_STATELESS = os.getenv('AUTH_STATELESS', 'false').lower() in ('1', 'true', 'yes')
+# Where provider callbacks send the browser once the token cookies are set
+LOGIN_FINAL_ENDPOINT = os.getenv('LOGIN_FINAL_ENDPOINT', '/')
 
 # OAuth2 bearer token configuration
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# For routes that also take tokens from cookies
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+    return await db.scalar(select(User).where(User.username == username))
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
-    user = db.query(User).filter(User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    user = await get_user_by_username(db, username)
     if not user:
         # Logging would be better than print in production
         print("User not found.")
         return None
     try:
-        if not verify_password(password, user.hashed_password):
+        # Hash verification is CPU-bound, it runs in the hashing worker processes
+        verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not verified:
             print("Incorrect password.")
             return None
+    except HashingOverloaded:
+        raise
     except Exception as e:
         print(f"Password verification failed: {e}")
         return None
+    if new_hash:
+        # Stored with another scheme or work factor than the current policy
+        user.hashed_password = new_hash
+        await db.commit()
+    return user
+
+async def get_or_create_provider_user(db: AsyncSession, provider: str, subject: str,
+                                      username: Optional[str] = None, email: Optional[str] = None) -> User:
+    """
+    The user linked to an account at `provider`, created on its first login.
+    `username` and `email` are only used when they are still free.
+    """
+    subject = str(subject)
+    query = select(User).join(OAuthIdentity, OAuthIdentity.user_id == User.id).where(
+        OAuthIdentity.provider == provider, OAuthIdentity.subject == subject
+    )
+    user = await db.scalar(query)
+    if user is not None:
+        return user
+    if not username or await get_user_by_username(db, username) is not None:
+        username = f"{provider}-{subject}"
+    if email and await db.scalar(select(User.id).where(User.email == email)) is not None:
+        # Linking by email would hand an existing account to whoever controls the provider account
+        email = None
+    user = User(username=username, email=email, hashed_password=None, is_active=True)
+    db.add(user)
+    try:
+        await db.flush()
+        db.add(OAuthIdentity(provider=provider, subject=subject, user_id=user.id))
+        await db.commit()
+    except IntegrityError:
+        # A concurrent first login of the same account won
+        await db.rollback()
+        user = await db.scalar(query)
+        if user is None:
+            raise
     return user
 
+def login_response(user: User) -> RedirectResponse:
+    """Redirect to LOGIN_FINAL_ENDPOINT with fresh access and refresh token cookies."""
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
+    response = RedirectResponse(LOGIN_FINAL_ENDPOINT, status_code=status.HTTP_303_SEE_OTHER)
+    response.set_cookie('access_token', create_access_token(token_claims(user)), httponly=True, secure=True)
+    response.set_cookie('refresh_token', create_refresh_token(token_claims(user)), httponly=True, secure=True)
+    return response
+
+def token_claims(user) -> dict:
+    """Claims identifying a User or Principal in an access or refresh token."""
+    return {"sub": user.username, "uid": user.id, "active": user.is_active is not False}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     # Use datetime.now(UTC) instead of utcnow()
     expire = datetime.now(UTC) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({
         "exp": expire,
-        "sub": data.get("username")  # Add the 'sub' claim explicitly
+        "sub": data.get("sub", data.get("username")),  # Add the 'sub' claim explicitly
+        # Issue time and token id, checked against the revocation list
+        "iat": time.time(),
+        "jti": uuid.uuid4().hex,
     })
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
-    expire = datetime.now(UTC) + (expires_delta or timedelta(days=7))  # 7 days for refresh token
-    to_encode.update({"exp": expire, "sub": str(data), "refresh": True})
+    expire = datetime.now(UTC) + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    to_encode.update({
+        "exp": expire,
+        "sub": data.get("sub", data.get("username")),
+        "refresh": True,
+        # Revocable like access tokens
+        "iat": time.time(),
+        "jti": uuid.uuid4().hex,
+    })
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials.",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str, refresh: bool = False) -> dict:
+    """
+    Claims of a valid, unrevoked access token, or refresh token with
+    `refresh`; raises a 401 otherwise.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
     except JWTError as e:
         print(f"JWT decode error: {e}")
-        raise credentials_exception
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        raise _credentials_exception()
+    # A refresh token must not pass for an access token, nor the other way round
+    if payload.get("sub") is None or bool(payload.get("refresh")) != refresh:
+        raise _credentials_exception()
+    if revocation_list.is_revoked(payload):
+        raise _credentials_exception()
+    return payload
+
+async def principal_from_token(db: AsyncSession, token: str, stateless: Optional[bool] = None,
+                               refresh: bool = False) -> Principal:
+    """
+    The active user a token belongs to. Stateless (AUTH_STATELESS by
+    default) reads the identity from the token's claims without touching
+    the database; tokens issued without them are looked up as usual.
+    """
+    payload = decode_token(token, refresh)
+    if (AUTH_STATELESS if stateless is None else stateless) and payload.get("uid") is not None:
+        principal = Principal(id=payload["uid"], username=payload["sub"], email=None,
+                              is_active=payload.get("active", True), created_at=None)
+    else:
+        # Usually served from the principal cache, without a query
+        principal = await get_principal(db, token, payload["sub"], payload.get("exp"))
+    if principal is None or not principal.is_active:
+        raise _credentials_exception()
+    return principal
+
+async def revoke_token(db: AsyncSession, token: str):
+    """Revoke an access or refresh token for every worker; invalid or expired tokens are ignored."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return
+    if payload.get("jti"):
+        await revocation_list.revoke(db, payload["exp"], jti=payload["jti"])
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_read_db)) -> Principal:
+    """The authenticated user, with the profile fields of the users table."""
+    return await principal_from_token(db, token, stateless=False)
+
+async def get_token_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_read_db)) -> Principal:
+    """The authenticated user's id and username, from the token alone under AUTH_STATELESS."""
+    return await principal_from_token(db, token)
+
+async def get_refresh_principal(
+    request: Request,
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_async_read_db)) -> Principal:
+    """
+    The user of the refresh_token cookie, or else of the bearer access token.
+    Always looked up, even under AUTH_STATELESS, so a deactivated user can't
+    keep minting access tokens; that is one lookup per access token lifetime.
+    """
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        return await principal_from_token(db, refresh_token, stateless=False, refresh=True)
+    if token is None:
+        raise _credentials_exception()
+    return await principal_from_token(db, token, stateless=False)
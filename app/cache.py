@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Keys can be tied to a group (e.g. the user id of a per-user key) with the
+    `group` function so that invalidate_group() drops exactly that group's
+    entries. get_or_set() will not store a value computed while its group
+    was being invalidated, so a write racing a read cannot leave stale data
+    behind.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, group: Optional[Callable[[Hashable], Hashable]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._group = group
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._groups: Dict[Hashable, Set[Hashable]] = {}
+        self._generations: "OrderedDict[Hashable, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, generation: Optional[int] = None):
+        """
+        Store a value. `ttl` overrides the cache TTL for this entry (it is
+        never extended past it); `generation` is the group generation seen
+        before the value was computed.
+        """
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        group = self._group(key) if self._group else None
+        with self._lock:
+            if generation is not None and self._generations.get(group, 0) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value)
+            if self._group:
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get_or_set(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        generation = self.generation(self._group(key)) if self._group else None
+        value = compute()
+        self.set(key, value, generation=generation)
+        return value
+
+    def generation(self, group: Hashable) -> int:
+        with self._lock:
+            return self._generations.get(group, 0)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_group(self, group: Hashable):
+        with self._lock:
+            self._generations[group] = self._generations.pop(group, 0) + 1
+            while len(self._generations) > max(self.maxsize, 1):
+                self._generations.popitem(last=False)
+            for key in list(self._groups.get(group, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def _remove(self, key: Hashable):
+        del self._entries[key]
+        if self._group:
+            group = self._group(key)
+            keys = self._groups.get(group)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._groups[group]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,17 @@
+import os
+from functools import partial
+
+import anyio.to_thread
+
+# Threads shared by sync endpoints, sync dependencies and run_sync calls
+SYNC_THREAD_LIMIT = int(os.getenv('SYNC_THREAD_LIMIT', 16))
+
+
+def limit_sync_threads(limit: int = SYNC_THREAD_LIMIT):
+    """Bound the worker threads of the running event loop; call from the app lifespan."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = limit
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run blocking `func` on the bounded thread pool instead of the event loop."""
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs))
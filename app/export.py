@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+from enum import StrEnum
+from itertools import chain
+from typing import Dict, Iterator, List
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.archive import history_archive, to_datetimes
+from app.models import ListeningHistory, Song
+
+# Rows fetched per round trip of the server-side cursor
+EXPORT_BATCH_SIZE = 5_000
+
+EXPORT_COLUMNS = [
+    'id', 'song_id', 'completed', 'listened_at', 'title', 'artist', 'album', 'genre', 'duration'
+]
+
+
+class ExportFormat(StrEnum):
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: 'application/x-ndjson',
+    ExportFormat.CSV: 'text/csv',
+}
+
+
+def iter_history_batches(db: Session, user_id: int) -> Iterator[List[Dict]]:
+    """
+    A user's plays with their song metadata, oldest first, EXPORT_BATCH_SIZE
+    rows at a time. Timestamps are ISO 8601 strings.
+    """
+    result = db.execute(
+        select(
+            ListeningHistory.id, ListeningHistory.song_id, ListeningHistory.completed,
+            ListeningHistory.listened_at, Song.title, Song.artist, Song.album, Song.genre, Song.duration
+        )
+        .outerjoin(Song, Song.id == ListeningHistory.song_id)
+        .where(ListeningHistory.user_id == user_id)
+        .order_by(ListeningHistory.listened_at, ListeningHistory.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    for partition in result.mappings().partitions():
+        batch = [dict(row) for row in partition]
+        for row in batch:
+            if row['listened_at'] is not None:
+                row['listened_at'] = row['listened_at'].isoformat()
+        yield batch
+
+
+def iter_archived_batches(db: Session, user_id: int) -> Iterator[List[Dict]]:
+    """Like iter_history_batches, for the user's plays in the history archive."""
+    for columns in history_archive.scan(user_id=user_id):
+        for start in range(0, len(columns['id']), EXPORT_BATCH_SIZE):
+            chunk = {name: values[start:start + EXPORT_BATCH_SIZE] for name, values in columns.items()}
+            song_ids = [None if song_id < 0 else song_id for song_id in chunk['song_id'].tolist()]
+            songs = {
+                song.id: song for song in db.execute(
+                    select(Song.id, Song.title, Song.artist, Song.album, Song.genre, Song.duration)
+                    .where(Song.id.in_({song_id for song_id in song_ids if song_id is not None}))
+                )
+            }
+            batch = []
+            for history_id, song_id, completed, listened_at in zip(
+                    chunk['id'].tolist(), song_ids, chunk['completed'].tolist(), to_datetimes(chunk['listened_at'])):
+                song = songs.get(song_id)
+                batch.append({
+                    'id': history_id, 'song_id': song_id, 'completed': bool(completed),
+                    'listened_at': listened_at.isoformat(),
+                    'title': song and song.title, 'artist': song and song.artist, 'album': song and song.album,
+                    'genre': song and song.genre, 'duration': song and song.duration,
+                })
+            yield batch
+
+
+def _ndjson(batch: List[Dict]) -> str:
+    return ''.join(json.dumps(row) + '\n' for row in batch)
+
+
+def _csv(batch: List[Dict], header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    if header:
+        writer.writeheader()
+    writer.writerows(batch)
+    return buffer.getvalue()
+
+
+def stream_history_export(user_id: int, format: ExportFormat) -> Iterator[str]:
+    """Export chunks of a user's archived and then live history, using a session of its own."""
+    from app.database import ReadSessionLocal
+
+    if format == ExportFormat.CSV:
+        yield _csv([], header=True)
+    db = ReadSessionLocal()
+    try:
+        for batch in chain(iter_archived_batches(db, user_id), iter_history_batches(db, user_id)):
+            yield _csv(batch) if format == ExportFormat.CSV else _ndjson(batch)
+    finally:
+        db.close()
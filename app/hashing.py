@@ -0,0 +1,317 @@
+"""
+Password hashing policy and the worker processes that apply it.
+
+New hashes use PASSWORD_HASH_SCHEME with the work factor recorded in
+PASSWORD_HASH_POLICY_FILE, calibrated to take about PASSWORD_HASH_TARGET_MS
+to verify on this machine. Hashes in another scheme or with other rounds
+still verify and are replaced on the user's next login.
+
+    python -m app.hashing calibrate --target-ms 250
+    python -m app.hashing bench
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+
+# Older schemes are kept so existing hashes verify and can be upgraded
+SUPPORTED_SCHEMES = ["sha256_crypt", "sha512_crypt", "pbkdf2_sha256", "bcrypt"]
+PASSWORD_HASH_SCHEME = os.getenv('PASSWORD_HASH_SCHEME', 'sha256_crypt')
+PASSWORD_HASH_TARGET_MS = float(os.getenv('PASSWORD_HASH_TARGET_MS', 250))
+PASSWORD_HASH_POLICY_FILE = os.getenv('PASSWORD_HASH_POLICY_FILE', './password_hash_policy.json')
+# Calibrate at startup when there is no policy file for the scheme
+PASSWORD_HASH_CALIBRATE = os.getenv('PASSWORD_HASH_CALIBRATE', 'false').lower() in ('1', 'true', 'yes')
+
+CALIBRATION_PASSWORD = "calibration-password"
+CALIBRATION_SAMPLES = 3
+CALIBRATION_PASSES = 2
+
+
+def build_context(scheme: str = PASSWORD_HASH_SCHEME, rounds: Optional[int] = None) -> CryptContext:
+    """Hashes with `scheme` at exactly `rounds` (the scheme's default if None); anything else needs an update."""
+    settings = {}
+    if rounds is not None:
+        settings = {f"{scheme}__default_rounds": rounds, f"{scheme}__min_rounds": rounds,
+                    f"{scheme}__max_rounds": rounds}
+    return CryptContext(
+        schemes=[scheme] + [other for other in SUPPORTED_SCHEMES if other != scheme],
+        default=scheme, deprecated="auto", **settings
+    )
+
+
+def load_policy(path: str = PASSWORD_HASH_POLICY_FILE, scheme: str = PASSWORD_HASH_SCHEME) -> Dict[str, Any]:
+    """The calibrated policy for `scheme`, or its passlib defaults when none was saved."""
+    try:
+        with open(path) as file:
+            policy = json.load(file)
+    except FileNotFoundError:
+        policy = None
+    if not policy or policy.get("scheme") != scheme:
+        return {"scheme": scheme, "rounds": None}
+    return policy
+
+
+def save_policy(policy: Dict[str, Any], path: str = PASSWORD_HASH_POLICY_FILE):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.policy-', dir=directory)
+    with os.fdopen(fd, 'w') as file:
+        json.dump(policy, file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _verify_seconds(scheme: str, rounds: int) -> float:
+    """Best of CALIBRATION_SAMPLES verify times of one hash."""
+    handler = get_crypt_handler(scheme).using(rounds=rounds)
+    hashed = handler.hash(CALIBRATION_PASSWORD)
+    timings = []
+    for _ in range(CALIBRATION_SAMPLES):
+        started = time.perf_counter()
+        handler.verify(CALIBRATION_PASSWORD, hashed)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def calibrate(scheme: str = PASSWORD_HASH_SCHEME, target_ms: float = PASSWORD_HASH_TARGET_MS) -> Dict[str, Any]:
+    """Policy whose verify time on this machine is as close to target_ms as the scheme's rounds allow."""
+    handler = get_crypt_handler(scheme)
+    rounds = handler.default_rounds
+    target = target_ms / 1000
+    # The second pass corrects for costs that are not quite proportional to rounds
+    for _ in range(CALIBRATION_PASSES):
+        measured = _verify_seconds(scheme, rounds)
+        if handler.rounds_cost == "log2":
+            rounds = rounds + math.floor(math.log2(target / measured))
+        else:
+            rounds = int(rounds * target / measured)
+        rounds = min(max(rounds, handler.min_rounds), handler.max_rounds)
+    return {
+        "scheme": scheme,
+        "rounds": rounds,
+        "target_ms": target_ms,
+        "verify_ms": _verify_seconds(scheme, rounds) * 1000,
+        "calibrated_at": datetime.now().isoformat(),
+    }
+
+
+policy = load_policy()
+pwd_context = build_context(policy["scheme"], policy["rounds"])
+
+
+def apply_policy(new_policy: Dict[str, Any]):
+    """Hash with `new_policy` in this process; start the worker pool afterwards."""
+    global policy, pwd_context
+    policy, pwd_context = new_policy, build_context(new_policy["scheme"], new_policy["rounds"])
+
+
+def ensure_calibrated(path: str = PASSWORD_HASH_POLICY_FILE, scheme: str = PASSWORD_HASH_SCHEME):
+    """
+    Apply the saved policy, calibrating and saving one first if PASSWORD_HASH_CALIBRATE
+    is set and none exists; call before starting the pool.
+
+    Only the first server worker to take the lock calibrates. The others wait, then
+    load its file like the hash workers do, so every process hashes at the same rounds.
+    """
+    if PASSWORD_HASH_CALIBRATE:
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if load_policy(path, scheme)["rounds"] is None:
+                save_policy(calibrate(scheme), path)
+    apply_policy(load_policy(path, scheme))
+
+
+# Worker processes for hashing and verification, one per core by default
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+# Hashes queued or running at once; beyond this requests get a 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 4 * PASSWORD_HASH_WORKERS))
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Whether the password matches, and a replacement hash if the stored one is outdated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _timed(func: Callable, *args) -> Tuple[Any, float, float]:
+    """Run in a worker: the result with its start and end on the shared monotonic clock."""
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic()
+
+
+def _process_pool(workers: int) -> Executor:
+    # Fresh interpreters; a fork would copy the app's threads and open connections
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class HashingOverloaded(Exception):
+    """Too many password hashes are queued already."""
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a pool of worker processes,
+    so the CPU cost stays off the event loop and its threads.
+
+    At most `max_pending` calls are queued or running; further calls raise
+    HashingOverloaded straight away rather than waiting behind them. The
+    pool starts on first use if start() was not called.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING,
+                 executor_factory: Callable[[int], Executor] = _process_pool):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor_factory = executor_factory
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hash_total = 0.0
+        self._hash_max = 0.0
+
+    def start(self) -> Executor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = self.executor_factory(self.workers)
+                # Start the workers now rather than on the first logins
+                for _ in range(self.workers):
+                    self._executor.submit(int)
+            return self._executor
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    async def run(self, func: Callable, *args) -> Any:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HashingOverloaded(f"{self.pending} password hashes pending")
+            self.pending += 1
+        try:
+            executor = self._executor or self.start()
+            submitted = time.monotonic()
+            try:
+                result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                    executor, partial(_timed, func, *args)
+                )
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+        with self._lock:
+            self.completed += 1
+            self._wait_total += started - submitted
+            self._wait_max = max(self._wait_max, started - submitted)
+            self._hash_total += finished - started
+            self._hash_max = max(self._hash_max, finished - started)
+        return result
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await self.run(verify_and_update, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = self.completed
+            return {
+                "running": self._executor is not None,
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_wait_mean_ms": self._wait_total / completed * 1000 if completed else 0.0,
+                "queue_wait_max_ms": self._wait_max * 1000,
+                "hash_mean_ms": self._hash_total / completed * 1000 if completed else 0.0,
+                "hash_max_ms": self._hash_max * 1000,
+            }
+
+
+password_hasher = PasswordHasher()
+
+
+def bench(seconds: float) -> Dict[str, Dict[str, Any]]:
+    """Verifications per second on one core for every scheme, at the policy's rounds or the scheme default."""
+    results = {}
+    for scheme in SUPPORTED_SCHEMES:
+        handler = get_crypt_handler(scheme)
+        rounds = policy["rounds"] if scheme == policy["scheme"] and policy["rounds"] else handler.default_rounds
+        try:
+            hasher = handler.using(rounds=rounds)
+            hashed = hasher.hash(CALIBRATION_PASSWORD)
+            count, started = 0, time.perf_counter()
+            while time.perf_counter() - started < seconds:
+                hasher.verify(CALIBRATION_PASSWORD, hashed)
+                count += 1
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            results[scheme] = {"rounds": rounds, "error": str(e)}
+            continue
+        results[scheme] = {"rounds": rounds, "hashes_per_second": count / elapsed, "verify_ms": elapsed / count * 1000}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate and benchmark password hashing")
+    parser.add_argument('command', choices=['calibrate', 'bench'])
+    parser.add_argument('--scheme', choices=SUPPORTED_SCHEMES, default=PASSWORD_HASH_SCHEME)
+    parser.add_argument('--target-ms', type=float, default=PASSWORD_HASH_TARGET_MS)
+    parser.add_argument('--seconds', type=float, default=2.0, help="Time spent on each scheme by bench")
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        calibrated = calibrate(args.scheme, args.target_ms)
+        save_policy(calibrated)
+        print(f"{calibrated['scheme']}: {calibrated['rounds']} rounds verify in {calibrated['verify_ms']:.1f}ms "
+              f"(target {args.target_ms:.0f}ms), saved to {PASSWORD_HASH_POLICY_FILE}")
+        return
+
+    cores = os.cpu_count() or 1
+    for scheme, result in bench(args.seconds).items():
+        if "error" in result:
+            print(f"{scheme:14} unavailable: {result['error']}")
+            continue
+        current = " (policy)" if scheme == policy["scheme"] else ""
+        print(f"{scheme:14} rounds {result['rounds']:>10}  {result['verify_ms']:8.1f}ms  "
+              f"{result['hashes_per_second']:8.1f} hashes/s per core, {result['hashes_per_second'] * cores:8.1f} "
+              f"on {cores} cores{current}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import os
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException, status
+
+# Shared with internal callers (batch pipelines, monitoring); the routes
+# that require it are disabled while it is unset
+INTERNAL_API_KEY = os.getenv('INTERNAL_API_KEY')
+
+
+def require_internal_caller(x_internal_key: Optional[str] = Header(None)):
+    """Only callers holding INTERNAL_API_KEY get past this dependency."""
+    if not INTERNAL_API_KEY or not x_internal_key or not secrets.compare_digest(x_internal_key, INTERNAL_API_KEY):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Internal callers only")
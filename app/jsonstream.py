@@ -0,0 +1,123 @@
+import codecs
+import json
+from typing import Any, AsyncIterator, Iterator, List
+
+# An unfinished value longer than this is treated as malformed
+MAX_VALUE_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class InvalidJSON:
+    """Placeholder yielded for a value that could not be parsed."""
+
+    def __init__(self, detail: str):
+        self.detail = detail
+
+
+class _Parser:
+    """
+    Incremental parser for a JSON array or newline-delimited JSON.
+
+    The format is picked from the first non-whitespace character. Text is
+    fed in as it arrives and only the unfinished value is kept buffered.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.mode = None
+        self.state = 'value'
+        self.done = False
+        # Inside an NDJSON line already rejected as too long
+        self.skipping = False
+
+    def feed(self, text: str, final: bool = False) -> List[Any]:
+        if self.done:
+            # Past the end of the array or a syntax error, nothing more is parsed
+            return []
+        self.buffer += text
+        if self.mode is None:
+            stripped = self.buffer.lstrip(_WHITESPACE)
+            if not stripped:
+                self.buffer = ''
+                return []
+            self.mode = 'array' if stripped[0] == '[' else 'ndjson'
+            self.buffer = stripped[1:] if self.mode == 'array' else stripped
+        return list(self._array(final) if self.mode == 'array' else self._lines(final))
+
+    def _lines(self, final: bool) -> Iterator[Any]:
+        *lines, self.buffer = self.buffer.split('\n')
+        if self.skipping:
+            if not lines:
+                self.buffer = ''
+                return
+            # The rest of the line that was too long
+            lines.pop(0)
+            self.skipping = False
+        if final:
+            lines.append(self.buffer)
+            self.buffer = ''
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as error:
+                    yield InvalidJSON(str(error))
+        if len(self.buffer) > MAX_VALUE_SIZE:
+            self.buffer = ''
+            self.skipping = True
+            yield InvalidJSON(f"Line longer than {MAX_VALUE_SIZE} characters")
+
+    def _array(self, final: bool) -> Iterator[Any]:
+        position = 0
+        while not self.done:
+            while position < len(self.buffer) and self.buffer[position] in _WHITESPACE:
+                position += 1
+            if position == len(self.buffer):
+                break
+            char = self.buffer[position]
+            if char == ']':
+                self.done = True
+                position += 1
+            elif self.state == 'separator':
+                if char != ',':
+                    yield self._fail(f"Expected ',' or ']' but found {char!r}")
+                    break
+                self.state = 'value'
+                position += 1
+            else:
+                try:
+                    value, end = _decoder.raw_decode(self.buffer, position)
+                except ValueError as error:
+                    if final or len(self.buffer) - position > MAX_VALUE_SIZE:
+                        yield self._fail(str(error))
+                    break
+                # A number at the end of the buffer may still be growing
+                if end == len(self.buffer) and not final:
+                    break
+                yield value
+                self.state = 'separator'
+                position = end
+        self.buffer = '' if self.done else self.buffer[position:]
+        if final and not self.done:
+            yield self._fail("Unterminated JSON array")
+
+    def _fail(self, detail: str) -> InvalidJSON:
+        # Nothing after a syntax error in an array can be trusted
+        self.done = True
+        return InvalidJSON(detail)
+
+
+async def iter_json_values(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Values of a streamed JSON array or NDJSON body, yielded as they arrive.
+    Unparseable values are yielded as InvalidJSON.
+    """
+    parser = _Parser()
+    text = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    async for chunk in chunks:
+        for value in parser.feed(text.decode(chunk)):
+            yield value
+    for value in parser.feed(text.decode(b'', final=True), final=True):
+        yield value
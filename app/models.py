@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, Index, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -22,6 +22,10 @@ class User(Base):
 # Listening History Model
 class ListeningHistory(Base):
     __tablename__ = "listening_history"
+    __table_args__ = (
+        # Serves a user's history newest first, including keyset pages
+        Index("ix_listening_history_user_listened_at_id", "user_id", "listened_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -36,6 +40,10 @@ class ListeningHistory(Base):
 # Song Model
 class Song(Base):
     __tablename__ = "songs"
+    __table_args__ = (
+        # Serves the song catalog's incremental refresh
+        Index("ix_songs_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
@@ -57,3 +65,64 @@ class UserPreferences(Base):
 
     # Relationships
     user = relationship("User", back_populates="preferences")
+
+# Song Popularity Model
+class SongPopularity(Base):
+    __tablename__ = "song_popularity"
+    __table_args__ = (
+        Index("ix_song_popularity_score", "score"),
+        Index("ix_song_popularity_genre_score", "genre", "score"),
+    )
+
+    song_id = Column(Integer, ForeignKey("songs.id"), primary_key=True)
+    genre = Column(String, nullable=True)
+    plays = Column(Integer, default=0)
+    # Time-decayed play count, scaled to a fixed epoch (see app.recommender.popularity)
+    score = Column(Float, default=0.0)
+    last_played_at = Column(DateTime, nullable=True)
+
+    song = relationship("Song")
+
+# Per user per day listening totals by genre and by artist
+class UserDailyRollup(Base):
+    __tablename__ = "user_daily_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    # 'genre' or 'artist' (see app.recommender.rollups)
+    dimension = Column(String, primary_key=True)
+    # Genre or artist name, '' when the song has none
+    value = Column(String, primary_key=True)
+    plays = Column(Integer, default=0)
+    completed_plays = Column(Integer, default=0)
+    seconds = Column(Float, default=0.0)
+
+# Account of a user at an OAuth provider; a table of its own so existing
+# users tables need no new columns
+class OAuthIdentity(Base):
+    __tablename__ = "oauth_identities"
+    __table_args__ = (UniqueConstraint("provider", "subject"),)
+
+    id = Column(Integer, primary_key=True)
+    provider = Column(String, nullable=False)
+    # The provider's unique id of the account
+    subject = Column(String, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+# Revoked access and refresh tokens, kept until they would have expired
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    # Without AUTOINCREMENT SQLite reuses the ids of deleted rows, which
+    # workers polling past the last id they loaded would never see
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Workers poll for ids above the last one they loaded
+    id = Column(Integer, primary_key=True)
+    # Token id (jti claim); None revokes every token of user_id issued up to revoked_at
+    jti = Column(String, nullable=True)
+    # No foreign key: revocations of a deleted user outlive its row
+    user_id = Column(Integer, nullable=True)
+    # Unix timestamps, comparable with the iat and exp claims
+    revoked_at = Column(Float)
+    expires_at = Column(Float, index=True)
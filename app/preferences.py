@@ -0,0 +1,50 @@
+import os
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.cache import TTLCache
+from app.models import UserPreferences
+from app.schemas import PreferenceResponse
+
+PREFERENCE_CACHE_SIZE = int(os.getenv('PREFERENCE_CACHE_SIZE', 100_000))
+# Invalidation only reaches this process; other workers see a change after the TTL
+PREFERENCE_CACHE_TTL = float(os.getenv('PREFERENCE_CACHE_TTL', 300))
+
+# Keyed and grouped by user_id
+preference_cache = TTLCache(
+    maxsize=PREFERENCE_CACHE_SIZE,
+    ttl=PREFERENCE_CACHE_TTL,
+    group=lambda user_id: user_id
+)
+
+
+def default_preferences(user_id: int) -> PreferenceResponse:
+    """Preferences of a user who has not set any; nothing is stored."""
+    return PreferenceResponse(
+        id=None, user_id=user_id, genre_preference=None, artist_preference=None, language_preference=None
+    )
+
+
+def load_preferences(db: Session, user_id: int) -> PreferenceResponse:
+    row = db.scalar(select(UserPreferences).where(UserPreferences.user_id == user_id))
+    return PreferenceResponse.model_validate(row) if row is not None else default_preferences(user_id)
+
+
+def get_user_preferences(db: Session, user_id: int) -> PreferenceResponse:
+    """A user's preferences behind the preference cache, read-only."""
+    return preference_cache.get_or_set(user_id, lambda: load_preferences(db, user_id))
+
+
+def invalidate_preferences(user_id: int):
+    preference_cache.invalidate_group(user_id)
+
+
+def store_preferences(user_id: int, preferences: PreferenceResponse):
+    """
+    Cache preferences just committed on the primary, so the next read doesn't
+    refill the cache from a replica that hasn't caught up yet.
+    """
+    invalidate_preferences(user_id)
+    # Dropped if another update invalidates the group before this lands
+    preference_cache.set(user_id, preferences, generation=preference_cache.generation(user_id))
@@ -0,0 +1,110 @@
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from app.cache import TTLCache
+from app.models import User
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', 100_000))
+# Entries never outlive their token. Invalidation only reaches this process;
+# other workers see a deactivated or changed user after the TTL
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', 60))
+
+# Session.info key of the users changed in the current transaction, by username
+_CHANGED = 'principals_changed'
+_MISSING = object()
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """The authenticated user as request handlers see it, without a session."""
+    id: int
+    username: str
+    email: Optional[str]
+    is_active: bool
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> 'Principal':
+        return cls(id=user.id, username=user.username, email=user.email,
+                   is_active=user.is_active is not False, created_at=user.created_at)
+
+
+# Keyed by (username, token), grouped by username
+principal_cache = TTLCache(
+    maxsize=PRINCIPAL_CACHE_SIZE,
+    ttl=PRINCIPAL_CACHE_TTL,
+    group=lambda key: key[0]
+)
+# The state of users changed by this worker as committed, None once deleted,
+# keyed by username: a lagging read replica could still return the old row
+committed_principals = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+
+async def get_principal(db: AsyncSession, token: str, username: str, expires_at: Optional[float]) -> Optional[Principal]:
+    """
+    The principal of a decoded token behind the principal cache, or None
+    when the user does not exist. `expires_at` is the token's exp claim.
+    """
+    key = (username, token)
+    principal = principal_cache.get(key)
+    if principal is not None:
+        return principal
+    generation = principal_cache.generation(username)
+    principal = committed_principals.get(username, _MISSING)
+    if principal is _MISSING:
+        user = await db.scalar(select(User).where(User.username == username))
+        principal = Principal.from_user(user) if user is not None else None
+    if principal is None:
+        return None
+    ttl = expires_at - time.time() if expires_at is not None else None
+    principal_cache.set(key, principal, ttl=ttl, generation=generation)
+    return principal
+
+
+def invalidate_principals(username: str):
+    """Drop a user's cached principals; bulk UPDATEs skip the events below and call this."""
+    principal_cache.invalidate_group(username)
+    committed_principals.invalidate(username)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _user_saved(mapper, connection, target):
+    changed = _changed(target)
+    if changed is not None:
+        # A rename invalidates the tokens issued for the old name too
+        changed.update(dict.fromkeys(inspect(target).attrs.username.history.deleted, _MISSING))
+        changed[target.username] = Principal.from_user(target)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    changed = _changed(target)
+    if changed is not None:
+        changed[target.username] = None
+
+
+def _changed(target: User) -> Optional[Dict[str, Any]]:
+    session = object_session(target)
+    return session.info.setdefault(_CHANGED, {}) if session is not None else None
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    # After the commit, so a lookup in between can't cache the old row
+    for username, principal in session.info.pop(_CHANGED, {}).items():
+        invalidate_principals(username)
+        if principal is not _MISSING:
+            committed_principals.set(username, principal)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop(_CHANGED, None)
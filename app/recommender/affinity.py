@@ -0,0 +1,198 @@
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.archive import history_archive
+from app.models import ListeningHistory, UserDailyRollup, UserPreferences
+from app.recommender.catalog import CatalogSnapshot, SongCatalog, UNKNOWN, Vocabulary, normalize_label
+from app.recommender.rollups import RollupDimension
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+@dataclass(frozen=True)
+class AffinityWeights:
+    """Blend of the signals that make up a user's affinity vector."""
+    history_genre: float = field(default_factory=lambda: _env_float('AFFINITY_HISTORY_GENRE_WEIGHT', 1.0))
+    history_artist: float = field(default_factory=lambda: _env_float('AFFINITY_HISTORY_ARTIST_WEIGHT', 0.6))
+    preference_genre: float = field(default_factory=lambda: _env_float('AFFINITY_PREFERENCE_GENRE_WEIGHT', 0.8))
+    preference_artist: float = field(default_factory=lambda: _env_float('AFFINITY_PREFERENCE_ARTIST_WEIGHT', 0.5))
+    # Weight of a play that was not completed relative to a completed one
+    partial_play: float = field(default_factory=lambda: _env_float('AFFINITY_PARTIAL_PLAY_WEIGHT', 0.5))
+    # A play's weight halves every half_life_days
+    half_life_days: float = field(default_factory=lambda: _env_float('AFFINITY_HALF_LIFE_DAYS', 30.0))
+
+
+def _normalized_histogram(codes: np.ndarray, weights: np.ndarray, size: int) -> np.ndarray:
+    known = codes != UNKNOWN
+    histogram = np.bincount(codes[known], weights=weights[known], minlength=size)[:size]
+    total = histogram.sum()
+    return histogram / total if total > 0 else histogram
+
+
+def _preference_vector(codes: np.ndarray, size: int) -> np.ndarray:
+    vector = np.zeros(size, dtype=np.float64)
+    if len(codes):
+        vector[codes] = 1.0 / len(codes)
+    return vector
+
+
+def _blend(
+        catalog: CatalogSnapshot,
+        genre_codes: np.ndarray,
+        genre_weights: np.ndarray,
+        artist_codes: np.ndarray,
+        artist_weights: np.ndarray,
+        genre_preference: Optional[List[str]],
+        artist_preference: Optional[List[str]],
+        weights: AffinityWeights
+) -> np.ndarray:
+    n_genres, n_artists = len(catalog.genres), len(catalog.artists)
+    genre = weights.history_genre * _normalized_histogram(genre_codes, genre_weights, n_genres) \
+        + weights.preference_genre * _preference_vector(catalog.genres.lookup(genre_preference), n_genres)
+    artist = weights.history_artist * _normalized_histogram(artist_codes, artist_weights, n_artists) \
+        + weights.preference_artist * _preference_vector(catalog.artists.lookup(artist_preference), n_artists)
+    return np.concatenate([genre, artist])
+
+
+def _decay(ages_days: np.ndarray, weights: AffinityWeights) -> np.ndarray:
+    return 0.5 ** (np.asarray(ages_days, dtype=np.float64) / weights.half_life_days)
+
+
+def user_affinity(
+        catalog: CatalogSnapshot,
+        history_song_ids: np.ndarray,
+        history_completed: np.ndarray,
+        history_ages_days: np.ndarray,
+        genre_preference: Optional[List[str]] = None,
+        artist_preference: Optional[List[str]] = None,
+        weights: AffinityWeights = None
+) -> np.ndarray:
+    """
+    Affinity vector over [genre codes | artist codes].
+
+    History plays are weighted by completion and exponential recency decay
+    and turned into genre and artist distributions; explicit preferences are
+    spread evenly over the listed genres and artists. Each part is scaled by
+    its weight.
+    """
+    weights = weights or AffinityWeights()
+    positions = catalog.positions(history_song_ids)
+    in_catalog = positions >= 0
+    positions = positions[in_catalog]
+    play_weights = np.where(np.asarray(history_completed, dtype=bool)[in_catalog], 1.0, weights.partial_play)
+    play_weights = play_weights * _decay(np.asarray(history_ages_days)[in_catalog], weights)
+
+    return _blend(
+        catalog, catalog.genre_codes[positions], play_weights, catalog.artist_codes[positions], play_weights,
+        genre_preference, artist_preference, weights
+    )
+
+
+def _codes(vocabulary: Vocabulary, values: Sequence[str]) -> np.ndarray:
+    return np.array([
+        code if (code := vocabulary.codes.get(label)) is not None else UNKNOWN
+        for label in map(normalize_label, values)
+    ], dtype=np.int64)
+
+
+def rollup_affinity(
+        catalog: CatalogSnapshot,
+        dimensions: Sequence[str],
+        values: Sequence[str],
+        plays: np.ndarray,
+        completed_plays: np.ndarray,
+        ages_days: np.ndarray,
+        genre_preference: Optional[List[str]] = None,
+        artist_preference: Optional[List[str]] = None,
+        weights: AffinityWeights = None
+) -> np.ndarray:
+    """user_affinity computed from daily rollup rows instead of individual plays."""
+    weights = weights or AffinityWeights()
+    plays = np.asarray(plays, dtype=np.float64)
+    completed_plays = np.asarray(completed_plays, dtype=np.float64)
+    row_weights = (completed_plays + weights.partial_play * (plays - completed_plays)) * _decay(ages_days, weights)
+
+    dimensions = np.asarray(dimensions, dtype=object)
+    values = np.asarray(values, dtype=object)
+    genres = dimensions == RollupDimension.GENRE
+    artists = dimensions == RollupDimension.ARTIST
+    return _blend(
+        catalog,
+        _codes(catalog.genres, values[genres]), row_weights[genres],
+        _codes(catalog.artists, values[artists]), row_weights[artists],
+        genre_preference, artist_preference, weights
+    )
+
+
+def score_catalog(catalog: CatalogSnapshot, affinity: np.ndarray, exclude_song_ids: np.ndarray) -> np.ndarray:
+    """Score of every catalog song: one sparse product of the song features with the affinity."""
+    scores = catalog.features @ affinity
+    excluded = catalog.positions(exclude_song_ids)
+    scores[excluded[excluded >= 0]] = -np.inf
+    return scores
+
+
+def top_song_ids(catalog: CatalogSnapshot, scores: np.ndarray, limit: int) -> List[int]:
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > limit:
+        candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+    order = candidates[np.lexsort((candidates, -scores[candidates]))]
+    return catalog.song_ids[order].tolist()
+
+
+def recommend(
+        db: Session,
+        catalog: SongCatalog,
+        user_id: int,
+        limit: int,
+        weights: AffinityWeights = None,
+        now: datetime = None,
+        preferences: Tuple[Optional[List[str]], Optional[List[str]]] = None
+) -> List[int]:
+    """
+    Ids of the best scoring unheard songs for a user, empty if nothing is
+    known about them. Listening history is read from the daily rollups;
+    `preferences` (genres, artists) are read from the table if not given.
+    """
+    # One snapshot for the whole call: a refresh may publish another meanwhile
+    snapshot = catalog.snapshot
+    now = now or datetime.now()
+    rollups = db.execute(
+        select(UserDailyRollup.dimension, UserDailyRollup.value, UserDailyRollup.plays,
+               UserDailyRollup.completed_plays, UserDailyRollup.day)
+        .where(UserDailyRollup.user_id == user_id)
+    ).all()
+    if preferences is None:
+        preferences = db.execute(
+            select(UserPreferences.genre_preference, UserPreferences.artist_preference)
+            .where(UserPreferences.user_id == user_id)
+        ).first()
+    genre_preference, artist_preference = preferences or (None, None)
+    if not rollups and not genre_preference and not artist_preference:
+        return []
+
+    heard = np.array(db.scalars(
+        select(ListeningHistory.song_id).distinct()
+        .where(ListeningHistory.user_id == user_id, ListeningHistory.song_id.isnot(None))
+    ).all(), dtype=np.int64)
+    heard = np.union1d(heard, history_archive.song_ids(user_id))
+    # A day's plays are treated as made at midday
+    ages = np.array([
+        max((now - datetime.combine(row[4], time(12))).total_seconds(), 0.0) / 86_400 for row in rollups
+    ], dtype=np.float64)
+
+    affinity = rollup_affinity(
+        snapshot,
+        [row[0] for row in rollups], [row[1] for row in rollups],
+        [row[2] for row in rollups], [row[3] for row in rollups], ages,
+        genre_preference, artist_preference, weights
+    )
+    return top_song_ids(snapshot, score_catalog(snapshot, affinity, heard), limit)
@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models import Song
+from app.recommender.features import load_song_features, song_vector
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the content index is rebuilt to pick up new songs
+CONTENT_INDEX_MAX_AGE = float(os.getenv('CONTENT_INDEX_MAX_AGE', 3600))
+
+LSH_TABLES = 8
+LSH_BITS = 16
+# Extra buckets probed per table, flipping the least certain bits
+LSH_PROBES = 2
+HASH_CHUNK_SIZE = 100_000
+# Below this many vectors an exact scan is as fast as probing buckets
+EXACT_SEARCH_THRESHOLD = 20_000
+
+
+class LSHIndex:
+    """
+    Random-projection LSH over unit vectors for approximate cosine search.
+
+    Each of `n_tables` tables hashes a vector to the signs of its projections
+    on `n_bits` random hyperplanes. Buckets are stored as one sorted code
+    array per table, so a lookup is two binary searches; the union of the
+    probed buckets is then re-ranked exactly.
+    """
+
+    def __init__(self, vectors: np.ndarray, n_tables: int = LSH_TABLES, n_bits: int = LSH_BITS,
+                 n_probes: int = LSH_PROBES, seed: int = 0, exact_threshold: int = EXACT_SEARCH_THRESHOLD):
+        self.vectors = vectors
+        self.exact = len(vectors) <= exact_threshold
+        self.n_probes = min(n_probes, n_bits)
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((n_tables, n_bits, vectors.shape[1])).astype(np.float32)
+        self._powers = np.left_shift(1, np.arange(n_bits, dtype=np.int64))
+
+        codes = np.empty((n_tables, len(vectors)), dtype=np.int64)
+        for start in range(0, len(vectors), HASH_CHUNK_SIZE):
+            chunk = vectors[start:start + HASH_CHUNK_SIZE]
+            projections = np.einsum('tbd,md->tmb', self.planes, chunk)
+            codes[:, start:start + len(chunk)] = (projections > 0).astype(np.int64) @ self._powers
+        self._order = np.argsort(codes, axis=1, kind='stable')
+        self._sorted_codes = np.take_along_axis(codes, self._order, axis=1)
+
+    def candidates(self, vector: np.ndarray) -> np.ndarray:
+        """Positions sharing a probed bucket with `vector` in any table."""
+        projections = self.planes @ vector
+        codes = (projections > 0).astype(np.int64) @ self._powers
+        probes = [codes]
+        if self.n_probes:
+            uncertain = np.argsort(np.abs(projections), axis=1)[:, :self.n_probes]
+            for bit in uncertain.T:
+                probes.append(codes ^ self._powers[bit])
+
+        found = []
+        for table in range(len(self.planes)):
+            sorted_codes = self._sorted_codes[table]
+            for probe in probes:
+                low = np.searchsorted(sorted_codes, probe[table], side='left')
+                high = np.searchsorted(sorted_codes, probe[table], side='right')
+                if high > low:
+                    found.append(self._order[table, low:high])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def query(self, vector: np.ndarray, k: int, exclude: Iterable[int] = ()) -> np.ndarray:
+        """Positions of the (approximately) k most similar vectors, best first."""
+        candidates = np.arange(len(self.vectors)) if self.exact else self.candidates(vector)
+        exclude = np.fromiter(exclude, dtype=np.int64)
+        if len(exclude):
+            candidates = candidates[~np.isin(candidates, exclude)]
+        if not len(candidates) or k <= 0:
+            return candidates[:0]
+        similarity = self.vectors[candidates] @ vector
+        if len(candidates) > k:
+            top = np.argpartition(-similarity, k - 1)[:k]
+            candidates, similarity = candidates[top], similarity[top]
+        return candidates[np.lexsort((candidates, -similarity))]
+
+
+class ContentIndex:
+    """
+    Song feature vectors and their LSH index. start() builds it in the
+    background when a worker starts; once it is older than `max_age`
+    seconds, requests keep using it while a background thread rebuilds it.
+    """
+
+    def __init__(self, max_age: float = CONTENT_INDEX_MAX_AGE, name: str = 'content-index'):
+        self.max_age = max_age
+        self.name = name
+        # Held for the whole of a build, so only one runs at a time
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._state = None
+        self._session_factory: Optional[Callable[[], Session]] = None
+
+    def ensure_loaded(self, db: Session):
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self.load(db)
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            self.start()
+
+    def load(self, db: Session):
+        song_ids, vectors = load_song_features(db)
+        self._state = (song_ids, vectors, LSHIndex(vectors))
+        self._loaded_at = time.monotonic()
+
+    def start(self, session_factory: Optional[Callable[[], Session]] = None) -> bool:
+        """(Re)build the index in a background thread, unless a build is running."""
+        if not self._lock.acquire(blocking=False):
+            return False
+        if session_factory is not None:
+            self._session_factory = session_factory
+        elif self._session_factory is not None:
+            session_factory = self._session_factory
+        else:
+            from app.database import ReadSessionLocal as session_factory
+
+        def build():
+            try:
+                with session_factory() as db:
+                    self.load(db)
+            except Exception:
+                # Try again after another max_age rather than on every request
+                self._loaded_at = time.monotonic()
+                logger.exception(f"{self.name}: failed to build the content index")
+            finally:
+                self._lock.release()
+
+        threading.Thread(target=build, name=self.name, daemon=True).start()
+        return True
+
+    def vector(self, song_id: int) -> Optional[np.ndarray]:
+        song_ids, vectors, _ = self._state
+        position = np.searchsorted(song_ids, song_id)
+        if position < len(song_ids) and song_ids[position] == song_id:
+            return vectors[position]
+        return None
+
+    def mean_vector(self, song_ids: Iterable[int]) -> Optional[np.ndarray]:
+        """Normalised centroid of the given songs' vectors."""
+        catalog_ids, vectors, _ = self._state
+        song_ids = np.fromiter(song_ids, dtype=np.int64)
+        positions = np.searchsorted(catalog_ids, song_ids)
+        found = positions < len(catalog_ids)
+        found[found] = catalog_ids[positions[found]] == song_ids[found]
+        if not found.any():
+            return None
+        centroid = vectors[positions[found]].mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        return centroid / norm if norm > 0 else None
+
+    def query(self, vector: np.ndarray, limit: int, exclude_song_ids: Iterable[int] = ()) -> List[int]:
+        song_ids, _, index = self._state
+        exclude = np.fromiter(exclude_song_ids, dtype=np.int64)
+        positions = np.searchsorted(song_ids, exclude)
+        found = positions < len(song_ids)
+        found[found] = song_ids[positions[found]] == exclude[found]
+        return song_ids[index.query(vector, limit, positions[found])].tolist()
+
+    def similar(self, song_id: int, limit: int, db: Optional[Session] = None) -> Optional[List[int]]:
+        """
+        Songs most similar to `song_id`, or None if it is not indexed. With
+        `db`, songs added since the last build are vectorized from their row.
+        """
+        vector = self.vector(song_id)
+        if vector is None and db is not None:
+            song = db.get(Song, song_id)
+            vector = song_vector(song) if song is not None else None
+        if vector is None:
+            return None
+        return self.query(vector, limit, exclude_song_ids=[song_id])
+
+
+content_index = ContentIndex()
@@ -0,0 +1,134 @@
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Union
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import User
+from app.recommender.interactions import interaction_matrix
+
+# Upper bound on users x songs score cells held in memory at once
+SCORE_CELL_BUDGET = 32_000_000
+USER_ID_BATCH_SIZE = 10_000
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indexes of the k best positive scores of every row, best first (-1 pads)."""
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    if k <= 0:
+        return np.full((n_rows, 0), -1, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top[np.take_along_axis(top_scores, order, axis=1) <= 0] = -1
+    return top
+
+
+def iter_all_user_ids(db: Session) -> Iterator[int]:
+    """Every user id, fetched in keyset pages."""
+    last_id = 0
+    while True:
+        page = db.scalars(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(USER_ID_BATCH_SIZE)
+        ).all()
+        if not page:
+            return
+        yield from page
+        last_id = page[-1]
+
+
+def _chunks(user_ids: Iterable[int], size: int) -> Iterator[List[int]]:
+    chunk = []
+    for user_id in user_ids:
+        chunk.append(user_id)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_batch_recommendations(
+        db: Session,
+        user_ids: Union[Iterable[int], str],
+        limit: int = 10
+) -> Iterator[Dict]:
+    """
+    Collaborative recommendations for many users.
+
+    Users are scored a block at a time with sparse matrix products against
+    the shared interaction matrix, so the history of the whole batch is read
+    with at most one scan of listening_history (when the matrix is not
+    loaded yet) instead of per-user queries. Users without plays get the
+    cold-start list.
+    """
+    from recommendations import (
+        _cold_start_recommendations, get_recommendations_based_on_history, RecommendationEngine
+    )
+
+    interaction_matrix.ensure_loaded(db)
+    if user_ids == 'all':
+        user_ids = iter_all_user_ids(db)
+
+    cold_start = [song.id for song in _cold_start_recommendations(db, limit)]
+    _, n_songs = interaction_matrix.shape
+    block_size = max(1, SCORE_CELL_BUDGET // max(n_songs, 1))
+
+    for block in _chunks(user_ids, block_size):
+        scores, known, song_ids = interaction_matrix.scores_many(block)
+        top = top_k_rows(scores, limit)
+        for user_id, has_plays, columns in zip(block, known, top):
+            columns = columns[columns >= 0]
+            if len(columns):
+                recommended = song_ids[columns].tolist()
+            elif has_plays:
+                # Nothing co-listened; use the genre based engine for this user
+                recommended = [song.id for song in get_recommendations_based_on_history(
+                    db, user_id, limit, RecommendationEngine.SET_BASED
+                )]
+            else:
+                recommended = list(cold_start)
+            yield {'user_id': user_id, 'song_ids': recommended}
+
+
+def stream_batch_recommendations(user_ids: Union[List[int], str], limit: int = 10) -> Iterator[str]:
+    """NDJSON lines for iter_batch_recommendations, using a session of its own."""
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for result in iter_batch_recommendations(db, user_ids, limit):
+            yield json.dumps(result) + '\n'
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write recommendations for many users as NDJSON")
+    parser.add_argument('--users', default='all', help="'all' or a comma separated list of user ids")
+    parser.add_argument('--limit', type=int, default=10, help="Recommendations per user")
+    parser.add_argument('--output', default='-', help="Output file, '-' for stdout")
+    args = parser.parse_args()
+
+    user_ids = 'all' if args.users == 'all' else [int(u) for u in args.users.split(',') if u]
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    started = time.perf_counter()
+    count = 0
+    try:
+        for line in stream_batch_recommendations(user_ids, args.limit):
+            output.write(line)
+            count += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Wrote recommendations for {count} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
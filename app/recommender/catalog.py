@@ -0,0 +1,284 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from app.models import Song
+
+# Seconds before the snapshot is rebuilt from scratch, picking up edited and deleted songs
+SONG_CATALOG_MAX_AGE = float(os.getenv('SONG_CATALOG_MAX_AGE', 3600))
+# Seconds between incremental refreshes, which only add songs past the id watermark
+SONG_CATALOG_REFRESH_INTERVAL = float(os.getenv('SONG_CATALOG_REFRESH_INTERVAL', 60))
+# Seconds of recently created songs re-read by each refresh, catching ids that commit out of order
+SONG_CATALOG_REFRESH_OVERLAP = float(os.getenv('SONG_CATALOG_REFRESH_OVERLAP', 300))
+
+LOAD_BATCH_SIZE = 100_000
+UNKNOWN = -1
+CODE_DTYPE = np.int32
+
+
+def normalize_label(value: Optional[str]) -> Optional[str]:
+    """Genre/artist labels are matched case-insensitively."""
+    if value is None:
+        return None
+    value = value.strip().lower()
+    return value or None
+
+
+class Vocabulary:
+    """Dictionary encoding of genre or artist labels to dense integer codes."""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.labels: List[str] = []
+
+    def __len__(self):
+        return len(self.labels)
+
+    def encode(self, value: Optional[str]) -> int:
+        label = normalize_label(value)
+        if label is None:
+            return UNKNOWN
+        code = self.codes.get(label)
+        if code is None:
+            code = self.codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def copy(self) -> 'Vocabulary':
+        vocabulary = Vocabulary()
+        vocabulary.codes, vocabulary.labels = dict(self.codes), list(self.labels)
+        return vocabulary
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the labels and the code dictionary."""
+        return sys.getsizeof(self.codes) + sys.getsizeof(self.labels) + \
+            sum(sys.getsizeof(label) for label in self.labels)
+
+    def lookup(self, values: Iterable[Optional[str]]) -> np.ndarray:
+        """Codes of already known labels; unknown labels are skipped."""
+        codes = [self.codes.get(normalize_label(v)) for v in values or ()]
+        return np.array([c for c in codes if c is not None], dtype=np.int64)
+
+
+COLUMNS = {
+    'song_ids': np.int64,
+    'genre_codes': CODE_DTYPE,
+    'artist_codes': CODE_DTYPE,
+    # UNKNOWN for songs without a duration
+    'durations': np.int32,
+    # NaT for songs without a creation time
+    'created_at': 'datetime64[us]',
+}
+
+
+class CatalogSnapshot:
+    """
+    One immutable version of the catalog: sorted song ids with their genre
+    and artist codes, durations and creation times, the vocabularies of
+    those codes, plus a sparse one-hot matrix over [genre codes | artist
+    codes] for scoring the whole catalog with a single sparse product.
+
+    A refresh builds a new snapshot rather than changing this one, so a
+    reader that took a snapshot sees consistent columns and matrix shape.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], genres: Vocabulary, artists: Vocabulary,
+                 watermark: Optional[int]):
+        self.genres = genres
+        self.artists = artists
+        self.watermark = watermark
+        for name in COLUMNS:
+            values = columns[name]
+            values.flags.writeable = False
+            setattr(self, name, values)
+        self._features = None
+
+    @classmethod
+    def empty(cls) -> 'CatalogSnapshot':
+        return cls({name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()},
+                   Vocabulary(), Vocabulary(), None)
+
+    def __len__(self):
+        return len(self.song_ids)
+
+    @property
+    def features(self) -> sparse.csr_matrix:
+        """songs x (genres + artists) one-hot matrix, built on first use"""
+        if self._features is None:
+            n = len(self.song_ids)
+            rows = np.concatenate([np.arange(n), np.arange(n)])
+            cols = np.concatenate([self.genre_codes, len(self.genres) + self.artist_codes])
+            known = np.concatenate([self.genre_codes, self.artist_codes]) != UNKNOWN
+            # Concurrent first uses may both build it; either result is the same
+            self._features = sparse.csr_matrix(
+                (np.ones(known.sum(), dtype=np.float32), (rows[known], cols[known])),
+                shape=(n, len(self.genres) + len(self.artists))
+            )
+        return self._features
+
+    def positions(self, song_ids: np.ndarray) -> np.ndarray:
+        """Snapshot positions of song ids, -1 for songs not in it."""
+        song_ids = np.asarray(song_ids, dtype=np.int64)
+        if not len(self.song_ids):
+            return np.full(len(song_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.song_ids, song_ids), len(self.song_ids) - 1)
+        return np.where(self.song_ids[positions] == song_ids, positions, -1)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Bytes per column, vocabulary and the feature matrix (once built)."""
+        usage = {name: getattr(self, name).nbytes for name in COLUMNS}
+        usage['genre_vocabulary'] = self.genres.memory_usage()
+        usage['artist_vocabulary'] = self.artists.memory_usage()
+        if self._features is not None:
+            usage['features'] = self._features.data.nbytes + self._features.indices.nbytes + \
+                self._features.indptr.nbytes
+        return usage
+
+
+class SongCatalog:
+    """
+    In-memory copy of the songs table, published as a CatalogSnapshot.
+
+    Readers take `snapshot` once and use only that object; load() and
+    refresh() replace it with a single assignment. Refreshes read songs
+    past the id watermark of the snapshot plus those created in the last
+    SONG_CATALOG_REFRESH_OVERLAP seconds, and add the ones it lacks; a
+    full reload every max_age seconds catches edits and deletions.
+    """
+
+    def __init__(self, max_age: float = SONG_CATALOG_MAX_AGE,
+                 refresh_interval: float = SONG_CATALOG_REFRESH_INTERVAL):
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._refreshed_at = None
+        self.snapshot = CatalogSnapshot.empty()
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def _stale(self) -> Optional[str]:
+        now = time.monotonic()
+        if self._loaded_at is None or now - self._loaded_at > self.max_age:
+            return 'load'
+        if now - self._refreshed_at > self.refresh_interval:
+            return 'refresh'
+        return None
+
+    def ensure_loaded(self, db: Session) -> CatalogSnapshot:
+        """The current snapshot, loaded or refreshed first when due."""
+        if self._stale() is not None:
+            with self._lock:
+                stale = self._stale()
+                if stale == 'load':
+                    self.load(db)
+                elif stale == 'refresh':
+                    self.refresh(db)
+        return self.snapshot
+
+    @staticmethod
+    def _read(db: Session, query, genres: Vocabulary, artists: Vocabulary) -> Dict[str, np.ndarray]:
+        """Columns of the songs selected by `query`, encoding their labels into the vocabularies."""
+        parts = {name: [] for name in COLUMNS}
+        result = db.execute(query.execution_options(yield_per=LOAD_BATCH_SIZE))
+        for partition in result.partitions():
+            count = len(partition)
+            parts['song_ids'].append(np.fromiter((row.id for row in partition), dtype=np.int64, count=count))
+            parts['genre_codes'].append(np.fromiter(
+                (genres.encode(row.genre) for row in partition), dtype=CODE_DTYPE, count=count
+            ))
+            parts['artist_codes'].append(np.fromiter(
+                (artists.encode(row.artist) for row in partition), dtype=CODE_DTYPE, count=count
+            ))
+            parts['durations'].append(np.fromiter(
+                (UNKNOWN if row.duration is None else row.duration for row in partition), dtype=np.int32, count=count
+            ))
+            parts['created_at'].append(np.array([row.created_at for row in partition], dtype='datetime64[us]'))
+        return {
+            name: np.concatenate(parts[name]) if parts[name] else np.zeros(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+
+    @staticmethod
+    def _watermark(columns: Dict[str, np.ndarray]) -> Optional[int]:
+        """Greatest id among the columns' songs."""
+        if not len(columns['song_ids']):
+            return None
+        return int(columns['song_ids'].max())
+
+    def load(self, db: Session):
+        genres, artists = Vocabulary(), Vocabulary()
+        columns = self._read(
+            db, select(Song.id, Song.genre, Song.artist, Song.duration, Song.created_at).order_by(Song.id),
+            genres, artists
+        )
+        self.snapshot = CatalogSnapshot(columns, genres, artists, self._watermark(columns))
+        self._loaded_at = self._refreshed_at = time.monotonic()
+
+    def refresh(self, db: Session) -> int:
+        """Add the songs missing from the snapshot; returns how many were added."""
+        current = self.snapshot
+        query = select(Song.id, Song.genre, Song.artist, Song.duration, Song.created_at)
+        if current.watermark is not None:
+            # Timestamps come from the app clock and ids may commit out of order, so
+            # neither alone is a safe watermark; recently created songs are read again
+            overlap = datetime.now() - timedelta(seconds=SONG_CATALOG_REFRESH_OVERLAP)
+            query = query.where(or_(Song.id > current.watermark, Song.created_at > overlap))
+        # Readers may hold the current vocabularies, so new labels go into copies
+        genres, artists = current.genres.copy(), current.artists.copy()
+        read = self._read(db, query.order_by(Song.id), genres, artists)
+        self._refreshed_at = time.monotonic()
+        missing = current.positions(read['song_ids']) < 0
+        if not missing.any():
+            return 0
+
+        new = {name: read[name][missing] for name in COLUMNS}
+        columns = {name: np.concatenate([getattr(current, name), new[name]]) for name in COLUMNS}
+        order = np.argsort(columns['song_ids'], kind='stable')
+        columns = {name: values[order] for name, values in columns.items()}
+        watermark = max(filter(None, [current.watermark, self._watermark(new)]))
+        self.snapshot = CatalogSnapshot(columns, genres, artists, watermark)
+        return len(new['song_ids'])
+
+
+song_catalog = SongCatalog()
+
+
+def main():
+    from app.database import ReadSessionLocal
+
+    parser = argparse.ArgumentParser(description="Load the song catalog snapshot and report its memory use")
+    parser.parse_args()
+
+    started = time.perf_counter()
+    db = ReadSessionLocal()
+    try:
+        song_catalog.load(db)
+    finally:
+        db.close()
+    snapshot = song_catalog.snapshot
+    # Built on first use; included in the report
+    snapshot.features
+    elapsed = time.perf_counter() - started
+
+    songs = len(snapshot)
+    usage = snapshot.memory_usage()
+    print(f"Loaded {songs} songs, {len(snapshot.genres)} genres and {len(snapshot.artists)} artists "
+          f"in {elapsed:.1f}s")
+    for name, size in {**usage, 'total': sum(usage.values())}.items():
+        per_million = f"{size / songs * 1e6 / 2 ** 20:10.1f} MiB per million songs" if songs else ""
+        print(f"{name:20} {size / 2 ** 20:10.1f} MiB  {per_million}")
+
+
+if __name__ == "__main__":
+    main()
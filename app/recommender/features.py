@@ -0,0 +1,92 @@
+import re
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import Song
+from app.recommender.catalog import normalize_label
+
+FEATURE_DIM = 128
+LOAD_BATCH_SIZE = 50_000
+
+# Relative weight of each metadata field in a song vector
+FIELD_WEIGHTS = {
+    'genre': 1.0,
+    'artist': 1.0,
+    'album': 0.7,
+    'title': 0.3,
+    'duration': 0.3,
+}
+# Upper bounds (seconds) of the duration buckets
+DURATION_BUCKETS = (120, 180, 240, 300, 420, 600)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def _hashed(field: str, value: str) -> Tuple[int, float]:
+    """Stable feature index and sign of a field value (the hashing trick)."""
+    digest = zlib.crc32(f"{field}:{value}".encode('utf-8'))
+    return digest % FEATURE_DIM, 1.0 if digest & 0x80000000 else -1.0
+
+
+def song_tokens(
+        title: Optional[str] = None,
+        artist: Optional[str] = None,
+        album: Optional[str] = None,
+        genre: Optional[str] = None,
+        duration: Optional[int] = None
+) -> List[Tuple[str, str]]:
+    """(field, value) pairs that describe a song."""
+    tokens = []
+    for field, value in (('genre', genre), ('artist', artist), ('album', album)):
+        label = normalize_label(value)
+        if label:
+            tokens.append((field, label))
+    for word in _TOKEN.findall((title or '').lower()):
+        tokens.append(('title', word))
+    if duration:
+        bucket = int(np.searchsorted(DURATION_BUCKETS, duration))
+        tokens.append(('duration', str(bucket)))
+    return tokens
+
+
+def vectorize(tokens: Iterable[Tuple[str, str]], out: np.ndarray = None) -> np.ndarray:
+    """L2-normalised float32 feature vector of a list of (field, value) pairs."""
+    vector = np.zeros(FEATURE_DIM, dtype=np.float32) if out is None else out
+    for field, value in tokens:
+        index, sign = _hashed(field, value)
+        vector[index] += sign * FIELD_WEIGHTS[field]
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def song_vector(song: Song) -> np.ndarray:
+    return vectorize(song_tokens(song.title, song.artist, song.album, song.genre, song.duration))
+
+
+def load_song_features(db: Session) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sorted song ids and a contiguous (songs x FEATURE_DIM) float32 array of
+    their feature vectors.
+    """
+    blocks_ids, blocks_vectors = [], []
+    result = db.execute(
+        select(Song.id, Song.title, Song.artist, Song.album, Song.genre, Song.duration)
+        .order_by(Song.id)
+        .execution_options(yield_per=LOAD_BATCH_SIZE)
+    )
+    for partition in result.partitions():
+        vectors = np.zeros((len(partition), FEATURE_DIM), dtype=np.float32)
+        for row, (_, title, artist, album, genre, duration) in enumerate(partition):
+            vectorize(song_tokens(title, artist, album, genre, duration), out=vectors[row])
+        blocks_ids.append(np.fromiter((row[0] for row in partition), dtype=np.int64, count=len(partition)))
+        blocks_vectors.append(vectors)
+
+    if not blocks_ids:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, FEATURE_DIM), dtype=np.float32)
+    return np.concatenate(blocks_ids), np.ascontiguousarray(np.concatenate(blocks_vectors))
@@ -0,0 +1,296 @@
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.archive import history_archive
+from app.models import ListeningHistory
+
+# Interaction weights
+COMPLETED_WEIGHT = 1.0
+PARTIAL_WEIGHT = 0.5
+
+# Number of new (user, song) pairs kept outside the CSR arrays before merging
+COMPACT_THRESHOLD = 10_000
+
+LOAD_BATCH_SIZE = 50_000
+
+
+def interaction_weight(completed: bool) -> float:
+    return COMPLETED_WEIGHT if completed else PARTIAL_WEIGHT
+
+
+class InteractionMatrix:
+    """
+    User x song matrix of listening weights used for item-item collaborative
+    filtering.
+
+    The matrix is loaded once from listening_history and then kept up to date
+    with record(). Plays of a (user, song) pair already in the matrix update
+    the CSR data array in place; new pairs are held in a small pending set and
+    merged into the CSR arrays once COMPACT_THRESHOLD of them have piled up.
+    Plays recorded while a load is running are buffered and applied once
+    the new matrix is in place, as the load's query may not have seen them.
+    """
+
+    def __init__(self, compact_threshold: int = COMPACT_THRESHOLD):
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        # Serialises loads without holding up record()
+        self._load_lock = threading.RLock()
+        self._loaded = False
+        self._loading = False
+        self._buffered: List[Tuple[int, int, bool]] = []
+        self._reset()
+
+    def _reset(self):
+        self._user_index: Dict[int, int] = {}
+        self._song_index: Dict[int, int] = {}
+        self._song_ids: List[int] = []
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float64)
+        self._col_sq = np.zeros(0, dtype=np.float64)
+        self._pending: Dict[Tuple[int, int], float] = {}
+        self._pending_matrix = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self._user_index), len(self._song_ids)
+
+    def ensure_loaded(self, db: Session):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load(db)
+
+    def load(self, db: Session):
+        """(Re)build the matrix from the listening_history table and its archive."""
+        with self._load_lock:
+            with self._lock:
+                self._loading = True
+                self._buffered = []
+            try:
+                matrix, unique_users, unique_songs = self._read(db)
+            except BaseException:
+                with self._lock:
+                    # A failed reload keeps the current matrix, which still needs the plays
+                    self._loading = False
+                    buffered, self._buffered = self._buffered, []
+                    if self._loaded:
+                        for play in buffered:
+                            self._record(*play)
+                raise
+
+            with self._lock:
+                self._reset()
+                self._user_index = {int(u): i for i, u in enumerate(unique_users)}
+                self._song_ids = [int(s) for s in unique_songs]
+                self._song_index = {s: i for i, s in enumerate(self._song_ids)}
+                self._matrix = matrix
+                self._col_sq = np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()
+                self._loaded = True
+                self._loading = False
+                buffered, self._buffered = self._buffered, []
+                for play in buffered:
+                    self._record(*play)
+
+    def _read(self, db: Session):
+        users, songs, weights = [], [], []
+        result = db.execute(
+            select(ListeningHistory.user_id, ListeningHistory.song_id, ListeningHistory.completed)
+            .where(ListeningHistory.user_id.isnot(None), ListeningHistory.song_id.isnot(None))
+            .execution_options(yield_per=LOAD_BATCH_SIZE)
+        )
+        for partition in result.partitions():
+            batch = np.array(partition, dtype=object).reshape(-1, 3)
+            users.append(batch[:, 0].astype(np.int64))
+            songs.append(batch[:, 1].astype(np.int64))
+            weights.append(np.where(batch[:, 2].astype(bool), COMPLETED_WEIGHT, PARTIAL_WEIGHT))
+        for archived in history_archive.scan(['user_id', 'song_id', 'completed']):
+            with_song = archived['song_id'] >= 0
+            users.append(archived['user_id'][with_song])
+            songs.append(archived['song_id'][with_song])
+            weights.append(np.where(archived['completed'][with_song] > 0, COMPLETED_WEIGHT, PARTIAL_WEIGHT))
+
+        user_ids = np.concatenate(users) if users else np.zeros(0, dtype=np.int64)
+        song_ids = np.concatenate(songs) if songs else np.zeros(0, dtype=np.int64)
+        data = np.concatenate(weights) if weights else np.zeros(0, dtype=np.float64)
+
+        unique_users, rows = np.unique(user_ids, return_inverse=True)
+        unique_songs, cols = np.unique(song_ids, return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (data, (rows, cols)), shape=(len(unique_users), len(unique_songs)), dtype=np.float64
+        )
+        matrix.sum_duplicates()
+        return matrix, unique_users, unique_songs
+
+    def record(self, user_id: int, song_id: int, completed: bool):
+        """Add a single play to the matrix without rebuilding it."""
+        with self._lock:
+            if self._loading:
+                self._buffered.append((user_id, song_id, completed))
+            elif self._loaded:
+                self._record(user_id, song_id, completed)
+            # Otherwise the play will be picked up when the matrix is first loaded
+
+    def _record(self, user_id: int, song_id: int, completed: bool):
+        """record() with the lock held."""
+        row = self._user_index.setdefault(user_id, len(self._user_index))
+        col = self._song_index.get(song_id)
+        if col is None:
+            col = len(self._song_ids)
+            self._song_index[song_id] = col
+            self._song_ids.append(song_id)
+            self._col_sq = np.append(self._col_sq, 0.0)
+
+        weight = interaction_weight(completed)
+        position = self._find(row, col)
+        if position is not None:
+            old = self._matrix.data[position]
+            self._matrix.data[position] = old + weight
+        else:
+            old = self._pending.get((row, col), 0.0)
+            self._pending[(row, col)] = old + weight
+            self._pending_matrix = None
+        self._col_sq[col] += (old + weight) ** 2 - old ** 2
+
+        if len(self._pending) >= self.compact_threshold:
+            self._compact()
+
+    def _find(self, row: int, col: int):
+        """Position of (row, col) in the CSR data array, if stored."""
+        matrix = self._matrix
+        if row >= matrix.shape[0] or col >= matrix.shape[1]:
+            return None
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        position = start + np.searchsorted(matrix.indices[start:end], col)
+        if position < end and matrix.indices[position] == col:
+            return position
+        return None
+
+    def _pending_csr(self):
+        if self._pending_matrix is None:
+            n_users, n_songs = self.shape
+            if self._pending:
+                keys = np.array(list(self._pending.keys()), dtype=np.int64)
+                values = np.fromiter(self._pending.values(), dtype=np.float64, count=len(self._pending))
+                self._pending_matrix = sparse.csr_matrix(
+                    (values, (keys[:, 0], keys[:, 1])), shape=(n_users, n_songs)
+                )
+            else:
+                self._pending_matrix = sparse.csr_matrix((n_users, n_songs), dtype=np.float64)
+        return self._pending_matrix
+
+    def _compact(self):
+        """Merge pending pairs into the CSR arrays."""
+        n_users, n_songs = self.shape
+        matrix = self._matrix.copy()
+        matrix.resize((n_users, n_songs))
+        self._matrix = (matrix + self._pending_csr()).tocsr()
+        self._matrix.sort_indices()
+        self._pending = {}
+        self._pending_matrix = None
+
+    def snapshot(self) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """Copy of the full matrix and the song id of each column."""
+        with self._lock:
+            if self._pending:
+                self._compact()
+            return self._matrix.copy(), np.array(self._song_ids, dtype=np.int64)
+
+    def _matvec(self, song_vector: np.ndarray) -> np.ndarray:
+        """(matrix + pending) @ song_vector"""
+        n_users, _ = self.shape
+        rows, cols = self._matrix.shape
+        result = np.zeros(n_users, dtype=np.float64)
+        result[:rows] = self._matrix @ song_vector[:cols]
+        if self._pending:
+            result += self._pending_csr() @ song_vector
+        return result
+
+    def _rmatvec(self, user_vector: np.ndarray) -> np.ndarray:
+        """(matrix + pending).T @ user_vector"""
+        _, n_songs = self.shape
+        rows, cols = self._matrix.shape
+        result = np.zeros(n_songs, dtype=np.float64)
+        result[:cols] = self._matrix.T @ user_vector[:rows]
+        if self._pending:
+            result += self._pending_csr().T @ user_vector
+        return result
+
+    def scores(self, user_id: int):
+        """
+        Item-item cosine scores of every song for a user, or None if the user
+        has no plays. Already heard songs score -inf.
+
+        With X the matrix, D the inverse column norms and r the user's row,
+        the scores are D X^T X D r, computed as two sparse products so the
+        song x song similarity matrix is never materialised.
+        """
+        with self._lock:
+            row = self._user_index.get(user_id)
+            if row is None:
+                return None
+            n_users, _ = self.shape
+            selector = np.zeros(n_users, dtype=np.float64)
+            selector[row] = 1.0
+            listened = self._rmatvec(selector)
+
+            norms = np.sqrt(self._col_sq)
+            inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+            scores = inverse * self._rmatvec(self._matvec(inverse * listened))
+            scores[listened > 0] = -np.inf
+            return scores
+
+    def scores_many(self, user_ids: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        scores() for a block of users at once, as one users x songs array.
+        Returns the scores, a mask of users with plays and the song id of
+        each column.
+        """
+        with self._lock:
+            if self._pending:
+                self._compact()
+            # record() updates the data array in place, so the block product
+            # below runs on a copy of it, outside the lock
+            matrix = sparse.csr_matrix((self._matrix.data.copy(), self._matrix.indices, self._matrix.indptr),
+                                       shape=self._matrix.shape)
+            col_sq = self._col_sq[:matrix.shape[1]].copy()
+            song_ids = np.array(self._song_ids[:matrix.shape[1]], dtype=np.int64)
+            rows = np.array([self._user_index.get(u, -1) for u in user_ids], dtype=np.int64)
+
+        known = rows >= 0
+        selector = sparse.csr_matrix(
+            (np.ones(known.sum()), (np.flatnonzero(known), rows[known])),
+            shape=(len(user_ids), matrix.shape[0])
+        )
+        listened = (selector @ matrix).tocsr()
+
+        norms = np.sqrt(col_sq)
+        inverse = sparse.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0))
+        scores = (((listened @ inverse) @ matrix.T) @ matrix @ inverse).toarray()
+
+        heard_rows, heard_cols = listened.nonzero()
+        scores[heard_rows, heard_cols] = -np.inf
+        return scores, known, song_ids
+
+    def recommend(self, user_id: int, limit: int) -> List[int]:
+        """Ids of the highest scoring unheard songs for a user."""
+        scores = self.scores(user_id)
+        if scores is None or limit <= 0:
+            return []
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[top]
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [self._song_ids[i] for i in order]
+
+
+interaction_matrix = InteractionMatrix()
@@ -0,0 +1,289 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import Song
+from app.recommender.interactions import InteractionMatrix
+
+logger = logging.getLogger(__name__)
+
+NEIGHBOUR_INDEX_PATH = os.getenv('NEIGHBOUR_INDEX_PATH', './song_neighbours.idx')
+# Seconds between checks for a rebuilt index file
+NEIGHBOUR_INDEX_REFRESH_SECONDS = float(os.getenv('NEIGHBOUR_INDEX_REFRESH_SECONDS', 30))
+
+DEFAULT_K = 50
+CO_LISTEN_WEIGHT = 1.0
+ARTIST_WEIGHT = 0.3
+GENRE_WEIGHT = 0.1
+# Same-artist and same-genre candidates considered per song, most played first
+CANDIDATES_PER_GROUP = 4 * DEFAULT_K
+BUILD_CHUNK_SIZE = 1024
+
+# File layout: header, song ids (int64[n]), neighbour ids (int64[n, k]),
+# neighbour scores (float32[n, k]). Unused neighbour slots hold -1.
+MAGIC = b'SONGNBR1'
+HEADER = struct.Struct('<8sQQ')
+EMPTY = -1
+
+
+def _group_tops(codes: np.ndarray, popularity: np.ndarray, size: int) -> Dict[int, np.ndarray]:
+    """Most played positions for every code, at most `size` each."""
+    order = np.lexsort((-popularity, codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    return {
+        int(sorted_codes[start]): np.sort(order[start:min(end, start + size)])
+        for start, end in zip(starts, ends)
+        if sorted_codes[start] >= 0
+    }
+
+
+def _encode(values: List[Optional[str]]) -> np.ndarray:
+    vocabulary: Dict[str, int] = {}
+    return np.array(
+        [vocabulary.setdefault(v, len(vocabulary)) if v else -1 for v in values], dtype=np.int64
+    )
+
+
+def compute_neighbours(db: Session, k: int = DEFAULT_K) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Top-k most similar songs for every song in the catalog.
+
+    Similarity is the co-listening cosine between song columns of the
+    interaction matrix plus flat bonuses for sharing an artist or a genre.
+    """
+    rows = db.execute(select(Song.id, Song.artist, Song.genre).order_by(Song.id)).all()
+    song_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    artist_codes = _encode([row[1] for row in rows])
+    genre_codes = _encode([row[2] for row in rows])
+    n = len(song_ids)
+
+    matrix = InteractionMatrix()
+    matrix.load(db)
+    interactions, matrix_song_ids = matrix.snapshot()
+    interactions = interactions.tocsc()
+    # Map interaction matrix columns onto catalog positions
+    catalog_position = np.minimum(np.searchsorted(song_ids, matrix_song_ids), max(n - 1, 0))
+    known = song_ids[catalog_position] == matrix_song_ids if n else np.zeros(len(matrix_song_ids), dtype=bool)
+    interactions = interactions[:, np.flatnonzero(known)]
+    column_position = np.full(n, -1, dtype=np.int64)
+    column_position[catalog_position[known]] = np.arange(known.sum())
+
+    norms = np.sqrt(np.asarray(interactions.multiply(interactions).sum(axis=0)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (interactions @ sparse.diags(inverse)).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    popularity = np.zeros(n, dtype=np.float64)
+    popularity[catalog_position[known]] = np.asarray(interactions.sum(axis=0)).ravel()
+    artist_tops = _group_tops(artist_codes, popularity, CANDIDATES_PER_GROUP)
+    genre_tops = _group_tops(genre_codes, popularity, CANDIDATES_PER_GROUP)
+    no_candidates = np.zeros(0, dtype=np.int64)
+    catalog_columns = catalog_position[known]
+
+    neighbours = np.full((n, k), EMPTY, dtype=np.int64)
+    scores = np.zeros((n, k), dtype=np.float32)
+
+    for chunk_start in range(0, n, BUILD_CHUNK_SIZE):
+        chunk = np.arange(chunk_start, min(chunk_start + BUILD_CHUNK_SIZE, n))
+        columns = column_position[chunk]
+        listened = columns >= 0
+        co_listen = sparse.csr_matrix((len(chunk), normalized.shape[1]))
+        if listened.any():
+            rows_with_plays = sparse.csr_matrix(
+                (np.ones(listened.sum()), (np.flatnonzero(listened), columns[listened])),
+                shape=(len(chunk), normalized.shape[1])
+            )
+            co_listen = (rows_with_plays @ normalized_t @ normalized).tocsr()
+
+        for offset, position in enumerate(chunk):
+            start, end = co_listen.indptr[offset], co_listen.indptr[offset + 1]
+            co_positions = catalog_columns[co_listen.indices[start:end]]
+            co_values = co_listen.data[start:end]
+
+            candidates = np.unique(np.concatenate([
+                co_positions,
+                artist_tops.get(int(artist_codes[position]), no_candidates),
+                genre_tops.get(int(genre_codes[position]), no_candidates),
+            ]))
+            candidates = candidates[candidates != position]
+            if not len(candidates):
+                continue
+
+            candidate_scores = np.zeros(len(candidates), dtype=np.float64)
+            candidate_scores[np.searchsorted(candidates, co_positions[co_positions != position])] = \
+                CO_LISTEN_WEIGHT * co_values[co_positions != position]
+            if artist_codes[position] >= 0:
+                candidate_scores += ARTIST_WEIGHT * (artist_codes[candidates] == artist_codes[position])
+            if genre_codes[position] >= 0:
+                candidate_scores += GENRE_WEIGHT * (genre_codes[candidates] == genre_codes[position])
+
+            count = min(k, len(candidates))
+            top = np.argpartition(-candidate_scores, count - 1)[:count]
+            top = top[np.lexsort((candidates[top], -candidate_scores[top]))]
+            neighbours[position, :count] = song_ids[candidates[top]]
+            scores[position, :count] = candidate_scores[top]
+
+    return song_ids, neighbours, scores
+
+
+def write_index(path: str, song_ids: np.ndarray, neighbours: np.ndarray, scores: np.ndarray):
+    """Write the index next to `path` and atomically swap it into place."""
+    n, k = neighbours.shape
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.neighbours-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, n, k))
+            file.write(np.ascontiguousarray(song_ids, dtype='<i8').tobytes())
+            file.write(np.ascontiguousarray(neighbours, dtype='<i8').tobytes())
+            file.write(np.ascontiguousarray(scores, dtype='<f4').tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def build_index(db: Session, path: str = NEIGHBOUR_INDEX_PATH, k: int = DEFAULT_K):
+    song_ids, neighbours, scores = compute_neighbours(db, k)
+    write_index(path, song_ids, neighbours, scores)
+    return len(song_ids)
+
+
+class NeighbourIndex:
+    """
+    Read-only view of a neighbour index file.
+
+    The file is memory-mapped, so lookups never touch the database and every
+    worker process shares the same page cache instead of a heap copy. The
+    file is re-checked every `refresh_seconds` and reopened when a rebuild
+    has swapped in a new one.
+    """
+
+    def __init__(self, path: str = NEIGHBOUR_INDEX_PATH,
+                 refresh_seconds: float = NEIGHBOUR_INDEX_REFRESH_SECONDS):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._view = None
+        self._identity = None
+        self._checked_at = 0.0
+
+    @property
+    def available(self) -> bool:
+        self._maybe_refresh()
+        return self._view is not None
+
+    def open(self) -> bool:
+        """Map the index file, returning False if there is none yet."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                logger.info(f"No neighbour index at {self.path}")
+                self._view, self._identity = None, None
+                return False
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity == self._identity:
+                return True
+
+            with open(self.path, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, n, k = HEADER.unpack_from(mapped, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not a neighbour index")
+            offset = HEADER.size
+            song_ids = np.frombuffer(mapped, dtype='<i8', count=n, offset=offset)
+            offset += 8 * n
+            neighbours = np.frombuffer(mapped, dtype='<i8', count=n * k, offset=offset).reshape(n, k)
+            offset += 8 * n * k
+            scores = np.frombuffer(mapped, dtype='<f4', count=n * k, offset=offset).reshape(n, k)
+
+            # Readers holding the previous view keep it alive until they finish
+            self._view = (song_ids, neighbours, scores)
+            self._identity = identity
+            logger.info(f"Opened neighbour index {self.path} ({n} songs, k={k})")
+            return True
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._checked_at >= self.refresh_seconds:
+            self.open()
+
+    def lookup(self, song_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Neighbour ids and scores of a song, best first."""
+        self._maybe_refresh()
+        view = self._view
+        if view is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        song_ids, neighbours, scores = view
+        position = np.searchsorted(song_ids, song_id)
+        if position >= len(song_ids) or song_ids[position] != song_id:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        row = neighbours[position]
+        valid = row != EMPTY
+        return row[valid], scores[position][valid]
+
+    def merge(self, seeds: Dict[int, float], exclude=(), limit: int = 10) -> List[int]:
+        """
+        Combine the neighbour lists of several seed songs, weighting each
+        list by its seed's weight, and return the best `limit` song ids.
+        """
+        self._maybe_refresh()
+        view = self._view
+        if view is None or not seeds:
+            return []
+        song_ids, neighbours, scores = view
+        seed_ids = np.fromiter(seeds.keys(), dtype=np.int64, count=len(seeds))
+        weights = np.fromiter(seeds.values(), dtype=np.float64, count=len(seeds))
+        positions = np.searchsorted(song_ids, seed_ids)
+        found = positions < len(song_ids)
+        found[found] = song_ids[positions[found]] == seed_ids[found]
+        if not found.any():
+            return []
+
+        candidates = neighbours[positions[found]].ravel()
+        candidate_scores = (scores[positions[found]] * weights[found, None]).ravel()
+        valid = (candidates != EMPTY) & ~np.isin(candidates, np.fromiter(exclude, dtype=np.int64))
+        unique, inverse = np.unique(candidates[valid], return_inverse=True)
+        totals = np.bincount(inverse, weights=candidate_scores[valid], minlength=len(unique))
+        order = np.lexsort((unique, -totals))[:limit]
+        return [int(song_id) for song_id in unique[order]]
+
+
+neighbour_index = NeighbourIndex()
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Build the song neighbour index")
+    parser.add_argument('--output', default=NEIGHBOUR_INDEX_PATH, help="Index file to write")
+    parser.add_argument('-k', type=int, default=DEFAULT_K, help="Neighbours kept per song")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        count = build_index(db, args.output, args.k)
+    finally:
+        db.close()
+    print(f"Wrote neighbours for {count} songs to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import argparse
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.archive import history_archive, to_datetimes, to_microseconds
+from app.database import dialect_insert
+from app.models import ListeningHistory, Song, SongPopularity
+
+# A play's contribution to a song's score halves every half-life
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv('POPULARITY_HALF_LIFE_DAYS', 7))
+
+# Scores are stored as sum(2 ** ((listened_at - EPOCH) / half_life)). Every
+# stored score decays by the same factor over time, so ordering by the
+# stored value is ordering by the decayed value and old rows never need
+# to be rewritten. With a 7 day half-life this stays within float range
+# for roughly 19 years after the epoch.
+EPOCH = datetime(2025, 1, 1)
+
+BACKFILL_BATCH_SIZE = 50_000
+# Kept under SQLite's bound parameter limit
+UPSERT_BATCH_SIZE = 5_000
+
+
+def _age_in_half_lives(moment: datetime) -> float:
+    return (moment - EPOCH).total_seconds() / 86_400 / POPULARITY_HALF_LIFE_DAYS
+
+
+def play_weight(listened_at: Optional[datetime]) -> float:
+    """Stored score contribution of one play."""
+    return 2.0 ** _age_in_half_lives(listened_at or datetime.now())
+
+
+def decayed(score: float, now: datetime = None) -> float:
+    """A stored score as a decayed play count at `now`."""
+    return score / 2.0 ** _age_in_half_lives(now or datetime.now())
+
+
+def record_plays(db: Session, plays: Iterable[Tuple[int, Optional[datetime]]]):
+    """
+    Add plays to the popularity table inside the caller's transaction, with
+    one upsert per distinct song.
+    """
+    totals: Dict[int, List] = {}
+    for song_id, listened_at in plays:
+        if song_id is None:
+            continue
+        listened_at = listened_at or datetime.now()
+        total = totals.setdefault(song_id, [0, 0.0, listened_at])
+        total[0] += 1
+        total[1] += play_weight(listened_at)
+        total[2] = max(total[2], listened_at)
+    if totals:
+        _upsert(db, [
+            {'song_id': song_id, 'plays': plays, 'score': score, 'last_played_at': last_played_at}
+            for song_id, (plays, score, last_played_at) in totals.items()
+        ])
+
+
+def _upsert(db: Session, rows: List[Dict]):
+    genres = dict(db.execute(
+        select(Song.id, Song.genre).where(Song.id.in_([row['song_id'] for row in rows]))
+    ).all())
+    for row in rows:
+        row['genre'] = genres.get(row['song_id'])
+
+    # SQLite spells GREATEST as a two-argument max()
+    greatest = func.max if db.get_bind().dialect.name == 'sqlite' else func.greatest
+    statement = dialect_insert(db, SongPopularity)
+    statement = statement.on_conflict_do_update(
+        index_elements=[SongPopularity.song_id],
+        set_={
+            'plays': SongPopularity.plays + statement.excluded.plays,
+            'score': SongPopularity.score + statement.excluded.score,
+            'last_played_at': greatest(SongPopularity.last_played_at, statement.excluded.last_played_at),
+            'genre': statement.excluded.genre,
+        }
+    )
+    db.execute(statement, rows)
+
+
+def trending(db: Session, limit: int = 10, genre: Optional[str] = None) -> List[Tuple[Song, float]]:
+    """Most played songs with their decayed play counts, read through the score indexes."""
+    query = db.query(Song, SongPopularity.score).join(
+        SongPopularity, SongPopularity.song_id == Song.id
+    )
+    if genre is not None:
+        query = query.filter(SongPopularity.genre == genre)
+    now = datetime.now()
+    return [(song, decayed(score, now)) for song, score in
+            query.order_by(SongPopularity.score.desc(), SongPopularity.song_id).limit(limit)]
+
+
+def backfill(db: Session) -> int:
+    """Rebuild the popularity table from listening_history and its archive."""
+    totals = defaultdict(lambda: [0, 0.0, None])
+    result = db.execute(
+        select(ListeningHistory.song_id, ListeningHistory.listened_at)
+        .where(ListeningHistory.song_id.isnot(None))
+        .execution_options(yield_per=BACKFILL_BATCH_SIZE)
+    )
+    for song_id, listened_at in result:
+        total = totals[song_id]
+        total[0] += 1
+        total[1] += play_weight(listened_at)
+        if listened_at and (total[2] is None or listened_at > total[2]):
+            total[2] = listened_at
+    epoch = to_microseconds([EPOCH])[0]
+    for archived in history_archive.scan(['song_id', 'listened_at']):
+        with_song = archived['song_id'] >= 0
+        moments = archived['listened_at'][with_song]
+        song_ids, inverse = np.unique(archived['song_id'][with_song], return_inverse=True)
+        scores = np.bincount(inverse, 2.0 ** ((moments - epoch) / 86_400e6 / POPULARITY_HALF_LIFE_DAYS))
+        latest = np.full(len(song_ids), np.iinfo(np.int64).min)
+        np.maximum.at(latest, inverse, moments)
+        for song_id, plays, score, listened_at in zip(song_ids.tolist(), np.bincount(inverse).tolist(),
+                                                      scores.tolist(), to_datetimes(latest)):
+            total = totals[song_id]
+            total[0] += plays
+            total[1] += score
+            if total[2] is None or listened_at > total[2]:
+                total[2] = listened_at
+
+    db.query(SongPopularity).delete()
+    rows = [
+        {'song_id': song_id, 'plays': plays, 'score': score, 'last_played_at': last_played_at}
+        for song_id, (plays, score, last_played_at) in totals.items()
+    ]
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        _upsert(db, rows[start:start + UPSERT_BATCH_SIZE])
+    db.commit()
+    return len(rows)
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Maintain the song popularity table")
+    parser.add_argument('command', choices=['backfill'])
+    parser.parse_args()
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        count = backfill(db)
+    finally:
+        db.close()
+    print(f"Backfilled popularity for {count} songs in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import os
+import time
+from datetime import date, datetime
+from enum import StrEnum
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Date, case, func, literal, select, union_all
+from sqlalchemy.orm import Session
+
+from app.database import dialect_insert
+from app.models import ListeningHistory, Song, UserDailyRollup
+
+# Share of a song's duration counted for a play that was not completed
+PARTIAL_LISTEN_FRACTION = float(os.getenv('ROLLUP_PARTIAL_LISTEN_FRACTION', 0.5))
+
+# Kept under SQLite's bound parameter limit
+UPSERT_BATCH_SIZE = 2_000
+CHECK_BATCH_SIZE = 50_000
+# Seconds may differ by float summation order
+SECONDS_TOLERANCE = 1e-6
+
+
+class RollupDimension(StrEnum):
+    GENRE = 'genre'
+    ARTIST = 'artist'
+
+
+DIMENSION_COLUMNS = {
+    RollupDimension.GENRE: Song.genre,
+    RollupDimension.ARTIST: Song.artist,
+}
+
+
+def listened_seconds(duration: Optional[int], completed: bool) -> float:
+    if not duration:
+        return 0.0
+    return float(duration) if completed else duration * PARTIAL_LISTEN_FRACTION
+
+
+def record_plays(db: Session, plays: Iterable[Dict]):
+    """
+    Add plays (dicts with user_id, song_id, completed and listened_at) to
+    the rollups inside the caller's transaction.
+    """
+    plays = [play for play in plays if play['song_id'] is not None]
+    if not plays:
+        return
+    songs = {
+        song_id: (genre, artist, duration) for song_id, genre, artist, duration in db.execute(
+            select(Song.id, Song.genre, Song.artist, Song.duration)
+            .where(Song.id.in_({play['song_id'] for play in plays}))
+        )
+    }
+
+    totals: Dict[Tuple, List] = {}
+    for play in plays:
+        genre, artist, duration = songs.get(play['song_id'], (None, None, None))
+        day = (play['listened_at'] or datetime.now()).date()
+        completed = bool(play['completed'])
+        for dimension, value in ((RollupDimension.GENRE, genre), (RollupDimension.ARTIST, artist)):
+            total = totals.setdefault((play['user_id'], day, str(dimension), value or ''), [0, 0, 0.0])
+            total[0] += 1
+            total[1] += completed
+            total[2] += listened_seconds(duration, completed)
+
+    rows = [
+        {'user_id': user_id, 'day': day, 'dimension': dimension, 'value': value,
+         'plays': plays, 'completed_plays': completed_plays, 'seconds': seconds}
+        for (user_id, day, dimension, value), (plays, completed_plays, seconds) in totals.items()
+    ]
+    statement = dialect_insert(db, UserDailyRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserDailyRollup.user_id, UserDailyRollup.day,
+                        UserDailyRollup.dimension, UserDailyRollup.value],
+        set_={
+            'plays': UserDailyRollup.plays + statement.excluded.plays,
+            'completed_plays': UserDailyRollup.completed_plays + statement.excluded.completed_plays,
+            'seconds': UserDailyRollup.seconds + statement.excluded.seconds,
+        }
+    )
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        db.execute(statement, rows[start:start + UPSERT_BATCH_SIZE])
+
+
+def _aggregate(user_id: Optional[int] = None, since: Optional[datetime] = None):
+    """Rollup rows computed from listening_history in SQL, one select per dimension."""
+    day = func.date(ListeningHistory.listened_at, type_=Date)
+    duration = func.coalesce(Song.duration, 0)
+    selects = []
+    for dimension, column in DIMENSION_COLUMNS.items():
+        value = func.coalesce(column, '')
+        query = (
+            select(
+                ListeningHistory.user_id.label('user_id'),
+                day.label('day'),
+                literal(str(dimension)).label('dimension'),
+                value.label('value'),
+                func.count().label('plays'),
+                func.sum(case((ListeningHistory.completed, 1), else_=0)).label('completed_plays'),
+                func.sum(case(
+                    (ListeningHistory.completed, duration), else_=duration * PARTIAL_LISTEN_FRACTION
+                )).label('seconds'),
+            )
+            .select_from(ListeningHistory)
+            .outerjoin(Song, Song.id == ListeningHistory.song_id)
+            .where(ListeningHistory.song_id.isnot(None), ListeningHistory.listened_at.isnot(None))
+            .group_by(ListeningHistory.user_id, day, value)
+        )
+        if user_id is not None:
+            query = query.where(ListeningHistory.user_id == user_id)
+        if since is not None:
+            query = query.where(ListeningHistory.listened_at >= since)
+        selects.append(query)
+    return union_all(*selects).subquery()
+
+
+def backfill(db: Session, since: Optional[datetime] = None) -> int:
+    """
+    Rebuild the rollups from listening_history with one INSERT ... SELECT.
+    With `since` (the start of a day) older rollups are kept, as their
+    plays may have been archived.
+    """
+    aggregate = _aggregate(since=since)
+    columns = ['user_id', 'day', 'dimension', 'value', 'plays', 'completed_plays', 'seconds']
+    stale = db.query(UserDailyRollup)
+    if since is not None:
+        stale = stale.filter(UserDailyRollup.day >= since.date())
+    stale.delete()
+    db.execute(UserDailyRollup.__table__.insert().from_select(
+        columns, select(*[aggregate.c[column] for column in columns])
+    ))
+    db.commit()
+    return db.scalar(select(func.count()).select_from(UserDailyRollup))
+
+
+def _days(db: Session, query) -> Iterator[Tuple[Tuple[int, str], Dict]]:
+    """((user_id, day), {(dimension, value): (plays, completed_plays, seconds)}) for rows ordered by user and day."""
+    rows = db.execute(query.execution_options(yield_per=CHECK_BATCH_SIZE))
+    for key, group in groupby(rows, key=lambda row: (row.user_id, str(row.day))):
+        yield key, {
+            (row.dimension, row.value): (int(row.plays), int(row.completed_plays), float(row.seconds or 0.0))
+            for row in group
+        }
+
+
+def _same(expected: Tuple, stored: Tuple) -> bool:
+    return expected[:2] == stored[:2] and \
+        abs(expected[2] - stored[2]) <= SECONDS_TOLERANCE * max(1.0, abs(expected[2]))
+
+
+def check(db: Session, user_id: Optional[int] = None, limit: int = 20, since: Optional[datetime] = None) -> Dict:
+    """
+    Compare the rollups with aggregates of the raw table, merging both
+    streams one user day at a time. Returns the number of rollup rows
+    compared, how many differ and up to `limit` examples as
+    (key, expected, stored) with None for a missing row. Days before
+    `since` are skipped.
+    """
+    aggregate = _aggregate(user_id, since)
+    expected_days = _days(db, select(aggregate).order_by(aggregate.c.user_id, aggregate.c.day))
+    stored_query = select(UserDailyRollup.__table__).order_by(UserDailyRollup.user_id, UserDailyRollup.day)
+    if user_id is not None:
+        stored_query = stored_query.where(UserDailyRollup.user_id == user_id)
+    if since is not None:
+        stored_query = stored_query.where(UserDailyRollup.day >= since.date())
+    stored_days = _days(db, stored_query)
+
+    compared, mismatched, examples = 0, 0, []
+    expected, stored = next(expected_days, None), next(stored_days, None)
+    while expected is not None or stored is not None:
+        if stored is None or (expected is not None and expected[0] < stored[0]):
+            day, expected_rows, stored_rows = expected[0], expected[1], {}
+            expected = next(expected_days, None)
+        elif expected is None or stored[0] < expected[0]:
+            day, expected_rows, stored_rows = stored[0], {}, stored[1]
+            stored = next(stored_days, None)
+        else:
+            day, expected_rows, stored_rows = expected[0], expected[1], stored[1]
+            expected, stored = next(expected_days, None), next(stored_days, None)
+        for dimension_value in expected_rows.keys() | stored_rows.keys():
+            compared += 1
+            want, have = expected_rows.get(dimension_value), stored_rows.get(dimension_value)
+            if want is None or have is None or not _same(want, have):
+                mismatched += 1
+                if len(examples) < limit:
+                    examples.append((day + dimension_value, want, have))
+
+    return {'compared': compared, 'mismatched': mismatched, 'examples': examples}
+
+
+def daily_totals(db: Session, user_id: int, since: date) -> List[Dict]:
+    """Plays, completed plays and seconds per day, from the genre rollups."""
+    rows = db.execute(
+        select(
+            UserDailyRollup.day,
+            func.sum(UserDailyRollup.plays),
+            func.sum(UserDailyRollup.completed_plays),
+            func.sum(UserDailyRollup.seconds),
+        )
+        .where(UserDailyRollup.user_id == user_id, UserDailyRollup.day >= since,
+               UserDailyRollup.dimension == RollupDimension.GENRE)
+        .group_by(UserDailyRollup.day)
+        .order_by(UserDailyRollup.day)
+    )
+    return [{'day': day, 'plays': plays, 'completed_plays': completed, 'seconds': seconds}
+            for day, plays, completed, seconds in rows]
+
+
+def top_values(db: Session, user_id: int, dimension: RollupDimension, since: date, limit: int = 10) -> List[Dict]:
+    """Most played genres or artists since a day; songs without one are left out."""
+    plays = func.sum(UserDailyRollup.plays)
+    rows = db.execute(
+        select(UserDailyRollup.value, plays, func.sum(UserDailyRollup.seconds))
+        .where(UserDailyRollup.user_id == user_id, UserDailyRollup.day >= since,
+               UserDailyRollup.dimension == dimension, UserDailyRollup.value != '')
+        .group_by(UserDailyRollup.value)
+        .order_by(plays.desc(), UserDailyRollup.value)
+        .limit(limit)
+    )
+    return [{'value': value, 'plays': plays, 'seconds': seconds} for value, plays, seconds in rows]
+
+
+def main():
+    from app.archive import history_archive
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Maintain the per user daily listening rollups")
+    parser.add_argument('command', choices=['backfill', 'check'])
+    parser.add_argument('--user', type=int, help="Only check this user")
+    args = parser.parse_args()
+
+    # Plays before this have been moved out of listening_history
+    since = history_archive.archived_before()
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        if args.command == 'backfill':
+            print(f"Backfilled {backfill(db, since)} rollup rows in {time.perf_counter() - started:.1f}s")
+            return
+        report = check(db, args.user, since=since)
+    finally:
+        db.close()
+    for key, expected, stored in report['examples']:
+        print(f"{key}: expected {expected}, stored {stored}")
+    print(f"Compared {report['compared']} rollup rows, {report['mismatched']} differ "
+          f"({time.perf_counter() - started:.1f}s)")
+    raise SystemExit(1 if report['mismatched'] else 0)
+
+
+if __name__ == "__main__":
+    main()
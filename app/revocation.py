@@ -0,0 +1,199 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import delete, event, insert, inspect, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
+
+from app.models import RevokedToken, User
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls for revocations made by other workers
+REVOCATION_POLL_INTERVAL = float(os.getenv('REVOCATION_POLL_INTERVAL', 5))
+# Polls also reread rows revoked this many seconds back: concurrent
+# transactions can commit a lower id after a higher one was loaded
+REVOCATION_POLL_OVERLAP = float(os.getenv('REVOCATION_POLL_OVERLAP', 60))
+# Refresh tokens live longest, so revoking a user's tokens lasts this long
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+
+# Session.info key of the users deactivated or deleted in the current transaction
+_REVOKED_USERS = 'revoked_users'
+
+
+class RevocationList:
+    """
+    Revoked token ids of every worker, in memory.
+
+    Holds the jti of each revoked token that has not expired yet, and per
+    user the time before which all tokens were revoked, so a check is a
+    dict lookup and memory is bounded by the revocations within one token
+    lifetime. refresh() loads the rows added since the last call and forgets
+    expired ones; start() runs it every `poll_interval` seconds.
+    """
+
+    def __init__(self, poll_interval: float = REVOCATION_POLL_INTERVAL, name: str = 'revocation-poller'):
+        self.poll_interval = poll_interval
+        self.name = name
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, float] = {}
+        # user_id -> (revoked_at, expires_at)
+        self._users: Dict[int, tuple] = {}
+        self._last_id = 0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.checks = 0
+        self.rejected = 0
+        self.polls = 0
+        self.failed_polls = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_revoked(self, payload: Dict[str, Any]) -> bool:
+        """Whether the token with these decoded claims was revoked."""
+        jti, user_id, issued_at = payload.get('jti'), payload.get('uid'), payload.get('iat')
+        with self._lock:
+            self.checks += 1
+            revoked = jti in self._tokens
+            if not revoked and user_id in self._users:
+                revoked = issued_at is None or issued_at <= self._users[user_id][0]
+            if revoked:
+                self.rejected += 1
+            return revoked
+
+    def _add(self, row: RevokedToken):
+        if row.jti is not None:
+            self._tokens[row.jti] = row.expires_at
+        elif row.user_id is not None:
+            previous = self._users.get(row.user_id)
+            if previous is None or previous[0] < row.revoked_at:
+                self._users[row.user_id] = (row.revoked_at, row.expires_at)
+        self._last_id = max(self._last_id, row.id or 0)
+
+    def _prune(self, now: float):
+        self._tokens = {jti: expires_at for jti, expires_at in self._tokens.items() if expires_at > now}
+        self._users = {user_id: entry for user_id, entry in self._users.items() if entry[1] > now}
+
+    def refresh(self, db: Session) -> int:
+        """Load revocations added since the last refresh; returns how many were new."""
+        now = time.time()
+        with self._lock:
+            last_id = self._last_id
+        rows = db.scalars(
+            select(RevokedToken)
+            .where(or_(RevokedToken.id > last_id, RevokedToken.revoked_at > now - REVOCATION_POLL_OVERLAP),
+                   RevokedToken.expires_at > now)
+            .order_by(RevokedToken.id)
+        ).all()
+        with self._lock:
+            for row in rows:
+                self._add(row)
+            self._prune(now)
+        return sum(row.id > last_id for row in rows)
+
+    async def revoke(self, db: AsyncSession, expires_at: float, jti: Optional[str] = None,
+                     user_id: Optional[int] = None):
+        """
+        Revoke one token by its jti, or without one every token of `user_id`
+        issued so far. `expires_at` is the exp claim of the token, or the
+        latest exp of any token of the user.
+        """
+        now = time.time()
+        row = RevokedToken(jti=jti, user_id=user_id, revoked_at=now, expires_at=expires_at)
+        db.add(row)
+        # Rows of expired tokens are no use to anyone
+        await db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+        await db.commit()
+        # Other workers pick the row up on their next poll; ours checks it now
+        self.remember(now, expires_at, jti, user_id)
+
+    def remember(self, revoked_at: float, expires_at: float, jti: Optional[str] = None,
+                 user_id: Optional[int] = None):
+        """Apply a revocation committed by this worker without waiting for the next poll."""
+        with self._lock:
+            if jti is not None:
+                self._tokens[jti] = expires_at
+            elif user_id is not None and self._users.get(user_id, (0.0,))[0] < revoked_at:
+                self._users[user_id] = (revoked_at, expires_at)
+
+    def start(self, session_factory: Optional[Callable[[], Session]] = None):
+        """Load the current revocations, then poll for new ones in the background."""
+        if self.running:
+            return
+        if session_factory is None:
+            from app.database import SessionLocal as session_factory
+        with session_factory() as db:
+            self.refresh(db)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(session_factory,), name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            thread.join(timeout)
+
+    def _run(self, session_factory: Callable[[], Session]):
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                with session_factory() as db:
+                    self.refresh(db)
+                self.polls += 1
+            except Exception:
+                self.failed_polls += 1
+                logger.exception(f"{self.name}: failed to load revocations")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "revoked_tokens": len(self._tokens),
+                "revoked_users": len(self._users),
+                "last_id": self._last_id,
+                "checks": self.checks,
+                "rejected": self.rejected,
+                "polls": self.polls,
+                "failed_polls": self.failed_polls,
+            }
+
+
+revocation_list = RevocationList()
+
+
+def _revoke_user(connection, target: User):
+    """Revoke every token of a user inside the flush that deactivates or deletes it."""
+    now = time.time()
+    expires_at = now + REFRESH_TOKEN_EXPIRE_DAYS * 86_400
+    connection.execute(insert(RevokedToken).values(user_id=target.id, revoked_at=now, expires_at=expires_at))
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_REVOKED_USERS, []).append((now, expires_at, target.id))
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    # Stateless tokens carry the active claim, so they must not outlive a deactivation
+    if target.is_active is False and inspect(target).attrs.is_active.history.deleted:
+        _revoke_user(connection, target)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _revoke_user(connection, target)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_revoked_users(session):
+    for revoked_at, expires_at, user_id in session.info.pop(_REVOKED_USERS, ()):
+        revocation_list.remember(revoked_at, expires_at, user_id=user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_revoked_users(session):
+    session.info.pop(_REVOKED_USERS, None)
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Literal, Union
+from datetime import date, datetime
 # In schemas.py
 from pydantic import BaseModel
 
@@ -23,7 +23,7 @@ class UserResponse(BaseModel):
     id: int
     username: str
     email: str
-    full_name: Optional[str]
+    full_name: Optional[str] = None
     is_active: bool
     created_at: datetime
 
@@ -33,7 +33,8 @@ class UserResponse(BaseModel):
 
 # User Preferences Schema
 class UserPreferencesResponse(BaseModel):
-    id: int
+    # None until the user saves preferences
+    id: Optional[int] = None
     user_id: int
     genre_preference: Optional[List[str]]
     artist_preference: Optional[List[str]]
@@ -41,3 +42,85 @@ class UserPreferencesResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Listening History Schemas
+class HistoryCreate(BaseModel):
+    song_id: int
+    completed: bool = False
+
+class HistoryEvent(HistoryCreate):
+    # Plays synced from offline players carry their own timestamps
+    listened_at: Optional[datetime] = None
+
+class BulkHistoryResult(BaseModel):
+    index: int
+    status: Literal["created", "error"]
+    detail: Optional[str] = None
+
+class BulkHistoryResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkHistoryResult]
+
+class HistoryResponse(BaseModel):
+    id: int
+    user_id: int
+    song_id: int
+    completed: bool
+    listened_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class HistoryPage(BaseModel):
+    items: List[HistoryResponse]
+    # Pass back as `cursor` for the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+class DailyListening(BaseModel):
+    day: date
+    plays: int
+    completed_plays: int
+    seconds: float
+
+class ListeningTotal(BaseModel):
+    value: str
+    plays: int
+    seconds: float
+
+class ListeningStats(BaseModel):
+    days: List[DailyListening]
+    top_genres: List[ListeningTotal]
+    top_artists: List[ListeningTotal]
+
+
+# User Preferences Update
+class PreferenceUpdate(BaseModel):
+    genre_preference: Optional[List[str]] = None
+    artist_preference: Optional[List[str]] = None
+    language_preference: Optional[List[str]] = None
+
+PreferenceResponse = UserPreferencesResponse
+
+
+# Song Schema
+class SongResponse(BaseModel):
+    id: int
+    title: str
+    artist: str
+    album: Optional[str] = None
+    genre: Optional[str] = None
+    duration: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class TrendingSongResponse(SongResponse):
+    score: float
+
+
+# Batch Recommendation Request
+class BatchRecommendationRequest(BaseModel):
+    user_ids: Union[List[int], Literal["all"]] = "all"
+    limit: int = 10
@@ -0,0 +1,146 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """The write-behind queue stayed full for the whole put timeout."""
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue drained by a background thread.
+
+    The worker hands items to `flush` in batches of up to `max_rows`, or
+    whatever arrived within `interval` seconds of a batch's first item.
+    put() blocks for at most `put_timeout` seconds while the queue is full
+    and then raises QueueFull, so callers can shed load. stop() flushes
+    everything queued before returning. Without a running worker, put()
+    flushes the item straight away. `flush` may return how many items of
+    the batch it had to drop.
+    """
+
+    def __init__(self, flush: Callable[[List[Any]], Optional[int]], max_rows: int, interval: float,
+                 maxsize: int, put_timeout: float = 0.0, name: str = 'write-behind'):
+        self.flush = flush
+        self.max_rows = max_rows
+        self.interval = interval
+        self.put_timeout = put_timeout
+        self.name = name
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        # Signalled when the last put() that saw the worker running has enqueued
+        self._idle = threading.Condition(self._lock)
+        self._producers = 0
+        self._thread: Optional[threading.Thread] = None
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_rows = 0
+        self._latency_total = 0.0
+        self._latency_last = 0.0
+        self._latency_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if not self.running:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Flush everything queued and stop the worker."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            # Items enqueued after _STOP would never be flushed
+            while self._producers:
+                self._idle.wait()
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def put(self, item: Any):
+        with self._lock:
+            running = self.running
+            if running:
+                self._producers += 1
+        if not running:
+            self._flush([item])
+            return
+        try:
+            self._queue.put(item, block=self.put_timeout > 0, timeout=self.put_timeout or None)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full ({self._queue.maxsize} items)")
+        else:
+            with self._lock:
+                self.enqueued += 1
+        finally:
+            with self._lock:
+                self._producers -= 1
+                self._idle.notify_all()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch: List[Any]):
+        started = time.perf_counter()
+        try:
+            dropped = self.flush(batch) or 0
+        except Exception:
+            self.failed_rows += len(batch)
+            logger.exception(f"{self.name}: dropped {len(batch)} items after a failed flush")
+            return
+        latency = time.perf_counter() - started
+        self.flushes += 1
+        self.flushed_rows += len(batch) - dropped
+        self.failed_rows += dropped
+        self._latency_total += latency
+        self._latency_last = latency
+        self._latency_max = max(self._latency_max, latency)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_rows": self.failed_rows,
+            "mean_batch_rows": self.flushed_rows / self.flushes if self.flushes else 0.0,
+            "flush_latency_last_ms": self._latency_last * 1000,
+            "flush_latency_mean_ms": self._latency_total / self.flushes * 1000 if self.flushes else 0.0,
+            "flush_latency_max_ms": self._latency_max * 1000,
+        }
@@ -0,0 +1,153 @@
+"""
+Deterministic synthetic data for benchmarking.
+
+Fills users, songs, listening_history and preferences with bulk inserts.
+Song popularity and user activity follow Zipf-like distributions so that
+there are hit songs and heavy listeners, as in production.
+
+    python -m benchmarks.generate --database-url sqlite:///./bench.db \\
+        --users 100000 --songs 1000000 --plays 50000000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import Session
+
+from app.models import Base, ListeningHistory, Song, User, UserPreferences
+
+GENRES = [
+    "Rock", "Pop", "Jazz", "Hip Hop", "Electronic", "Classical", "R&B", "Country",
+    "Metal", "Folk", "Blues", "Reggae", "Soul", "Punk", "Indie", "Latin",
+    "K-Pop", "Ambient", "Funk", "Disco",
+]
+LANGUAGES = ["en", "es", "fr", "de", "ko", "ja", "pt"]
+WORDS = [
+    "love", "night", "dream", "fire", "heart", "rain", "summer", "light", "road", "city",
+    "blue", "gold", "wild", "home", "river", "star", "shadow", "dance", "ocean", "echo",
+]
+BENCHMARK_PASSWORD = "benchmark-password"
+# Plays are spread over this many days before the generation date
+HISTORY_DAYS = 365
+PREFERENCE_SHARE = 0.3
+
+
+def zipf_weights(n: int, exponent: float = 1.1) -> np.ndarray:
+    """Cumulative Zipf weights of n ranks, for zipf_choice."""
+    return np.cumsum(1.0 / np.arange(1, n + 1) ** exponent)
+
+
+def zipf_choice(rng: np.random.Generator, cumulative: np.ndarray, size: int) -> np.ndarray:
+    """Indexes in [0, n) where low indexes are drawn far more often."""
+    return np.minimum(np.searchsorted(cumulative, rng.random(size) * cumulative[-1]), len(cumulative) - 1)
+
+
+def _tune_sqlite(engine):
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=OFF")
+            cursor.close()
+
+
+def generate(database_url: str, users: int, songs: int, plays: int, seed: int = 42,
+             batch_size: int = 50_000, now: datetime = None, with_aggregates: bool = True):
+    """Create the tables (if missing) and fill them; returns row counts."""
+    rng = np.random.default_rng(seed)
+    now = now or datetime(2026, 1, 1)
+    engine = create_engine(database_url)
+    _tune_sqlite(engine)
+    Base.metadata.create_all(bind=engine)
+
+    # Hashing is deliberately slow, so every user shares one password hash
+    from app.hashing import get_password_hash
+    hashed_password = get_password_hash(BENCHMARK_PASSWORD)
+
+    artists = max(songs // 10, 1)
+    genre_weights = zipf_weights(len(GENRES), exponent=0.8)
+    with engine.begin() as connection:
+        for start in range(0, users, batch_size):
+            ids = range(start + 1, min(start + batch_size, users) + 1)
+            connection.execute(insert(User), [
+                {"id": i, "username": f"user{i}", "email": f"user{i}@example.com",
+                 "hashed_password": hashed_password, "is_active": True, "created_at": now}
+                for i in ids
+            ])
+
+        for start in range(0, songs, batch_size):
+            count = min(batch_size, songs - start)
+            genre_codes = zipf_choice(rng, genre_weights, count)
+            artist_codes = rng.integers(0, artists, count)
+            word_codes = rng.integers(0, len(WORDS), (count, 2))
+            durations = np.clip(rng.normal(215, 60, count), 30, 1200).astype(int)
+            connection.execute(insert(Song), [
+                {"id": start + i + 1,
+                 "title": f"{WORDS[word_codes[i, 0]].title()} {WORDS[word_codes[i, 1]]} {start + i + 1}",
+                 "artist": f"Artist {artist_codes[i]}",
+                 "album": f"Album {artist_codes[i]}-{(start + i) % 5}",
+                 "genre": GENRES[genre_codes[i]],
+                 "duration": int(durations[i]),
+                 "created_at": now - timedelta(days=int(rng.integers(0, 3 * HISTORY_DAYS)))}
+                for i in range(count)
+            ])
+
+        preference_users = rng.choice(users, int(users * PREFERENCE_SHARE), replace=False) + 1 if users else []
+        for start in range(0, len(preference_users), batch_size):
+            connection.execute(insert(UserPreferences), [
+                {"user_id": int(user_id),
+                 "genre_preference": [GENRES[g] for g in rng.choice(len(GENRES), 2, replace=False)],
+                 "artist_preference": [f"Artist {a}" for a in rng.integers(0, artists, 2)],
+                 "language_preference": [LANGUAGES[rng.integers(0, len(LANGUAGES))]]}
+                for user_id in preference_users[start:start + batch_size]
+            ])
+
+    # Each play batch is its own transaction so memory stays flat
+    user_weights = zipf_weights(users, exponent=0.7)
+    song_weights = zipf_weights(songs)
+    for start in range(0, plays, batch_size):
+        count = min(batch_size, plays - start)
+        user_ids = zipf_choice(rng, user_weights, count) + 1
+        song_ids = zipf_choice(rng, song_weights, count) + 1
+        completed = rng.random(count) < 0.7
+        seconds_ago = rng.integers(0, HISTORY_DAYS * 86_400, count)
+        with engine.begin() as connection:
+            connection.execute(insert(ListeningHistory), [
+                {"user_id": int(user_ids[i]), "song_id": int(song_ids[i]), "completed": bool(completed[i]),
+                 "listened_at": now - timedelta(seconds=int(seconds_ago[i]))}
+                for i in range(count)
+            ])
+
+    if with_aggregates:
+        from app.recommender import popularity, rollups
+        with Session(engine) as db:
+            popularity.backfill(db)
+            rollups.backfill(db)
+
+    engine.dispose()
+    return {"users": users, "songs": songs, "plays": plays, "preferences": len(preference_users)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic benchmark data")
+    parser.add_argument("--database-url", default="sqlite:///./benchmark.db")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--songs", type=int, default=10_000)
+    parser.add_argument("--plays", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--skip-aggregates", action="store_true",
+                        help="Do not backfill song_popularity and user_daily_rollups")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.database_url, args.users, args.songs, args.plays, args.seed, args.batch_size,
+                      with_aggregates=not args.skip_aggregates)
+    print(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
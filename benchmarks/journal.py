@@ -0,0 +1,160 @@
+"""
+Concurrent reads and writes against SQLite with and without WAL.
+
+Each journal mode runs on its own copy of the database, so the source is
+left untouched. Reader threads page through a user's recent history while
+writer threads record plays (with their rollups) in small transactions;
+every other pragma comes from app.database.SQLITE_PRAGMAS:
+
+    python -m benchmarks.generate --database-url sqlite:///./bench.db --users 1000 --songs 10000 --plays 1000000
+    python -m benchmarks.journal --database-url sqlite:///./bench.db --readers 8 --writers 2
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.database import create_db_engine
+from app.models import ListeningHistory, Song, User
+from benchmarks.run import git_commit, summarize
+
+JOURNAL_MODES = ["wal", "delete"]
+PAGE_SIZE = 50
+PLAYS_PER_WRITE = 5
+
+
+def copy_database(path: str, directory: str, mode: str) -> str:
+    target = os.path.join(directory, f"{mode}.db")
+    with sqlite3.connect(path) as source, sqlite3.connect(target) as copy:
+        source.backup(copy)
+    return target
+
+
+def run_mode(path: str, mode: str, readers: int, writers: int, seconds: float, seed: int) -> Dict:
+    import history
+
+    engine = create_db_engine(f"sqlite:///{path}", pragmas={"journal_mode": mode},
+                              pool_size=readers + writers, max_overflow=0)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with SessionLocal() as db:
+        max_user_id = db.scalar(select(func.max(User.id))) or 1
+        max_song_id = db.scalar(select(func.max(Song.id))) or 1
+
+    timings: Dict[str, List[float]] = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def read(db, rng):
+        db.execute(
+            select(ListeningHistory)
+            .where(ListeningHistory.user_id == int(rng.integers(1, max_user_id + 1)))
+            .order_by(ListeningHistory.listened_at.desc(), ListeningHistory.id.desc())
+            .limit(PAGE_SIZE)
+        ).all()
+        db.rollback()
+
+    def write(db, rng):
+        user_id = int(rng.integers(1, max_user_id + 1))
+        history.insert_plays(db, [
+            {"user_id": user_id, "song_id": int(rng.integers(1, max_song_id + 1)),
+             "completed": bool(rng.random() < 0.7), "listened_at": datetime.now()}
+            for _ in range(PLAYS_PER_WRITE)
+        ])
+        db.commit()
+
+    def worker(kind, operation, worker_seed):
+        rng = np.random.default_rng(worker_seed)
+        mine, failed = [], 0
+        with SessionLocal() as db:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    operation(db, rng)
+                except OperationalError:
+                    # "database is locked" once busy_timeout runs out
+                    db.rollback()
+                    failed += 1
+                    continue
+                mine.append(time.perf_counter() - started)
+        with lock:
+            timings[kind].extend(mine)
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=("read", read, seed + i)) for i in range(readers)] + \
+              [threading.Thread(target=worker, args=("write", write, seed + readers + i)) for i in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    with engine.connect() as connection:
+        journal_mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+    engine.dispose()
+
+    result = {"journal_mode": journal_mode}
+    for kind in ("read", "write"):
+        if timings[kind]:
+            result[kind] = summarize(timings[kind], errors[kind], elapsed)
+        else:
+            result[kind] = {"requests": 0, "errors": errors[kind]}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent SQLite reads and writes across journal modes")
+    parser.add_argument("--database-url", default="sqlite:///./benchmark.db")
+    parser.add_argument("--mode", action="append", choices=JOURNAL_MODES, help="Journal mode (repeatable, default all)")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file for the results")
+    args = parser.parse_args()
+
+    url = make_url(args.database_url)
+    if url.get_backend_name() != "sqlite" or not url.database:
+        raise SystemExit("Journal modes only apply to SQLite database files")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="journal-bench-") as directory:
+        for mode in args.mode or JOURNAL_MODES:
+            path = copy_database(url.database, directory, mode)
+            results[mode] = result = run_mode(path, mode, args.readers, args.writers, args.seconds, args.seed)
+            for kind in ("read", "write"):
+                summary = result[kind]
+                if not summary["requests"]:
+                    print(f"{mode:7} {kind:5} no completed operations, errors {summary['errors']}", file=sys.stderr)
+                    continue
+                print(f"{mode:7} {kind:5} p50 {summary['p50_ms']:8.2f}ms  p95 {summary['p95_ms']:8.2f}ms  "
+                      f"p99 {summary['p99_ms']:8.2f}ms  {summary['throughput_rps']:8.1f} ops/s  "
+                      f"errors {summary['errors']}", file=sys.stderr)
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "database_url": args.database_url,
+            "parameters": {"readers": args.readers, "writers": args.writers,
+                           "seconds": args.seconds, "seed": args.seed},
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
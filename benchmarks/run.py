@@ -0,0 +1,228 @@
+"""
+Latency and throughput benchmarks against a (generated) database.
+
+Requests go through the real FastAPI app in-process, with its database
+dependencies pointed at --database-url. Results are written as JSON keyed
+by scenario so runs from different commits can be compared:
+
+    python -m benchmarks.generate --database-url sqlite:///./benchmark.db
+    python -m benchmarks.run --database-url sqlite:///./benchmark.db --output before.json
+    python -m benchmarks.run --database-url sqlite:///./benchmark.db --baseline before.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app.models import ListeningHistory, Song, User
+from benchmarks.generate import BENCHMARK_PASSWORD
+
+RECOMMENDATION_ENGINES = ["set", "collaborative", "affinity", "content", "neighbours"]
+DEFAULT_SCENARIOS = ["token", "users_me", "history_list", "history_add"] + \
+                    [f"recommendations_{engine}" for engine in RECOMMENDATION_ENGINES]
+# Users that log in up front to get tokens for the authenticated scenarios
+TOKEN_USERS = 20
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_client(database_url: str):
+    """
+    TestClient for the app with every session factory pointed at
+    database_url: the write and read dependencies, and the module level
+    sessionmakers used by the write-behind queue, the export and the
+    batch recommendations.
+    """
+    from fastapi.testclient import TestClient
+
+    import history
+    import main
+    from app import database
+
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.create_db_engine(database_url))
+    ReadSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False,
+        bind=database.create_db_engine(database_url, pragmas=database.READ_PRAGMAS)
+    )
+    database.SessionLocal = history.SessionLocal = SessionLocal
+    database.ReadSessionLocal = ReadSessionLocal
+    database.AsyncSessionLocal = async_sessionmaker(
+        database.create_async_db_engine(database_url), autoflush=False, expire_on_commit=False
+    )
+    database.AsyncReadSessionLocal = async_sessionmaker(
+        database.create_async_db_engine(database_url, pragmas=database.READ_PRAGMAS),
+        autoflush=False, expire_on_commit=False
+    )
+    return TestClient(main.app), SessionLocal
+
+
+def summarize(timings: List[float], errors: int, elapsed: float) -> Dict:
+    milliseconds = np.array(timings) * 1000
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "mean_ms": float(milliseconds.mean()),
+        "throughput_rps": len(timings) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def measure(call: Callable[[int], int], requests: int, warmup: int, concurrency: int) -> Dict:
+    """Run `call(i)` (returning an HTTP status) `requests` times and summarise the latencies."""
+    for i in range(warmup):
+        call(-1 - i)
+
+    def timed(i):
+        started = time.perf_counter()
+        status = call(i)
+        return time.perf_counter() - started, status >= 400
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(timed, range(requests)))
+    else:
+        outcomes = [timed(i) for i in range(requests)]
+    elapsed = time.perf_counter() - started
+    return summarize([t for t, _ in outcomes], sum(failed for _, failed in outcomes), elapsed)
+
+
+def make_scenarios(client, tokens: Dict[int, str], user_ids: List[int], max_song_id: int, seed: int):
+    rng = np.random.default_rng(seed)
+    token_users = list(tokens)
+
+    def headers():
+        user_id = token_users[rng.integers(len(token_users))]
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    def token(i):
+        user_id = user_ids[rng.integers(len(user_ids))]
+        return client.post("/token", data={"username": f"user{user_id}", "password": BENCHMARK_PASSWORD}).status_code
+
+    scenarios = {
+        "token": token,
+        "users_me": lambda i: client.get("/users/me/", headers=headers()).status_code,
+        "history_list": lambda i: client.get("/history/?limit=100", headers=headers()).status_code,
+        "history_add": lambda i: client.post(
+            "/history/", headers=headers(),
+            json={"song_id": int(rng.integers(1, max_song_id + 1)), "completed": bool(rng.random() < 0.7)}
+        ).status_code,
+    }
+    for engine in RECOMMENDATION_ENGINES:
+        scenarios[f"recommendations_{engine}"] = lambda i, engine=engine: client.get(
+            f"/recommendations/?engine={engine}&limit=10", headers=headers()
+        ).status_code
+    return scenarios
+
+
+def run(database_url: str, scenarios: List[str], requests: int, warmup: int, concurrency: int,
+        seed: int = 0, use_cache: bool = False) -> Dict:
+    import recommendations
+
+    if not use_cache:
+        recommendations.recommendation_cache.maxsize = 0
+
+    client, SessionLocal = build_client(database_url)
+    with SessionLocal() as db:
+        rows = {
+            "users": db.scalar(select(func.count(User.id))),
+            "songs": db.scalar(select(func.count(Song.id))),
+            "plays": db.scalar(select(func.count(ListeningHistory.id))),
+        }
+        max_song_id = db.scalar(select(func.max(Song.id))) or 1
+        rng = np.random.default_rng(seed)
+        all_ids = db.scalars(select(User.id).order_by(User.id)).all()
+        user_ids = [all_ids[i] for i in rng.choice(len(all_ids), min(len(all_ids), 1_000), replace=False)]
+
+    tokens = {}
+    for user_id in user_ids[:TOKEN_USERS]:
+        response = client.post("/token", data={"username": f"user{user_id}", "password": BENCHMARK_PASSWORD})
+        if response.status_code == 200:
+            tokens[user_id] = response.json()["access_token"]
+    if not tokens:
+        raise SystemExit("Could not log in any benchmark user; was the database made by benchmarks.generate?")
+
+    available = make_scenarios(client, tokens, user_ids, max_song_id, seed)
+    results = {}
+    for name in scenarios:
+        results[name] = measure(available[name], requests, warmup, concurrency)
+        print(f"{name:28} p50 {results[name]['p50_ms']:8.2f}ms  p95 {results[name]['p95_ms']:8.2f}ms  "
+              f"p99 {results[name]['p99_ms']:8.2f}ms  {results[name]['throughput_rps']:8.1f} req/s  "
+              f"errors {results[name]['errors']}", file=sys.stderr)
+
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database_url": database_url,
+        "rows": rows,
+        "parameters": {"requests": requests, "warmup": warmup, "concurrency": concurrency,
+                       "seed": seed, "cache": use_cache},
+        "results": results,
+    }
+
+
+def compare(report: Dict, baseline: Dict):
+    print(f"{'scenario':28} {'p50 before':>11} {'p50 after':>10} {'change':>8}  {'p95 before':>11} {'p95 after':>10} {'change':>8}")
+    for name, result in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        changes = [
+            (before[key], result[key], (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0)
+            for key in ("p50_ms", "p95_ms")
+        ]
+        print(f"{name:28} " + "  ".join(f"{b:11.2f} {a:10.2f} {c:+7.1f}%" for b, a, c in changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API endpoints against a database")
+    parser.add_argument("--database-url", default="sqlite:///./benchmark.db")
+    parser.add_argument("--scenario", action="append", choices=DEFAULT_SCENARIOS,
+                        help="Scenario to run (repeatable, default all)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="Keep the recommendation cache enabled")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmark-<commit>.json)")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    args = parser.parse_args()
+
+    report = run(args.database_url, args.scenario or DEFAULT_SCENARIOS, args.requests, args.warmup,
+                 args.concurrency, args.seed, args.cache)
+    output = args.output or f"benchmark-{report['commit'][:8]}.json"
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {output}", file=sys.stderr)
+
+    failed = [name for name, result in report["results"].items() if result["errors"]]
+    if failed:
+        # Latencies of failed requests say nothing about the endpoint, so they are not compared
+        raise SystemExit(f"Requests failed in: {', '.join(failed)}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(report, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
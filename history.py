@@ -1,10 +1,50 @@
-from fastapi import APIRouter, Depends
+import base64
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
-from app.models import ListeningHistory, UserPreferences, User
-from app.schemas import HistoryCreate, HistoryResponse, PreferenceUpdate, PreferenceResponse
+from typing import Dict, List, Optional, Tuple
+from app.concurrency import run_sync
+from app.database import SessionLocal, get_db, get_read_db
+from app.export import MEDIA_TYPES, ExportFormat, stream_history_export
+from app.internal import require_internal_caller
+from app.jsonstream import InvalidJSON, iter_json_values
+from app.models import ListeningHistory, Song, UserPreferences, User
+from app.preferences import get_user_preferences, store_preferences
+from app.recommender import popularity, rollups
+from app.recommender.catalog import song_catalog
+from app.recommender.rollups import RollupDimension
+from app.recommender.interactions import interaction_matrix
+from app.writebehind import QueueFull, WriteBehindQueue
+from app.schemas import (
+    BulkHistoryResponse, HistoryCreate, HistoryEvent, HistoryPage, HistoryResponse, ListeningStats,
+    PreferenceUpdate, PreferenceResponse
+)
 from auth import get_current_user
+from recommendations import invalidate_recommendations
+
+logger = logging.getLogger(__name__)
+
+# Plays inserted per executemany and transaction by POST /history/bulk
+HISTORY_BULK_BATCH_SIZE = int(os.getenv('HISTORY_BULK_BATCH_SIZE', 1000))
+
+# Opt-in write-behind for POST /history/: plays are queued and committed
+# by a background worker every HISTORY_FLUSH_INTERVAL_MS or
+# HISTORY_FLUSH_ROWS plays, whichever comes first
+HISTORY_WRITE_BEHIND = os.getenv('HISTORY_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv('HISTORY_FLUSH_INTERVAL_MS', 200))
+HISTORY_FLUSH_ROWS = int(os.getenv('HISTORY_FLUSH_ROWS', 500))
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', 10_000))
+# Seconds a request waits for room in a full queue before getting a 503
+HISTORY_ENQUEUE_TIMEOUT = float(os.getenv('HISTORY_ENQUEUE_TIMEOUT', 1))
 
 router = APIRouter(
     prefix="/history",
@@ -19,32 +59,277 @@ def add_to_history(
         db: Session = Depends(get_db)
 ):
     """Add a song to user's listening history"""
+    # Rejected up front like in /history/bulk, rather than dropped by the write-behind flush
+    _require_song(db, history_item.song_id)
+    if HISTORY_WRITE_BEHIND:
+        return _queue_play(current_user.id, history_item)
+
     new_history = ListeningHistory(
         user_id=current_user.id,
         song_id=history_item.song_id,
         completed=history_item.completed
     )
     db.add(new_history)
+    db.flush()
+    record_aggregates(db, [{"user_id": new_history.user_id, "song_id": new_history.song_id,
+                            "completed": new_history.completed, "listened_at": new_history.listened_at}])
     db.commit()
     db.refresh(new_history)
+    plays_committed(current_user.id, [(new_history.song_id, new_history.completed)])
     return new_history
 
 
+@router.get("/writer", dependencies=[Depends(require_internal_caller)])
+def read_writer_stats():
+    """Get write-behind queue depth and flush latency"""
+    return {"enabled": HISTORY_WRITE_BEHIND, **history_writer.stats()}
+
+
+@router.post("/bulk", response_model=BulkHistoryResponse)
+async def add_bulk_history(
+        request: Request,
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Add many plays from a JSON array or NDJSON body, with a status per play"""
+    results: List[Optional[Dict]] = []
+    batch: List[Tuple[int, HistoryEvent]] = []
+    async for value in iter_json_values(request.stream()):
+        index = len(results)
+        results.append(None)
+        if isinstance(value, InvalidJSON):
+            results[index] = _error(index, f"Invalid JSON: {value.detail}")
+            continue
+        try:
+            batch.append((index, HistoryEvent.model_validate(value)))
+        except ValidationError as error:
+            results[index] = _error(index, "; ".join(
+                f"{'.'.join(map(str, detail['loc'])) or 'body'}: {detail['msg']}" for detail in error.errors()
+            ))
+            continue
+        if len(batch) >= HISTORY_BULK_BATCH_SIZE:
+            await run_sync(_insert_batch, db, current_user.id, batch, results)
+            batch = []
+    if batch:
+        await run_sync(_insert_batch, db, current_user.id, batch, results)
+
+    created = sum(result['status'] == 'created' for result in results)
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+
+def _error(index: int, detail: str) -> Dict:
+    return {"index": index, "status": "error", "detail": detail}
+
+
+def _insert_batch(db: Session, user_id: int, batch: List[Tuple[int, HistoryEvent]], results: List[Optional[Dict]]):
+    """Insert one batch of validated plays in a single transaction, filling in their results."""
+    known_songs = set(db.scalars(select(Song.id).where(Song.id.in_({event.song_id for _, event in batch}))))
+    indexes, rows = [], []
+    now = datetime.now()
+    for index, event in batch:
+        if event.song_id not in known_songs:
+            results[index] = _error(index, "Song not found")
+            continue
+        listened_at = event.listened_at or now
+        if listened_at.tzinfo is not None:
+            listened_at = listened_at.astimezone().replace(tzinfo=None)
+        indexes.append(index)
+        rows.append({"user_id": user_id, "song_id": event.song_id,
+                     "completed": event.completed, "listened_at": listened_at})
+    if not rows:
+        return
+
+    try:
+        insert_plays(db, rows)
+        db.commit()
+    except SQLAlchemyError as error:
+        db.rollback()
+        for index in indexes:
+            results[index] = _error(index, f"Could not be saved: {error.__class__.__name__}")
+        return
+
+    for index in indexes:
+        results[index] = {"index": index, "status": "created"}
+    plays_committed(user_id, [(row["song_id"], row["completed"]) for row in rows])
+
+
+def insert_plays(db: Session, rows: List[Dict]):
+    """Insert plays with one executemany and update their aggregates, inside the caller's transaction."""
+    db.execute(insert(ListeningHistory), rows)
+    record_aggregates(db, rows)
+
+
+def record_aggregates(db: Session, plays: List[Dict]):
+    """Add new plays to song popularity and the user daily rollups."""
+    popularity.record_plays(db, [(play["song_id"], play["listened_at"]) for play in plays])
+    rollups.record_plays(db, plays)
+
+
+def _require_song(db: Session, song_id: int):
+    """404 unless the song exists; the song catalog answers without a query for all but new songs."""
+    if song_catalog.snapshot.positions([song_id])[0] >= 0:
+        return
+    if db.get(Song, song_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Song not found")
+
+
+def _queue_play(user_id: int, history_item: HistoryCreate) -> JSONResponse:
+    play = {"user_id": user_id, "song_id": history_item.song_id,
+            "completed": history_item.completed, "listened_at": datetime.now()}
+    try:
+        history_writer.put(play)
+    except QueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many listening events, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    # The id is assigned when the queue is flushed
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(play))
+
+
+def _flush_plays(plays: List[Dict]) -> int:
+    """
+    Commit a write-behind batch in one transaction, or play by play if that
+    fails, so one bad play can't take the others with it. Returns how many
+    plays were dropped.
+    """
+    db = SessionLocal()
+    try:
+        known_songs = set(db.scalars(select(Song.id).where(Song.id.in_({play["song_id"] for play in plays}))))
+        committed = [play for play in plays if play["song_id"] in known_songs]
+        if len(committed) < len(plays):
+            logger.warning(f"history-writer: dropped {len(plays) - len(committed)} plays of unknown songs")
+        try:
+            if committed:
+                insert_plays(db, committed)
+                db.commit()
+        except SQLAlchemyError:
+            db.rollback()
+            valid, committed = committed, []
+            for play in valid:
+                try:
+                    insert_plays(db, [play])
+                    db.commit()
+                    committed.append(play)
+                except SQLAlchemyError:
+                    db.rollback()
+                    logger.exception(f"history-writer: dropped a play of user {play['user_id']}")
+    finally:
+        db.close()
+    by_user: Dict[int, List[Tuple[int, bool]]] = {}
+    for play in committed:
+        by_user.setdefault(play["user_id"], []).append((play["song_id"], play["completed"]))
+    for user_id, user_plays in by_user.items():
+        plays_committed(user_id, user_plays)
+    return len(plays) - len(committed)
+
+
+def plays_committed(user_id: int, plays: List[Tuple[int, bool]]):
+    """Bring in-memory recommendation state up to date with committed (song_id, completed) plays."""
+    for song_id, completed in plays:
+        interaction_matrix.record(user_id, song_id, completed)
+    invalidate_recommendations(user_id)
+
+
+history_writer = WriteBehindQueue(
+    _flush_plays,
+    max_rows=HISTORY_FLUSH_ROWS,
+    interval=HISTORY_FLUSH_INTERVAL_MS / 1000,
+    maxsize=HISTORY_QUEUE_SIZE,
+    put_timeout=HISTORY_ENQUEUE_TIMEOUT,
+    name='history-writer',
+)
+
+
 @router.get("/", response_model=List[HistoryResponse])
 def get_user_history(
         current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db),
+        db: Session = Depends(get_read_db),
         skip: int = 0,
         limit: int = 100
 ):
     """Get current user's listening history"""
     history = db.query(ListeningHistory).filter(
         ListeningHistory.user_id == current_user.id
-    ).order_by(ListeningHistory.listened_at.desc()).offset(skip).limit(limit).all()
+    ).order_by(ListeningHistory.listened_at.desc(), ListeningHistory.id.desc()).offset(skip).limit(limit).all()
 
     return history
 
 
+@router.get("/page", response_model=HistoryPage)
+def get_user_history_page(
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_read_db),
+        cursor: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000)
+):
+    """Get a page of the current user's listening history, newest first"""
+    query = db.query(ListeningHistory).filter(ListeningHistory.user_id == current_user.id)
+    listened_at, history_id = _decode_cursor(cursor) if cursor is not None else (None, None)
+    items = []
+    if cursor is None or listened_at is not None:
+        dated = query.filter(ListeningHistory.listened_at.isnot(None))
+        if cursor is not None:
+            # Seeks straight to the page through the (user_id, listened_at, id) index
+            dated = dated.filter(
+                tuple_(ListeningHistory.listened_at, ListeningHistory.id) < tuple_(listened_at, history_id)
+            )
+        items = dated.order_by(ListeningHistory.listened_at.desc(), ListeningHistory.id.desc()).limit(limit + 1).all()
+    if len(items) <= limit:
+        # Plays without a timestamp come after all the others, newest id first
+        undated = query.filter(ListeningHistory.listened_at.is_(None))
+        if cursor is not None and listened_at is None:
+            undated = undated.filter(ListeningHistory.id < history_id)
+        items += undated.order_by(ListeningHistory.id.desc()).limit(limit + 1 - len(items)).all()
+
+    next_cursor = _encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return {"items": items[:limit], "next_cursor": next_cursor}
+
+
+@router.get("/export")
+def export_history(
+        current_user: User = Depends(get_current_user),
+        format: ExportFormat = ExportFormat.NDJSON
+):
+    """Stream the current user's full listening history with song details"""
+    return StreamingResponse(
+        stream_history_export(current_user.id, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="history-{current_user.id}.{format}"'}
+    )
+
+
+@router.get("/stats", response_model=ListeningStats)
+def get_listening_stats(
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_read_db),
+        days: int = Query(30, ge=1, le=3660),
+        top: int = Query(10, ge=1, le=100)
+):
+    """Get the current user's daily listening totals and top genres and artists, from the rollups"""
+    since = (datetime.now() - timedelta(days=days - 1)).date()
+    return {
+        "days": rollups.daily_totals(db, current_user.id, since),
+        "top_genres": rollups.top_values(db, current_user.id, RollupDimension.GENRE, since, top),
+        "top_artists": rollups.top_values(db, current_user.id, RollupDimension.ARTIST, since, top),
+    }
+
+
+def _encode_cursor(history: ListeningHistory) -> str:
+    listened_at = history.listened_at.isoformat() if history.listened_at is not None else None
+    position = json.dumps([listened_at, history.id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        listened_at, history_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return None if listened_at is None else datetime.fromisoformat(listened_at), int(history_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
 @router.put("/preferences", response_model=PreferenceResponse)
 def update_preferences(
         preferences: PreferenceUpdate,
@@ -67,24 +352,15 @@ def update_preferences(
 
     db.commit()
     db.refresh(user_prefs)
+    store_preferences(current_user.id, PreferenceResponse.model_validate(user_prefs))
+    invalidate_recommendations(current_user.id)
     return user_prefs
 
 
 @router.get("/preferences", response_model=PreferenceResponse)
 def get_preferences(
         current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_read_db)
 ):
-    """Get user preferences"""
-    user_prefs = db.query(UserPreferences).filter(
-        UserPreferences.user_id == current_user.id
-    ).first()
-
-    if not user_prefs:
-
-        user_prefs = UserPreferences(user_id=current_user.id)
-        db.add(user_prefs)
-        db.commit()
-        db.refresh(user_prefs)
-
-    return user_prefs
\ No newline at end of file
+    """Get user preferences, defaults if none were saved"""
+    return get_user_preferences(db, current_user.id)
@@ -1,23 +1,37 @@
+from contextlib import asynccontextmanager
 from datetime import timedelta
 import logging
 
-from fastapi import Depends, FastAPI, HTTPException, status, Form
+from fastapi import Depends, FastAPI, HTTPException, Request, status, Form
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.session import get_db, engine
+from app.internal import require_internal_caller
+from app.hashing import HashingOverloaded, ensure_calibrated, password_hasher
+from app.principals import principal_cache
+from app.revocation import revocation_list
+from app.concurrency import limit_sync_threads, run_sync
+from app.database import engine, get_async_db
 from app import models
+import history
+import recommendations
+import songs
+from app.auth import auth
+from app.auth.client import oauth_client
 from app.models import User
 from app.schemas import Token, UserCreate, UserResponse  # TokenData removed as it's not used
 
+from app.recommender.neighbours import neighbour_index
+from app.recommender.ann import content_index
 from app.auth.utils import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     authenticate_user,
     create_access_token,
     get_current_user,
-    get_password_hash
+    token_claims
 )
 
 # Configure logging
@@ -28,7 +42,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Music App API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    limit_sync_threads()
+    # Workers load the policy file when they start
+    await run_sync(ensure_calibrated)
+    password_hasher.start()
+    # Revoked tokens of every worker, then polled for new ones
+    await run_sync(revocation_list.start)
+    # One keep-alive pool for the OAuth provider callbacks
+    oauth_client.start()
+    # Map the precomputed song neighbour index once per worker
+    neighbour_index.open()
+    # Build the content index now rather than on the first similar-songs request
+    content_index.start()
+    if history.HISTORY_WRITE_BEHIND:
+        history.history_writer.start()
+    yield
+    # Commit buffered listening events before the worker exits
+    await run_sync(history.history_writer.stop)
+    await run_sync(password_hasher.stop)
+    await run_sync(revocation_list.stop)
+    await oauth_client.stop()
+
+
+app = FastAPI(title="Music App API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -38,6 +76,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.include_router(history.router)
+app.include_router(recommendations.router)
+app.include_router(songs.router)
+app.include_router(auth)
+
 # Create database tables
 try:
     models.Base.metadata.create_all(bind=engine)
@@ -53,12 +96,20 @@ async def global_exception_handler(exc: Exception):
         content={"detail": "Internal server error. Please check the logs for more details."},
     )
 
+@app.exception_handler(HashingOverloaded)
+async def hashing_overloaded_handler(request: Request, exc: HashingOverloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many logins in progress, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
 @app.post("/token", response_model=Token, tags=["authentication"])
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -67,24 +118,34 @@ async def login_for_access_token(
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=token_claims(user), expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/users/", response_model=UserResponse, tags=["users"])
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == user.username).first():
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    if await db.scalar(select(User.id).where(User.username == user.username)):
         raise HTTPException(status_code=400, detail="Username already registered")
-    if db.query(User).filter(User.email == user.email).first():
+    if await db.scalar(select(User.id).where(User.email == user.email)):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
+@app.get("/password-hashing", tags=["authentication"], dependencies=[Depends(require_internal_caller)])
+async def read_password_hashing_stats():
+    """Get password hashing queue wait and hash time"""
+    return password_hasher.stats()
+
+@app.get("/principal-cache", tags=["authentication"], dependencies=[Depends(require_internal_caller)])
+async def read_principal_cache_stats():
+    """Get authenticated user cache counters"""
+    return principal_cache.stats()
+
 @app.get("/users/me/", response_model=UserResponse, tags=["users"])
 async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
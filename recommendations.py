@@ -1,10 +1,117 @@
+import os
+from enum import StrEnum
+
+import numpy as np
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from sqlalchemy import exists, func
 from sqlalchemy.orm import Session
-from app.models import ListeningHistory, Song
+from app.archive import history_archive
+from app.cache import TTLCache
+from app.database import get_read_db
+from app.internal import require_internal_caller
+from app.models import ListeningHistory, Song, User
+from app.preferences import get_user_preferences
+from app.recommender import affinity, popularity
+from app.recommender.ann import content_index
+from app.recommender.batch import stream_batch_recommendations
+from app.recommender.catalog import normalize_label, song_catalog
+from app.recommender.features import vectorize
+from app.recommender.interactions import interaction_matrix
+from app.recommender.neighbours import neighbour_index
+from app.schemas import BatchRecommendationRequest, SongResponse
+from auth import get_current_user
 from collections import Counter
 from typing import List
 
+router = APIRouter(
+    prefix="/recommendations",
+    tags=["recommendations"]
+)
+
+
+class RecommendationEngine(StrEnum):
+    HISTORY = 'history'
+    SET_BASED = 'set'
+    COLLABORATIVE = 'collaborative'
+    NEIGHBOURS = 'neighbours'
+    AFFINITY = 'affinity'
+    CONTENT = 'content'
+
+
+DEFAULT_ENGINE = RecommendationEngine.SET_BASED
+
+# Most recently played songs whose neighbour lists are merged
+NEIGHBOUR_SEED_LIMIT = 50
+# Most recently played songs averaged into the content engine's query vector
+CONTENT_SEED_LIMIT = 20
+
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', 10_000))
+RECOMMENDATION_CACHE_TTL = float(os.getenv('RECOMMENDATION_CACHE_TTL', 300))
+
+# Keyed by (user_id, limit, engine) and invalidated per user
+recommendation_cache = TTLCache(
+    maxsize=RECOMMENDATION_CACHE_SIZE,
+    ttl=RECOMMENDATION_CACHE_TTL,
+    group=lambda key: key[0]
+)
+
+
+@router.get("/", response_model=List[SongResponse])
+def read_recommendations(
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_read_db),
+        limit: int = 10,
+        engine: RecommendationEngine = DEFAULT_ENGINE
+):
+    """Get song recommendations for the current user"""
+    return get_cached_recommendations(db, current_user.id, limit, engine)
+
+
+@router.post("/batch", dependencies=[Depends(require_internal_caller)])
+def batch_recommendations(request: BatchRecommendationRequest):
+    """Stream collaborative recommendations for many users as NDJSON"""
+    return StreamingResponse(
+        stream_batch_recommendations(request.user_ids, request.limit),
+        media_type="application/x-ndjson"
+    )
+
+
+@router.get("/cache", dependencies=[Depends(require_internal_caller)])
+def read_cache_stats():
+    """Get recommendation cache counters"""
+    return recommendation_cache.stats()
+
 
-def get_recommendations_based_on_history(db: Session, user_id: int, limit: int = 10) -> List[Song]:
+def get_cached_recommendations(
+        db: Session,
+        user_id: int,
+        limit: int = 10,
+        engine: RecommendationEngine = DEFAULT_ENGINE
+) -> List[Song]:
+    """get_recommendations_based_on_history behind the recommendation cache."""
+    def compute():
+        songs = get_recommendations_based_on_history(db, user_id, limit, engine)
+        # Cached songs outlive this session
+        for song in songs:
+            db.expunge(song)
+        return songs
+
+    return recommendation_cache.get_or_set((user_id, limit, RecommendationEngine(engine)), compute)
+
+
+def invalidate_recommendations(user_id: int):
+    """Drop every cached recommendation list of a user."""
+    recommendation_cache.invalidate_group(user_id)
+
+
+def get_recommendations_based_on_history(
+        db: Session,
+        user_id: int,
+        limit: int = 10,
+        engine: RecommendationEngine = DEFAULT_ENGINE
+) -> List[Song]:
     """
     Generate song recommendations based on user's listening history.
 
@@ -12,16 +119,42 @@ def get_recommendations_based_on_history(db: Session, user_id: int, limit: int =
         db: Database session
         user_id: ID of the user to generate recommendations for
         limit: Maximum number of recommendations to return
+        engine: Which recommendation engine to use
 
     Returns:
         List of recommended Song objects
     """
+    if engine == RecommendationEngine.HISTORY:
+        return _history_recommendations(db, user_id, limit)
+    if engine == RecommendationEngine.COLLABORATIVE:
+        return _collaborative_recommendations(db, user_id, limit)
+    if engine == RecommendationEngine.NEIGHBOURS:
+        return _neighbour_recommendations(db, user_id, limit)
+    if engine == RecommendationEngine.AFFINITY:
+        return _affinity_recommendations(db, user_id, limit)
+    if engine == RecommendationEngine.CONTENT:
+        return _content_recommendations(db, user_id, limit)
+    return _set_based_recommendations(db, user_id, limit)
+
+
+def _cold_start_recommendations(db: Session, limit: int) -> List[Song]:
+    """Trending songs for users without history, topped up with the oldest songs."""
+    songs = [song for song, _ in popularity.trending(db, limit)]
+    if len(songs) < limit:
+        songs += db.query(Song).filter(
+            Song.id.notin_([song.id for song in songs])
+        ).order_by(Song.id).limit(limit - len(songs)).all()
+    return songs
+
+
+def _history_recommendations(db: Session, user_id: int, limit: int) -> List[Song]:
+    """Original row-by-row engine, kept for comparison."""
     # Get user's listening history
     history = db.query(ListeningHistory).filter(ListeningHistory.user_id == user_id).all()
 
     if not history:
         # Return default recommendations if no history
-        return db.query(Song).order_by(Song.id).limit(limit).all()
+        return _cold_start_recommendations(db, limit)
 
     # Analyze favorite genres
     genres = []
@@ -35,7 +168,7 @@ def get_recommendations_based_on_history(db: Session, user_id: int, limit: int =
     common_genre = Counter(genres).most_common(1)[0][0] if genres else None
 
     # Get songs with similar genre, excluding those already in history
-    listened_song_ids = [item.song_id for item in history]
+    listened_song_ids = [item.song_id for item in history] + history_archive.song_ids(user_id).tolist()
 
     if common_genre:
         recommendations = db.query(Song).filter(
@@ -48,4 +181,161 @@ def get_recommendations_based_on_history(db: Session, user_id: int, limit: int =
             Song.id.notin_(listened_song_ids)
         ).limit(limit).all()
 
-    return recommendations
\ No newline at end of file
+    return recommendations
+
+
+def _songs_in_order(db: Session, song_ids: List[int]) -> List[Song]:
+    """Load songs by id, keeping the order of `song_ids`."""
+    songs = {song.id: song for song in db.query(Song).filter(Song.id.in_(song_ids))}
+    return [songs[song_id] for song_id in song_ids if song_id in songs]
+
+
+def _unheard(db: Session, user_id: int, song_ids: List[int]) -> List[int]:
+    """The ids in `song_ids` the user has never played, in order."""
+    heard = {song_id for song_id, in db.query(ListeningHistory.song_id).filter(
+        ListeningHistory.user_id == user_id,
+        ListeningHistory.song_id.in_(song_ids)
+    ).distinct()}
+    heard.update(history_archive.song_ids(user_id).tolist())
+    return [song_id for song_id in song_ids if song_id not in heard]
+
+
+def _set_based_recommendations(db: Session, user_id: int, limit: int) -> List[Song]:
+    """
+    Same result as the history engine using a fixed number of queries:
+    one aggregate join for the genre histogram and an anti-join for the
+    songs the user has already heard. Like the history engine, the genre
+    comes from the plays still in listening_history, while archived plays
+    only count as heard; users with only archived plays get the cold-start
+    list.
+    """
+    # Ties go to the genre heard first, matching Counter.most_common
+    common_genre = db.query(Song.genre).join(
+        ListeningHistory, ListeningHistory.song_id == Song.id
+    ).filter(
+        ListeningHistory.user_id == user_id,
+        Song.genre.isnot(None),
+        Song.genre != ''
+    ).group_by(Song.genre).order_by(
+        func.count(ListeningHistory.id).desc(),
+        func.min(ListeningHistory.id)
+    ).limit(1).scalar()
+
+    if common_genre is None:
+        has_history = db.query(
+            exists().where(ListeningHistory.user_id == user_id)
+        ).scalar()
+        if not has_history:
+            return _cold_start_recommendations(db, limit)
+
+    listened = exists().where(
+        ListeningHistory.user_id == user_id,
+        ListeningHistory.song_id == Song.id
+    )
+    query = db.query(Song).filter(~listened)
+    if common_genre:
+        query = query.filter(Song.genre == common_genre)
+
+    archived = set(history_archive.song_ids(user_id).tolist())
+    if not archived:
+        return query.order_by(Song.id).limit(limit).all()
+    # Pages of `limit` songs until enough of them were not archived
+    songs: List[Song] = []
+    page_query = query
+    while len(songs) < limit:
+        page = page_query.order_by(Song.id).limit(limit).all()
+        songs += [song for song in page if song.id not in archived]
+        if len(page) < limit:
+            break
+        page_query = query.filter(Song.id > page[-1].id)
+    return songs[:limit]
+
+
+def _collaborative_recommendations(db: Session, user_id: int, limit: int) -> List[Song]:
+    """
+    Item-item collaborative filtering over the in-memory interaction matrix.
+    Falls back to the set-based engine for users without plays.
+    """
+    interaction_matrix.ensure_loaded(db)
+    song_ids = interaction_matrix.recommend(user_id, limit)
+    if not song_ids:
+        return _set_based_recommendations(db, user_id, limit)
+
+    return _songs_in_order(db, song_ids)
+
+
+def _neighbour_recommendations(db: Session, user_id: int, limit: int) -> List[Song]:
+    """
+    Merge the precomputed neighbour lists of the user's recently played
+    songs. Falls back to the set-based engine if no index has been built.
+    """
+    if not neighbour_index.available:
+        return _set_based_recommendations(db, user_id, limit)
+
+    seeds = db.query(
+        ListeningHistory.song_id, func.count(ListeningHistory.id)
+    ).filter(
+        ListeningHistory.user_id == user_id
+    ).group_by(ListeningHistory.song_id).order_by(
+        func.max(ListeningHistory.listened_at).desc()
+    ).limit(NEIGHBOUR_SEED_LIMIT).all()
+    if not seeds:
+        return _set_based_recommendations(db, user_id, limit)
+
+    weights = {song_id: float(np.log1p(plays)) for song_id, plays in seeds}
+    candidates = neighbour_index.merge(weights, exclude=weights.keys(), limit=4 * limit)
+    if not candidates:
+        return _set_based_recommendations(db, user_id, limit)
+
+    # Older plays are not among the seeds, so drop anything else already heard
+    song_ids = _unheard(db, user_id, candidates)[:limit]
+    return _songs_in_order(db, song_ids)
+
+
+def _affinity_recommendations(db: Session, user_id: int, limit: int) -> List[Song]:
+    """
+    Blend decayed genre/artist history with explicit preferences and score
+    the whole catalog in memory. Falls back to the set-based engine for
+    users with neither.
+    """
+    song_catalog.ensure_loaded(db)
+    preferences = get_user_preferences(db, user_id)
+    song_ids = affinity.recommend(
+        db, song_catalog, user_id, limit,
+        preferences=(preferences.genre_preference, preferences.artist_preference)
+    )
+    if not song_ids:
+        return _set_based_recommendations(db, user_id, limit)
+
+    return _songs_in_order(db, song_ids)
+
+
+def _content_recommendations(db: Session, user_id: int, limit: int) -> List[Song]:
+    """
+    Content-based recommendations for users with little or no history: an
+    approximate nearest-neighbour search around the centroid of the user's
+    recent songs, or around their preferred genres and artists if they have
+    not played anything yet.
+    """
+    content_index.ensure_loaded(db)
+    recent = db.query(ListeningHistory.song_id).filter(
+        ListeningHistory.user_id == user_id
+    ).order_by(ListeningHistory.listened_at.desc()).limit(CONTENT_SEED_LIMIT).all()
+    recent = [song_id for song_id, in recent]
+
+    vector = None
+    if recent:
+        vector = content_index.mean_vector(recent)
+    else:
+        preferences = get_user_preferences(db, user_id)
+        tokens = [('genre', normalize_label(g)) for g in preferences.genre_preference or []] + \
+                 [('artist', normalize_label(a)) for a in preferences.artist_preference or []]
+        tokens = [(field, value) for field, value in tokens if value]
+        if tokens:
+            vector = vectorize(tokens)
+    if vector is None:
+        return _set_based_recommendations(db, user_id, limit)
+
+    candidates = content_index.query(vector, 4 * limit, exclude_song_ids=recent)
+    song_ids = _unheard(db, user_id, candidates)[:limit] if recent else candidates[:limit]
+    return _songs_in_order(db, song_ids)
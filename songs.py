@@ -0,0 +1,42 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app.database import get_read_db
+from app.models import Song
+from app.recommender import popularity
+from app.recommender.ann import content_index
+from app.schemas import SongResponse, TrendingSongResponse
+
+router = APIRouter(
+    prefix="/songs",
+    tags=["songs"]
+)
+
+
+@router.get("/trending", response_model=List[TrendingSongResponse])
+def get_trending_songs(
+        db: Session = Depends(get_read_db),
+        genre: Optional[str] = None,
+        limit: int = 10
+):
+    """Get the most played songs with time-decayed play counts, overall or for one genre"""
+    return [
+        TrendingSongResponse(**SongResponse.model_validate(song).model_dump(), score=score)
+        for song, score in popularity.trending(db, limit, genre)
+    ]
+
+
+@router.get("/{song_id}/similar", response_model=List[SongResponse])
+def get_similar_songs(
+        song_id: int,
+        db: Session = Depends(get_read_db),
+        limit: int = 10
+):
+    """Get songs with similar metadata, using the approximate nearest-neighbour index"""
+    content_index.ensure_loaded(db)
+    song_ids = content_index.similar(song_id, limit, db)
+    if song_ids is None:
+        raise HTTPException(status_code=404, detail="Song not found")
+
+    songs = {song.id: song for song in db.query(Song).filter(Song.id.in_(song_ids))}
+    return [songs[i] for i in song_ids if i in songs]
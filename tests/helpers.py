@@ -0,0 +1,69 @@
+"""
+Helpers shared by the test modules: throwaway databases, session
+dependencies bound to them, and the `overrides` fixture for swapping the
+app's dependencies during one test.
+
+Test modules import the fixture along with the helpers they use:
+
+    from helpers import memory_engine, overrides, session_factory
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import async_database_url
+from app.models import Base, User
+from main import app
+
+
+def memory_engine():
+    """An in-memory database with the app's tables, shared by every connection to the engine."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+def session_factory(engine) -> sessionmaker:
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def async_session_factory(url: str) -> async_sessionmaker:
+    """Async sessions on the database at the sync `url`."""
+    return async_sessionmaker(create_async_engine(async_database_url(url)), expire_on_commit=False)
+
+
+def yield_sessions(SessionLocal):
+    """A get_db-style dependency handing out sessions from SessionLocal."""
+    def get_session():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+    return get_session
+
+
+def yield_async_sessions(AsyncSessionLocal):
+    """A get_async_db-style dependency handing out sessions from AsyncSessionLocal."""
+    async def get_session():
+        async with AsyncSessionLocal() as db:
+            yield db
+    return get_session
+
+
+def listener() -> User:
+    """Stands in for auth.get_current_user."""
+    return User(id=1, username="listener")
+
+
+@pytest.fixture
+def overrides():
+    """app.dependency_overrides, restored to its previous entries when the test ends."""
+    saved = dict(app.dependency_overrides)
+    try:
+        yield app.dependency_overrides
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(saved)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.models import ListeningHistory, Song, UserPreferences
+from app.recommender import affinity, rollups
+from app.recommender.catalog import SongCatalog
+from helpers import memory_engine, session_factory
+
+NOW = datetime(2026, 1, 1)
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    db.add_all([
+        Song(id=1, title="Old rock", artist="Band", genre="Rock"),
+        Song(id=2, title="New jazz", artist="Trio", genre="Jazz"),
+        Song(id=3, title="More rock", artist="Other", genre="rock"),
+        Song(id=4, title="More jazz", artist="Quartet", genre="Jazz"),
+        Song(id=5, title="Pop", artist="Singer", genre="Pop"),
+        Song(id=6, title="Band pop", artist="Band", genre="Pop"),
+    ])
+    db.commit()
+    return db
+
+
+def test_recent_plays_outweigh_old_plays():
+    """Recency decay favours the genre heard lately"""
+    db = make_session()
+    db.add_all([
+        ListeningHistory(user_id=1, song_id=1, completed=True, listened_at=NOW - timedelta(days=365)),
+        ListeningHistory(user_id=1, song_id=1, completed=True, listened_at=NOW - timedelta(days=300)),
+        ListeningHistory(user_id=1, song_id=2, completed=True, listened_at=NOW - timedelta(days=1)),
+    ])
+    db.commit()
+    rollups.backfill(db)
+    catalog = SongCatalog()
+    catalog.load(db)
+
+    recommended = affinity.recommend(db, catalog, 1, 10, now=NOW)
+
+    assert recommended[0] == 4, f"Recent jazz should win over old rock: {recommended}"
+    assert not {1, 2} & set(recommended), "Heard songs are excluded"
+
+
+def test_preferences_are_blended_in():
+    """Explicit preferences score songs with no history, case-insensitively"""
+    db = make_session()
+    db.add(UserPreferences(user_id=1, genre_preference=["POP"], artist_preference=["band"]))
+    db.commit()
+    catalog = SongCatalog()
+    catalog.load(db)
+
+    recommended = affinity.recommend(db, catalog, 1, 3, now=NOW)
+
+    assert recommended == [6, 5, 1], f"Unexpected ranking: {recommended}"
+    assert affinity.recommend(db, catalog, 2, 3, now=NOW) == [], "Unknown users get no affinity"
+
+
+def test_weights_are_configurable():
+    """Zeroing the genre weights leaves only artist affinity"""
+    db = make_session()
+    catalog = SongCatalog()
+    catalog.load(db)
+    snapshot = catalog.snapshot
+    weights = affinity.AffinityWeights(history_genre=0.0, preference_genre=0.0)
+
+    vector = affinity.user_affinity(
+        snapshot, np.array([1]), np.array([True]), np.array([0.0]),
+        genre_preference=["Jazz"], weights=weights
+    )
+    scores = affinity.score_catalog(snapshot, vector, np.array([1]))
+
+    assert scores[5] > 0 and scores[1] == 0 and scores[3] == 0
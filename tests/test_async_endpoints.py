@@ -0,0 +1,58 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app import hashing
+from app.auth import utils
+from app.database import async_database_url, get_async_db
+from app.models import Base, User
+from helpers import async_session_factory, overrides, yield_async_sessions
+from main import app
+
+# Blocking work per login, standing in for a slow password hash
+VERIFY_SECONDS = 0.2
+
+
+def test_async_database_url():
+    """Sync URLs map onto their asyncio drivers"""
+    assert async_database_url("sqlite:///./music_app.db") == "sqlite+aiosqlite:///./music_app.db"
+    assert async_database_url("postgresql+psycopg2://u:p@db/music") == "postgresql+asyncpg://u:p@db/music"
+
+
+def test_concurrent_logins_overlap(tmp_path, monkeypatch, overrides):
+    """Blocking work in one login does not hold up the others"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add_all([User(username=f"user{i}", email=f"user{i}@example.com", hashed_password="hash")
+                    for i in range(5)])
+        db.commit()
+    engine.dispose()
+
+    def slow_verify(plain_password, hashed_password):
+        time.sleep(VERIFY_SECONDS)
+        return True, None
+
+    monkeypatch.setattr(hashing, "verify_and_update", slow_verify)
+    # Threads, as the stand-in can't be sent to worker processes
+    monkeypatch.setattr(utils, "password_hasher", hashing.PasswordHasher(5, 5, ThreadPoolExecutor))
+    overrides[get_async_db] = yield_async_sessions(async_session_factory(url))
+
+    async def login_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/token", data={"username": f"user{i}", "password": "secret"}) for i in range(5)
+            ])
+            return responses, time.perf_counter() - started
+
+    responses, elapsed = asyncio.run(login_all())
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert elapsed < 5 * VERIFY_SECONDS * 0.6, f"Logins ran one after another ({elapsed:.2f}s)"
@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app import database, internal
+from app.models import ListeningHistory, Song, User
+from app.recommender.batch import iter_batch_recommendations, top_k_rows
+from app.recommender.interactions import interaction_matrix
+from helpers import memory_engine, session_factory
+from main import app
+from recommendations import RecommendationEngine, get_recommendations_based_on_history
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    rng = np.random.default_rng(7)
+    db.add_all([Song(id=i, title=f"Song {i}", artist="Artist", genre="Rock") for i in range(1, 41)])
+    db.add_all([User(id=i, username=f"user{i}") for i in range(1, 31)])
+    db.add_all([
+        ListeningHistory(user_id=int(u), song_id=int(s), completed=bool(c))
+        for u, s, c in zip(rng.integers(1, 26, 300), rng.integers(1, 41, 300), rng.integers(0, 2, 300))
+    ])
+    db.commit()
+    return db, engine
+
+
+def test_top_k_rows():
+    """Rows keep their best positive scores in order"""
+    scores = np.array([[0.1, 0.9, -np.inf, 0.5], [0.0, 0.0, 0.0, 0.2]])
+    assert top_k_rows(scores, 3).tolist() == [[1, 3, 0], [3, -1, -1]]
+
+
+def test_batch_matches_per_user_engine():
+    """Batch scoring gives every user the same songs as the per-user engine"""
+    db, _ = make_session()
+    interaction_matrix.load(db)
+
+    results = list(iter_batch_recommendations(db, "all", limit=5))
+
+    assert [r["user_id"] for r in results] == list(range(1, 31))
+    for result in results:
+        expected = get_recommendations_based_on_history(
+            db, result["user_id"], 5, RecommendationEngine.COLLABORATIVE
+        )
+        assert result["song_ids"] == [song.id for song in expected], \
+            f"Batch and per-user results differ for user {result['user_id']}"
+
+
+def test_batch_endpoint_is_internal(monkeypatch):
+    """Only callers holding the batch key can stream other users' recommendations"""
+    db, engine = make_session()
+    interaction_matrix.load(db)
+    monkeypatch.setattr(database, "SessionLocal", session_factory(engine))
+    client = TestClient(app)
+    body = {"user_ids": [1, 2], "limit": 3}
+
+    assert client.post("/recommendations/batch", json=body).status_code == 403, "Disabled without a key"
+    monkeypatch.setattr(internal, "INTERNAL_API_KEY", "internal")
+    assert client.post("/recommendations/batch", json=body).status_code == 403
+    assert client.post("/recommendations/batch", json=body, headers={"X-Internal-Key": "guess"}).status_code == 403
+
+    response = client.post("/recommendations/batch", json=body, headers={"X-Internal-Key": "internal"})
+    assert response.status_code == 200
+    assert [json.loads(line)["user_id"] for line in response.text.splitlines()] == [1, 2]
+
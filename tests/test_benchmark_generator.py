@@ -0,0 +1,55 @@
+import json
+import sys
+
+import pytest
+from sqlalchemy import create_engine, func, select
+
+from app.models import ListeningHistory, Song, SongPopularity, User
+from benchmarks import run
+from benchmarks.generate import generate
+
+
+def snapshot(database_url):
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        counts = [connection.scalar(select(func.count()).select_from(model.__table__))
+                  for model in (User, Song, ListeningHistory, SongPopularity)]
+        plays = connection.execute(
+            select(ListeningHistory.user_id, ListeningHistory.song_id, ListeningHistory.listened_at)
+            .order_by(ListeningHistory.id).limit(50)
+        ).all()
+    engine.dispose()
+    return counts, plays
+
+
+def test_generator_is_deterministic(tmp_path):
+    """The same seed produces the same rows, skewed towards popular songs"""
+    first = f"sqlite:///{tmp_path / 'first.db'}"
+    second = f"sqlite:///{tmp_path / 'second.db'}"
+    generate(first, users=20, songs=200, plays=2_000, seed=7, batch_size=500)
+    generate(second, users=20, songs=200, plays=2_000, seed=7, batch_size=500)
+
+    counts, plays = snapshot(first)
+    assert counts[:3] == [20, 200, 2_000]
+    assert counts[3] > 0, "Popularity is backfilled"
+    assert (counts, plays) == snapshot(second), "Runs with one seed must match"
+
+    engine = create_engine(first)
+    with engine.connect() as connection:
+        top_song_plays = connection.scalar(
+            select(func.count()).where(ListeningHistory.song_id == 1)
+        )
+    engine.dispose()
+    assert top_song_plays > 2_000 / 200 * 5, "The first song is a hit"
+
+
+def test_failed_runs_still_write_their_report(tmp_path, monkeypatch):
+    """Requests that fail exit non-zero, after the report is written"""
+    output = tmp_path / "report.json"
+    report = {"commit": "abc", "results": {"history_add": {"errors": 3}, "history_list": {"errors": 0}}}
+    monkeypatch.setattr(run, "run", lambda *args: report)
+    monkeypatch.setattr(sys, "argv", ["run", "--output", str(output)])
+
+    with pytest.raises(SystemExit, match="history_add"):
+        run.main()
+    assert json.loads(output.read_text()) == report
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select
+
+import auth
+import history
+from app.database import get_db
+from app.jsonstream import MAX_VALUE_SIZE, InvalidJSON, _Parser, iter_json_values
+from app.models import ListeningHistory, Song, SongPopularity, User
+from helpers import listener, memory_engine, overrides, session_factory, yield_sessions
+from main import app
+
+
+def parse(body: bytes, chunk_size: int):
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def collect():
+        return [value async for value in iter_json_values(chunks())]
+
+    return asyncio.run(collect())
+
+
+def test_json_values_survive_any_chunking():
+    """Arrays and NDJSON parse the same however the body is split"""
+    values = [{"song_id": i, "title": "café ☕"} for i in range(20)] + [12345]
+    array = json.dumps(values).encode()
+    ndjson = "\n".join(json.dumps(value) for value in values).encode()
+    for chunk_size in (1, 3, 7, 64, 10_000):
+        assert parse(array, chunk_size) == values
+        assert parse(ndjson, chunk_size) == values
+
+    parsed = parse(b'{"song_id": 1}\nnot json\n{"song_id": 2}\n', 5)
+    assert parsed[0] == {"song_id": 1} and parsed[2] == {"song_id": 2}
+    assert isinstance(parsed[1], InvalidJSON), "A bad line only fails itself"
+    assert isinstance(parse(b'[{"song_id": 1}, {"song_', 4)[-1], InvalidJSON)
+
+
+def test_parser_buffer_stays_bounded():
+    """Overlong lines and text after the end of an array are dropped rather than buffered"""
+    chunk = "x" * 4096
+    parser = _Parser()
+    parser.feed('{"song_id": 1}\n')
+    rejected = [value for _ in range(256) for value in parser.feed(chunk)]
+    assert len(parser.buffer) <= MAX_VALUE_SIZE
+    assert len(rejected) == 1 and isinstance(rejected[0], InvalidJSON)
+    assert parser.feed('tail\n{"song_id": 2}\n') == [{"song_id": 2}], "Parsing resumes at the next line"
+
+    for body in ('[{"song_id": 1}]', '[{"song_id": 1} oops'):
+        parser = _Parser()
+        parser.feed(body)
+        for _ in range(256):
+            parser.feed(chunk)
+        assert parser.buffer == ""
+
+
+def test_bulk_history_inserts_in_batches(monkeypatch, overrides):
+    """Plays are validated one by one and inserted with one statement per batch"""
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    with SessionLocal() as db:
+        db.add(User(id=1, username="listener", email="listener@example.com", hashed_password="hash"))
+        db.add_all([Song(id=i, title=f"Song {i}", artist="Artist", genre="Rock") for i in range(1, 11)])
+        db.commit()
+
+    inserts = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_inserts(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO listening_history"):
+            inserts.append(statement)
+
+    events = [{"song_id": i % 10 + 1, "completed": i % 2 == 0} for i in range(2_500)]
+    events[10] = {"song_id": 999}
+    events[20] = {"completed": True}
+    events.append({"song_id": 3, "listened_at": "2026-01-01T12:00:00+00:00"})
+    body = "\n".join(json.dumps(item) for item in events).encode()
+
+    monkeypatch.setattr(history, "HISTORY_BULK_BATCH_SIZE", 1_000)
+    overrides[get_db] = yield_sessions(SessionLocal)
+    overrides[auth.get_current_user] = listener
+    response = TestClient(app).post(
+        "/history/bulk", content=(body[i:i + 4096] for i in range(0, len(body), 4096)),
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert (result["created"], result["failed"]) == (2_499, 2)
+    assert [item["index"] for item in result["results"]] == list(range(2_501))
+    assert result["results"][10] == {"index": 10, "status": "error", "detail": "Song not found"}
+    assert result["results"][20]["detail"].startswith("song_id")
+    assert len(inserts) == 3, f"Expected one insert per batch, got {len(inserts)}"
+
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count(ListeningHistory.id))) == 2_499
+        assert db.scalar(select(func.sum(SongPopularity.plays))) == 2_499
+        synced = db.scalar(select(ListeningHistory).order_by(ListeningHistory.id.desc()))
+        assert synced.listened_at.tzinfo is None and synced.listened_at.year == 2026
@@ -0,0 +1,59 @@
+import time
+
+from app.cache import TTLCache
+
+
+def test_lru_eviction_and_counters():
+    """The least recently used entry is evicted once the cache is full"""
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None, "b was least recently used and should be evicted"
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 1)
+
+
+def test_entries_expire():
+    """Entries are dropped after their TTL, which can only be shortened per entry"""
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    cache.set("short", 1, ttl=0.01)
+    cache.set("long", 2, ttl=100)
+    time.sleep(0.06)
+
+    assert cache.get("short") is None
+    assert cache.get("long") is None, "Per-entry TTL must not exceed the cache TTL"
+    assert cache.stats()["expirations"] == 2
+
+
+def test_group_invalidation_is_precise():
+    """Invalidating a user drops only that user's entries"""
+    cache = TTLCache(maxsize=10, ttl=60, group=lambda key: key[0])
+    cache.set((1, 10, "set"), "user 1 set")
+    cache.set((1, 20, "collaborative"), "user 1 collaborative")
+    cache.set((2, 10, "set"), "user 2 set")
+
+    cache.invalidate_group(1)
+
+    assert cache.get((1, 10, "set")) is None
+    assert cache.get((1, 20, "collaborative")) is None
+    assert cache.get((2, 10, "set")) == "user 2 set"
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_value_computed_during_invalidation_is_not_stored():
+    """A result computed before a write landed must not be cached"""
+    cache = TTLCache(maxsize=10, ttl=60, group=lambda key: key[0])
+
+    def compute():
+        # A history write for the same user arrives mid-computation
+        cache.invalidate_group(1)
+        return "stale"
+
+    assert cache.get_or_set((1, 10, "set"), compute) == "stale"
+    assert cache.get((1, 10, "set")) is None
+    assert cache.get_or_set((1, 10, "set"), lambda: "fresh") == "fresh"
+    assert cache.get((1, 10, "set")) == "fresh"
@@ -0,0 +1,78 @@
+import numpy as np
+
+from app.models import Song
+from app.recommender.ann import ContentIndex, LSHIndex
+from helpers import memory_engine, session_factory
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    db.add_all([
+        Song(id=1, title="Night Drive", artist="Synth Band", album="Neon", genre="Synthwave", duration=240),
+        Song(id=2, title="Night Ride", artist="Synth Band", album="Neon", genre="Synthwave", duration=250),
+        Song(id=3, title="Morning Coffee", artist="Jazz Trio", album="Cafe", genre="Jazz", duration=400),
+        Song(id=4, title="Evening Tea", artist="Jazz Trio", album="Cafe", genre="Jazz", duration=380),
+        Song(id=5, title="Drive Fast", artist="Other Band", album="Roads", genre="Synthwave", duration=200),
+    ])
+    db.commit()
+    return db, engine
+
+
+def test_similar_songs_share_metadata():
+    """Songs from the same artist and album are the nearest neighbours"""
+    db, _ = make_session()
+    index = ContentIndex()
+    index.load(db)
+
+    assert index.similar(1, 2)[0] == 2
+    assert index.similar(3, 1) == [4]
+    assert 1 not in index.similar(1, 10), "A song is not similar to itself"
+    assert index.similar(99, 5) is None
+
+
+def test_songs_added_after_the_build_are_vectorized_from_the_database():
+    """A song newer than the index gets neighbours instead of a 404"""
+    db, _ = make_session()
+    index = ContentIndex()
+    index.load(db)
+    db.add(Song(id=6, title="Night Drive II", artist="Synth Band", album="Neon", genre="Synthwave", duration=245))
+    db.commit()
+
+    assert index.similar(6, 2) is None, "Not indexed yet"
+    assert index.similar(6, 2, db)[0] in (1, 2)
+    assert index.similar(99, 2, db) is None
+
+
+def test_index_is_built_in_the_background():
+    """start() builds the index off the request path, and stale indexes are rebuilt the same way"""
+    db, engine = make_session()
+    SessionLocal = session_factory(engine)
+    index = ContentIndex(max_age=0)
+    assert index.start(SessionLocal)
+    with index._lock:
+        assert index.similar(3, 1) == [4], "The build finished while holding the lock"
+    built_at = index._loaded_at
+
+    index.ensure_loaded(db)
+    with index._lock:
+        pass
+    assert index._loaded_at > built_at, "A stale index is rebuilt by ensure_loaded"
+
+
+def test_lsh_recall_against_exact_search():
+    """The LSH index finds most of the exact nearest neighbours"""
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((200, 64))
+    vectors = centres[rng.integers(0, 200, 20_000)] + 0.3 * rng.standard_normal((20_000, 64))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    index = LSHIndex(vectors, n_bits=12, exact_threshold=0)
+
+    recalls = []
+    for position in rng.integers(0, len(vectors), 50):
+        exact = set(np.argsort(-(vectors @ vectors[position]))[1:11])
+        approximate = set(index.query(vectors[position], 10, exclude=[position]))
+        recalls.append(len(exact & approximate) / 10)
+        assert len(index.candidates(vectors[position])) < len(vectors) / 4, "Lookups must not scan the catalog"
+
+    assert np.mean(recalls) >= 0.8, f"Recall too low: {np.mean(recalls)}"
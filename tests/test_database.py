@@ -0,0 +1,35 @@
+import asyncio
+
+from sqlalchemy import text
+
+from app import database
+
+
+def test_sqlite_engines_apply_pragmas(tmp_path):
+    """Every new connection, sync or async, gets the configured pragmas and pool"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = database.create_db_engine(url, pragmas={"cache_size": -1024}, pool_size=3)
+    with engine.connect() as connection:
+        pragmas = {name: connection.execute(text(f"PRAGMA {name}")).scalar()
+                   for name in ("journal_mode", "synchronous", "cache_size", "busy_timeout")}
+    assert pragmas == {"journal_mode": "wal", "synchronous": 1, "cache_size": -1024,
+                       "busy_timeout": int(database.SQLITE_PRAGMAS["busy_timeout"])}
+    assert engine.pool.size() == 3
+    engine.dispose()
+
+    async def async_pragmas():
+        async_engine = database.create_async_db_engine(url, pragmas={"journal_mode": "delete"})
+        async with async_engine.connect() as connection:
+            mode = (await connection.execute(text("PRAGMA journal_mode"))).scalar()
+            synchronous = (await connection.execute(text("PRAGMA synchronous"))).scalar()
+        await async_engine.dispose()
+        return mode, synchronous
+
+    assert asyncio.run(async_pragmas()) == ("delete", 1)
+
+
+def test_in_memory_engine_skips_pool_settings():
+    """Pool sizing is left out for in-memory SQLite, which lives in one connection"""
+    engine = database.create_db_engine("sqlite://")
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT 1")).scalar() == 1
@@ -0,0 +1,160 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+import auth
+import recommendations
+from app import archive, database, export
+from app.archive import HistoryArchive
+from app.models import ListeningHistory, Song, SongPopularity
+from app.recommender import popularity, rollups
+from helpers import listener, memory_engine, overrides, session_factory
+from main import app
+
+NOW = datetime(2026, 6, 15, 12)
+
+
+def make_session():
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    with SessionLocal() as db:
+        db.add_all([Song(id=i, title=f"Song {i}", artist="Band", genre="Rock", duration=100) for i in (1, 2)])
+        db.add_all([
+            ListeningHistory(user_id=user_id, song_id=None if days == 200 else days % 2 + 1,
+                             completed=days % 3 == 0, listened_at=NOW - timedelta(days=days, minutes=user_id))
+            for user_id in (1, 2, 5) for days in (0, 10, 40, 100, 200)
+        ])
+        db.commit()
+    return SessionLocal
+
+
+def test_archive_moves_old_rows_into_segments(tmp_path):
+    """Old plays leave the table for per user range and month segments that read back unchanged"""
+    SessionLocal = make_session()
+    history_archive = HistoryArchive(str(tmp_path), users_per_segment=2)
+    cutoff = NOW - timedelta(days=30)
+    with SessionLocal() as db:
+        expected = {
+            row.id: (row.user_id, row.song_id or -1, int(row.completed), row.listened_at)
+            for row in db.scalars(select(ListeningHistory).where(ListeningHistory.listened_at < datetime(2026, 5, 1)))
+        }
+        result = history_archive.archive(db, cutoff)
+        remaining = db.scalar(select(func.count()).select_from(ListeningHistory))
+
+    assert result["rows"] == len(expected) == 6, "Rows before the start of the cutoff month are archived"
+    assert remaining == 9
+    assert history_archive.archived_before() == datetime(2026, 5, 1)
+    paths = {entry["path"] for entry in history_archive.index()["segments"]}
+    assert "users-000000001-000000002/2026-03.seg" in paths and "users-000000005-000000006/2025-11.seg" in paths
+
+    archived = {}
+    for columns in history_archive.scan():
+        for history_id, user_id, song_id, completed, listened_at in zip(
+                columns["id"].tolist(), columns["user_id"].tolist(), columns["song_id"].tolist(),
+                columns["completed"].tolist(), archive.to_datetimes(columns["listened_at"])):
+            archived[history_id] = (user_id, song_id, completed, listened_at)
+    assert archived == expected
+
+    mine = [archive.to_datetimes(columns["listened_at"]) for columns in history_archive.scan(user_id=2)]
+    assert [len(part) for part in mine] == [1, 1]
+    assert sum(mine, []) == sorted(sum(mine, [])), "A user's archived plays come oldest first"
+
+
+def test_archive_rerun_merges_without_duplicates(tmp_path):
+    """Archiving a later cutoff adds to the existing segments and never copies a row twice"""
+    SessionLocal = make_session()
+    history_archive = HistoryArchive(str(tmp_path), users_per_segment=10)
+    with SessionLocal() as db:
+        rollups.backfill(db)
+        oldest = db.scalars(select(ListeningHistory).order_by(ListeningHistory.listened_at)).first()
+        kept = {column: getattr(oldest, column) for column in ("id", "user_id", "song_id", "completed", "listened_at")}
+        history_archive.archive(db, NOW - timedelta(days=150))
+        # A row back in the table, as after a run interrupted before its delete committed
+        db.add(ListeningHistory(**kept))
+        db.commit()
+        history_archive.archive(db, NOW - timedelta(days=150))
+        ids = [history_id for columns in history_archive.scan(["id"]) for history_id in columns["id"].tolist()]
+        assert len(ids) == len(set(ids)) == 3
+
+        history_archive.archive(db, NOW)
+        ids = [history_id for columns in history_archive.scan(["id"]) for history_id in columns["id"].tolist()]
+        assert len(ids) == len(set(ids)) == 9
+        assert db.scalar(select(func.count()).select_from(ListeningHistory)) == 6
+
+        since = history_archive.archived_before()
+        assert since == datetime(2026, 6, 1)
+        assert rollups.check(db)["mismatched"] > 0, "Rollups of archived plays no longer match the table"
+        assert rollups.check(db, since=since)["mismatched"] == 0
+        rollups.backfill(db, since)
+        assert rollups.check(db, since=since)["mismatched"] == 0
+        assert rollups.check(db)["mismatched"] > 0, "A backfill keeps the rollups of archived days"
+
+
+def test_export_includes_archived_plays(tmp_path, monkeypatch, overrides):
+    """The export starts with the user's archived plays, with their song details"""
+    SessionLocal = make_session()
+    history_archive = HistoryArchive(str(tmp_path), users_per_segment=2)
+    with SessionLocal() as db:
+        history_archive.archive(db, NOW - timedelta(days=30))
+
+    monkeypatch.setattr(database, "ReadSessionLocal", SessionLocal)
+    monkeypatch.setattr(export, "history_archive", history_archive)
+    overrides[auth.get_current_user] = listener
+    response = TestClient(app).get("/history/export")
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 5
+    assert [row["listened_at"] for row in rows] == sorted(row["listened_at"] for row in rows)
+    assert rows[0] == {"id": rows[0]["id"], "song_id": None, "completed": False,
+                       "listened_at": (NOW - timedelta(days=200, minutes=1)).isoformat(),
+                       "title": None, "artist": None, "album": None, "genre": None, "duration": None}
+    assert rows[1]["title"] == "Song 1" and rows[1]["completed"] is False
+
+
+def test_popularity_backfill_includes_archived_plays(tmp_path, monkeypatch):
+    """Backfilling after archiving gives every song the same plays, score and last play as before"""
+    SessionLocal = make_session()
+    history_archive = HistoryArchive(str(tmp_path), users_per_segment=2)
+    monkeypatch.setattr(popularity, "history_archive", history_archive)
+
+    def table(db):
+        return {row.song_id: (row.plays, pytest.approx(row.score), row.last_played_at)
+                for row in db.scalars(select(SongPopularity))}
+
+    with SessionLocal() as db:
+        popularity.backfill(db)
+        before = table(db)
+        history_archive.archive(db, NOW - timedelta(days=30))
+        popularity.backfill(db)
+        assert table(db) == before
+
+
+def test_archived_songs_still_count_as_heard(tmp_path, monkeypatch):
+    """Songs whose plays were archived are not recommended again"""
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    history_archive = HistoryArchive(str(tmp_path))
+    monkeypatch.setattr(recommendations, "history_archive", history_archive)
+    with SessionLocal() as db:
+        db.add_all([Song(id=i, title=f"Song {i}", artist="Band", genre="Rock") for i in range(1, 6)])
+        db.add_all([ListeningHistory(user_id=1, song_id=1, completed=True, listened_at=NOW - timedelta(days=100)),
+                    ListeningHistory(user_id=1, song_id=2, completed=True, listened_at=NOW)])
+        db.commit()
+        history_archive.archive(db, NOW - timedelta(days=30))
+
+        assert recommendations._unheard(db, 1, [1, 2, 3]) == [3]
+        scans = []
+        scan = history_archive.scan
+        monkeypatch.setattr(history_archive, "scan", lambda *args, **kwargs: scans.append(args) or scan(*args, **kwargs))
+        assert history_archive.song_ids(1).tolist() == [1]
+        assert scans == [], "Archived song ids are cached until the archive changes"
+        for engine_name in (recommendations.RecommendationEngine.HISTORY,
+                            recommendations.RecommendationEngine.SET_BASED):
+            songs = recommendations.get_recommendations_based_on_history(db, 1, 2, engine_name)
+            assert [song.id for song in songs] == [3, 4], f"{engine_name} recommends an archived song"
+
+        history_archive.archive(db, NOW + timedelta(days=31))
+        assert history_archive.song_ids(1).tolist() == [1, 2] and scans, "A new archive run is read again"
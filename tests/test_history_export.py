@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import auth
+from app import database, export
+from app.models import ListeningHistory, Song
+from helpers import listener, memory_engine, overrides, session_factory
+from main import app
+
+
+def test_export_streams_history_with_song_details(monkeypatch, overrides):
+    """NDJSON and CSV exports hold every play of the user, oldest first"""
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    start = datetime(2026, 1, 1)
+    with SessionLocal() as db:
+        db.add_all([Song(id=i, title=f"Song {i}", artist=f"Artist {i}", genre="Jazz", duration=200 + i)
+                    for i in range(1, 4)])
+        db.add_all([
+            ListeningHistory(user_id=user_id, song_id=i % 3 + 1, completed=i % 2 == 0,
+                             listened_at=start + timedelta(hours=i))
+            for i in range(10) for user_id in (1, 2)
+        ])
+        db.commit()
+
+    monkeypatch.setattr(database, "ReadSessionLocal", SessionLocal)
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 3)
+    overrides[auth.get_current_user] = listener
+    client = TestClient(app)
+    ndjson = client.get("/history/export")
+    as_csv = client.get("/history/export?format=csv")
+    assert client.get("/history/export?format=xml").status_code == 422
+
+    assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in ndjson.text.splitlines()]
+    assert len(rows) == 10, "Only the current user's plays are exported"
+    assert [row["listened_at"] for row in rows] == sorted(row["listened_at"] for row in rows)
+    assert rows[0] == {"id": rows[0]["id"], "song_id": 1, "completed": True, "listened_at": "2026-01-01T00:00:00",
+                       "title": "Song 1", "artist": "Artist 1", "album": None, "genre": "Jazz", "duration": 201}
+
+    assert as_csv.headers["content-disposition"] == 'attachment; filename="history-1.csv"'
+    csv_rows = list(csv.DictReader(io.StringIO(as_csv.text)))
+    assert [int(row["id"]) for row in csv_rows] == [row["id"] for row in rows]
+    assert csv_rows[1]["title"] == "Song 2"
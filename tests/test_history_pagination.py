@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import text, update
+
+import auth
+from app.database import get_read_db
+from app.models import ListeningHistory, Song
+from helpers import listener, memory_engine, overrides, session_factory, yield_sessions
+from main import app
+
+
+def make_client(overrides):
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    start = datetime(2026, 1, 1)
+    with SessionLocal() as db:
+        db.add_all([Song(id=i, title=f"Song {i}", artist="Artist") for i in range(1, 6)])
+        # Plays share timestamps in threes, so pages must split ties by id
+        db.add_all([
+            ListeningHistory(user_id=user_id, song_id=i % 5 + 1, listened_at=start + timedelta(minutes=i // 3))
+            for i in range(250) for user_id in (1, 2)
+        ])
+        db.commit()
+
+    overrides[get_read_db] = yield_sessions(SessionLocal)
+    overrides[auth.get_current_user] = listener
+    return engine, TestClient(app)
+
+
+def walk_pages(client, limit):
+    seen, cursor = [], None
+    while True:
+        page = client.get("/history/page", params={"limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert page.status_code == 200, page.text
+        seen += [item["id"] for item in page.json()["items"]]
+        cursor = page.json()["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+def test_cursor_pages_match_offset_pages(overrides):
+    """Walking the cursor returns every play once, in skip/limit order"""
+    engine, client = make_client(overrides)
+    expected = [item["id"] for item in client.get("/history/?limit=1000").json()]
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = client.get("/history/page", params={"limit": 40, **({"cursor": cursor} if cursor else {})}).json()
+        seen += [item["id"] for item in page["items"]]
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert client.get("/history/page", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/history/?skip=240&limit=40").json()[0]["id"] == expected[240], "skip/limit still works"
+
+    assert len(expected) == 250
+    assert seen == expected
+    assert pages == 7
+
+    with engine.connect() as connection:
+        plan = connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT * FROM listening_history WHERE user_id = 1 "
+            "AND (listened_at, id) < ('2026-01-01 01:00:00', 100) ORDER BY listened_at DESC, id DESC LIMIT 40"
+        )).all()
+    assert any("ix_listening_history_user_listened_at_id" in row[-1] for row in plan), plan
+
+
+def test_cursor_pages_include_plays_without_a_timestamp(overrides):
+    """Plays with no listened_at come last and can end a page"""
+    engine, client = make_client(overrides)
+    with session_factory(engine)() as db:
+        db.add_all([ListeningHistory(user_id=1, song_id=1) for _ in range(5)])
+        db.flush()
+        # The column default fills in an explicit None, so clear it afterwards
+        db.execute(update(ListeningHistory).where(ListeningHistory.id > 500).values(listened_at=None))
+        db.commit()
+    expected = [item["id"] for item in client.get("/history/?limit=1000").json()]
+    # 42 per page: the sixth page runs from dated plays into undated ones and ends on one
+    seen = walk_pages(client, 42)
+
+    assert len(expected) == 255
+    assert seen == expected
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+import auth
+import history
+from app import database, internal
+from app.models import ListeningHistory, Song, SongPopularity
+from app.writebehind import QueueFull, WriteBehindQueue
+from helpers import listener, memory_engine, overrides, session_factory
+from main import app
+
+
+def test_batches_by_rows_and_drains_on_stop():
+    """Full batches flush right away and stop() flushes the remainder"""
+    batches = []
+    writer = WriteBehindQueue(batches.append, max_rows=10, interval=60, maxsize=100)
+    writer.start()
+    for i in range(25):
+        writer.put(i)
+    writer.stop()
+
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [item for batch in batches for item in batch] == list(range(25)), "Order is kept"
+    stats = writer.stats()
+    assert (stats["enqueued"], stats["flushed_rows"], stats["flushes"], stats["queue_depth"]) == (25, 25, 3, 0)
+    assert not stats["running"]
+
+
+def test_full_queue_rejects_after_timeout():
+    """Producers get QueueFull instead of growing the queue without bound"""
+    release = threading.Event()
+    flushed = []
+
+    def slow_flush(batch):
+        release.wait(5)
+        flushed.extend(batch)
+
+    writer = WriteBehindQueue(slow_flush, max_rows=1, interval=0, maxsize=2, put_timeout=0.05)
+    writer.start()
+    accepted = 0
+    with pytest.raises(QueueFull):
+        for i in range(10):
+            writer.put(i)
+            accepted += 1
+    assert writer.stats()["rejected"] == 1
+
+    release.set()
+    writer.stop()
+    assert flushed == list(range(accepted)), "Every accepted item is flushed"
+
+
+def test_put_racing_stop_is_flushed():
+    """An item put while the worker stops is flushed, never queued behind the stop marker"""
+    flushed = []
+    writer = WriteBehindQueue(flushed.extend, max_rows=10, interval=60, maxsize=100)
+    writer.start()
+    in_put, release = threading.Event(), threading.Event()
+    enqueue = writer._queue.put
+
+    def slow_put(item, *args, **kwargs):
+        if item == "late":
+            # The producer has seen the worker running but not enqueued yet
+            in_put.set()
+            release.wait(5)
+        enqueue(item, *args, **kwargs)
+
+    writer._queue.put = slow_put
+    producer = threading.Thread(target=writer.put, args=("late",))
+    producer.start()
+    in_put.wait(5)
+    stopper = threading.Thread(target=writer.stop)
+    stopper.start()
+    stopper.join(0.1)
+    release.set()
+    stopper.join()
+    producer.join()
+    assert flushed == ["late"]
+
+
+def make_songs_database():
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    with SessionLocal() as db:
+        db.add_all([Song(id=i, title=f"Song {i}", artist="Artist", genre="Rock") for i in range(1, 4)])
+        db.commit()
+    return SessionLocal
+
+
+def test_bad_plays_do_not_drop_their_batch(monkeypatch):
+    """Plays of unknown songs and rows the database rejects are dropped alone"""
+    SessionLocal = make_songs_database()
+    insert_plays = history.insert_plays
+
+    def reject_song_3(db, rows):
+        if any(row["song_id"] == 3 for row in rows):
+            raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+        insert_plays(db, rows)
+
+    monkeypatch.setattr(history, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(history, "insert_plays", reject_song_3)
+    writer = WriteBehindQueue(history._flush_plays, max_rows=100, interval=60, maxsize=100)
+    now = history.datetime.now()
+    for song_id in (1, 3, 99, 2):
+        writer.put({"user_id": 1, "song_id": song_id, "listened_at": now, "completed": True})
+
+    with SessionLocal() as db:
+        assert sorted(db.scalars(select(ListeningHistory.song_id))) == [1, 2]
+    stats = writer.stats()
+    assert (stats["flushed_rows"], stats["failed_rows"]) == (2, 2)
+
+
+def test_write_behind_history_endpoint(monkeypatch, overrides):
+    """Queued plays are acknowledged with 202 and committed by the worker"""
+    SessionLocal = make_songs_database()
+
+    writer = WriteBehindQueue(history._flush_plays, max_rows=100, interval=60, maxsize=100)
+    monkeypatch.setattr(history, "HISTORY_WRITE_BEHIND", True)
+    monkeypatch.setattr(history, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(database, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(history, "history_writer", writer)
+    monkeypatch.setattr(internal, "INTERNAL_API_KEY", "internal")
+    overrides[auth.get_current_user] = listener
+    try:
+        writer.start()
+        client = TestClient(app)
+        responses = [client.post("/history/", json={"song_id": i, "completed": True}) for i in (1, 2, 2)]
+        unknown = client.post("/history/", json={"song_id": 99, "completed": True})
+        with SessionLocal() as db:
+            assert db.scalar(select(func.count(ListeningHistory.id))) == 0, "Nothing is written before a flush"
+        stats = client.get("/history/writer", headers={"X-Internal-Key": "internal"}).json()
+        assert (stats["enqueued"], stats["flushed_rows"]) == (3, 0)
+    finally:
+        writer.stop()
+
+    assert [response.status_code for response in responses] == [202] * 3
+    assert unknown.status_code == 404, "Unknown songs are rejected before they are queued"
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count(ListeningHistory.id))) == 3
+        assert db.scalar(select(SongPopularity.plays).where(SongPopularity.song_id == 2)) == 2
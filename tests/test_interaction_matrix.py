@@ -0,0 +1,83 @@
+import numpy as np
+from sqlalchemy import event
+
+from app.models import ListeningHistory, Song
+from app.recommender.interactions import InteractionMatrix
+from helpers import memory_engine, session_factory
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    db.add_all([Song(id=i, title=f"Song {i}", artist="Artist") for i in range(1, 11)])
+    plays = [
+        (1, 1, True), (1, 2, True), (1, 3, False),
+        (2, 1, True), (2, 2, True), (2, 4, True),
+        (3, 2, True), (3, 4, False), (3, 5, True),
+    ]
+    db.add_all([ListeningHistory(user_id=u, song_id=s, completed=c) for u, s, c in plays])
+    db.commit()
+    return db
+
+
+def add_play(db, matrix, user_id, song_id, completed):
+    db.add(ListeningHistory(user_id=user_id, song_id=song_id, completed=completed))
+    db.commit()
+    matrix.record(user_id, song_id, completed)
+
+
+def test_collaborative_scores_co_listened_songs():
+    """Songs heard by similar users are recommended, heard songs are not"""
+    db = make_session()
+    matrix = InteractionMatrix()
+    matrix.load(db)
+
+    recommended = matrix.recommend(1, 10)
+    assert recommended[0] == 4, f"Song 4 is co-listened with songs 1 and 2: {recommended}"
+    assert not {1, 2, 3} & set(recommended), "Already heard songs must be excluded"
+    assert matrix.recommend(99, 10) == [], "Unknown users get no collaborative scores"
+
+
+def test_record_updates_matrix_in_place():
+    """Recording plays gives the same scores as rebuilding from the table"""
+    db = make_session()
+    matrix = InteractionMatrix(compact_threshold=3)
+    matrix.load(db)
+    data = matrix._matrix.data
+
+    add_play(db, matrix, 1, 1, False)
+    assert matrix._matrix.data is data, "Existing pairs must update the CSR data in place"
+
+    add_play(db, matrix, 1, 5, True)
+    add_play(db, matrix, 4, 6, True)
+    add_play(db, matrix, 4, 2, True)
+    add_play(db, matrix, 2, 6, False)
+
+    rebuilt = InteractionMatrix()
+    rebuilt.load(db)
+    for user_id in (1, 2, 3, 4):
+        assert np.allclose(
+            matrix.scores(user_id)[np.argsort(matrix._song_ids)],
+            rebuilt.scores(user_id)[np.argsort(rebuilt._song_ids)],
+        ), f"Incremental scores differ from a rebuild for user {user_id}"
+        assert matrix.recommend(user_id, 5) == rebuilt.recommend(user_id, 5)
+
+
+def test_plays_recorded_during_a_load_are_kept():
+    """A play committed after the load's query ran is applied once the new matrix is in place"""
+    db = make_session()
+    matrix = InteractionMatrix()
+    recorded = []
+
+    def play_during_load(*args):
+        if not recorded:
+            # Committed and recorded elsewhere while the SELECT is running
+            recorded.append(True)
+            matrix.record(4, 7, True)
+
+    event.listen(db.get_bind(), "after_cursor_execute", play_during_load)
+    matrix.load(db)
+    event.remove(db.get_bind(), "after_cursor_execute", play_during_load)
+
+    assert recorded and matrix.shape == (4, 6)
+    assert matrix.scores(4) is not None, "The buffered play made user 4 known"
@@ -0,0 +1,57 @@
+from app.models import ListeningHistory, Song
+from app.recommender.neighbours import NeighbourIndex, build_index
+from helpers import memory_engine, session_factory
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    db.add_all([
+        Song(id=1, title="A", artist="Band", genre="Rock"),
+        Song(id=2, title="B", artist="Band", genre="Rock"),
+        Song(id=3, title="C", artist="Singer", genre="Pop"),
+        Song(id=4, title="D", artist="Trio", genre="Jazz"),
+        Song(id=5, title="E", artist="Other", genre="Pop"),
+    ])
+    db.add_all([
+        ListeningHistory(user_id=u, song_id=s, completed=True)
+        for u, s in [(1, 1), (1, 3), (2, 1), (2, 3), (3, 4), (3, 5)]
+    ])
+    db.commit()
+    return db
+
+
+def test_index_lookup_and_merge(tmp_path):
+    """Neighbours combine co-listening with shared artist and genre"""
+    db = make_session()
+    path = str(tmp_path / "neighbours.idx")
+    assert build_index(db, path, k=3) == 5
+
+    index = NeighbourIndex(path, refresh_seconds=3600)
+    assert index.open()
+    neighbours, scores = index.lookup(1)
+    assert list(neighbours[:2]) == [3, 2], f"Unexpected neighbours of song 1: {list(neighbours)}"
+    assert scores[0] >= scores[1]
+    assert len(index.lookup(42)[0]) == 0, "Unknown songs have no neighbours"
+
+    merged = index.merge({1: 1.0}, exclude={3}, limit=2)
+    assert merged[0] == 2 and 3 not in merged
+
+
+def test_rebuilt_index_is_picked_up_without_reopening(tmp_path):
+    """An atomically swapped index file is seen by an already open reader"""
+    db = make_session()
+    path = str(tmp_path / "neighbours.idx")
+    build_index(db, path, k=3)
+    index = NeighbourIndex(path, refresh_seconds=0)
+    index.open()
+    assert index.lookup(6)[0].size == 0
+
+    db.add(Song(id=6, title="F", artist="Trio", genre="Jazz"))
+    db.add(ListeningHistory(user_id=3, song_id=6, completed=True))
+    db.commit()
+    build_index(db, path, k=3)
+
+    neighbours, _ = index.lookup(6)
+    assert 4 in list(neighbours), "Reader should serve the rebuilt index"
+    assert list(tmp_path.iterdir()) == [tmp_path / "neighbours.idx"], "Temporary files must not be left behind"
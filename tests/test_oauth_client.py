@@ -0,0 +1,156 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Form
+from jose import jwt
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from app import internal
+from app.auth import client as oauth
+from app.auth import utils
+from app.auth.client import OAuthClient, ProviderSettings, oauth_client
+from app.database import get_async_db
+from app.models import Base, OAuthIdentity, User
+from helpers import async_session_factory, overrides, yield_async_sessions
+from main import app
+
+
+def make_client(handler, retries=2, retry_reserve=10.0) -> OAuthClient:
+    settings = ProviderSettings(timeout=2, connect_timeout=0.5, retries=retries, retry_ratio=0.0,
+                                retry_reserve=retry_reserve)
+    return OAuthClient({"stub": settings}, transport=httpx.MockTransport(handler))
+
+
+def test_login_storm_shares_one_client_against_a_stub_provider(monkeypatch):
+    """Concurrent provider callbacks all go through the shared client and its transport"""
+    stub = FastAPI()
+    codes = []
+
+    @stub.post("/login/oauth/access_token")
+    async def exchange_code(code: str = Form()):
+        codes.append(code)
+        await asyncio.sleep(0.01)
+        # Every code is rejected, the callback answers 400 without touching the users table
+        return {"error": "bad_verification_code"}
+
+    async def storm():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            responses = await asyncio.gather(*(client.get("/auth/github/", params={"code": f"code-{i}"})
+                                               for i in range(50)))
+            stats = (await client.get("/auth/provider-requests", headers={"X-Internal-Key": "internal"})).json()
+        await oauth_client.stop()
+        return responses, stats
+
+    monkeypatch.setattr(internal, "INTERNAL_API_KEY", "internal")
+    before = oauth_client.stats()["github"]
+    oauth_client.start(httpx.ASGITransport(app=stub))
+    responses, stats = asyncio.run(storm())
+
+    assert [response.status_code for response in responses] == [400] * 50
+    assert sorted(codes) == sorted(f"code-{i}" for i in range(50))
+    assert stats["running"] and stats["github"]["requests"] - before["requests"] == 50
+    assert not oauth_client.running, "stop() closes the pool"
+
+
+def test_gets_are_retried_with_the_provider_timeout(monkeypatch):
+    """A GET answered with 503 is retried, and every attempt carries the provider's timeouts"""
+    monkeypatch.setattr(oauth, "OAUTH_RETRY_BACKOFF", 0)
+    timeouts = []
+
+    def handler(request):
+        timeouts.append(request.extensions["timeout"])
+        return httpx.Response(503 if len(timeouts) < 3 else 200, json={"id": 1})
+
+    client = make_client(handler)
+    response = asyncio.run(client.get("stub", "https://provider.test/user"))
+    assert response.status_code == 200 and len(timeouts) == 3
+    assert timeouts[0] == {"connect": 0.5, "read": 2, "write": 2, "pool": 2}
+    assert client.stats()["stub"]["retries"] == 2
+
+
+def test_retry_budget_limits_retries_during_an_outage(monkeypatch):
+    """Once the budget is spent a failing provider gets one attempt per request"""
+    monkeypatch.setattr(oauth, "OAUTH_RETRY_BACKOFF", 0)
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.method)
+        return httpx.Response(503)
+
+    client = make_client(handler, retries=3, retry_reserve=2)
+
+    async def outage():
+        return [await client.get("stub", "https://provider.test/user") for _ in range(3)]
+
+    assert [response.status_code for response in asyncio.run(outage())] == [503] * 3
+    assert len(attempts) == 5, "Two retries from the reserve, then none"
+    stats = client.stats()["stub"]
+    assert (stats["requests"], stats["retries"], stats["budget_exhausted"]) == (3, 2, 3)
+
+
+def test_posts_are_only_retried_when_never_sent(monkeypatch):
+    """Code exchanges are single use: a 503 is returned as is, a refused connection is retried"""
+    monkeypatch.setattr(oauth, "OAUTH_RETRY_BACKOFF", 0)
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.path)
+        if request.url.path == "/refused" and len(attempts) == 1:
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(503 if request.url.path == "/token" else 200)
+
+    client = make_client(handler)
+    assert asyncio.run(client.post("stub", "https://provider.test/refused")).status_code == 200
+    assert asyncio.run(client.post("stub", "https://provider.test/token")).status_code == 503
+    assert attempts == ["/refused", "/refused", "/token"]
+
+    def down(request):
+        raise httpx.ConnectError("Connection refused", request=request)
+
+    client = make_client(down, retries=1)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(client.post("stub", "https://provider.test/token"))
+    assert client.stats()["stub"]["failures"] == 1
+
+
+def test_successful_login_creates_the_user_once(tmp_path, overrides):
+    """A provider login creates the user and its identity, sets both token cookies, and reuses them next time"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        # The provider's login name is taken, so the new user gets a generated one
+        db.add(User(username="octocat", email="someone@example.com", hashed_password="-"))
+        db.commit()
+    stub = FastAPI()
+
+    @stub.post("/login/oauth/access_token")
+    async def exchange_code(code: str = Form()):
+        return {"access_token": f"token-{code}"}
+
+    @stub.get("/user")
+    async def read_user():
+        return {"id": 583231, "login": "octocat", "email": "octocat@example.com"}
+
+    async def log_in_twice():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+            responses = [await client.get("/auth/github/", params={"code": code}) for code in ("a", "b")]
+        await oauth_client.stop()
+        return responses
+
+    overrides[get_async_db] = yield_async_sessions(async_session_factory(url))
+    oauth_client.start(httpx.ASGITransport(app=stub))
+    responses = asyncio.run(log_in_twice())
+
+    assert [response.status_code for response in responses] == [303, 303]
+    with Session(engine) as db:
+        user = db.scalar(select(User).join(OAuthIdentity, OAuthIdentity.user_id == User.id))
+        assert (user.username, user.email) == ("github-583231", "octocat@example.com")
+        assert db.scalar(select(func.count(User.id))) == 2, "The second login reuses the user"
+    for response in responses:
+        access = jwt.decode(response.cookies["access_token"], utils.SECRET_KEY, algorithms=[utils.ALGORITHM])
+        refresh = jwt.decode(response.cookies["refresh_token"], utils.SECRET_KEY, algorithms=[utils.ALGORITHM])
+        assert (access["uid"], access["sub"]) == (user.id, "github-583231")
+        assert refresh["refresh"] and refresh["uid"] == user.id
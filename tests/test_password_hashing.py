@@ -0,0 +1,125 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from app import hashing
+from app.auth import utils
+from app.database import get_async_db
+from app.hashing import HashingOverloaded, PasswordHasher
+from app.models import Base, User
+from helpers import async_session_factory, overrides, yield_async_sessions
+from main import app
+
+
+def test_hashes_round_trip_through_worker_processes():
+    """Hashing and verification run in the process pool and are timed"""
+    hasher = PasswordHasher(workers=2, max_pending=4)
+
+    async def hash_and_verify():
+        hashed = await hasher.hash("secret")
+        return await asyncio.gather(hasher.verify("secret", hashed), hasher.verify("wrong", hashed))
+
+    try:
+        assert asyncio.run(hash_and_verify()) == [True, False]
+    finally:
+        hasher.stop()
+    stats = hasher.stats()
+    assert (stats["completed"], stats["pending"], stats["rejected"]) == (3, 0, 0)
+    assert stats["hash_mean_ms"] > 0 and stats["queue_wait_max_ms"] >= 0
+
+
+def test_saturated_hasher_fails_fast(monkeypatch):
+    """Calls beyond max_pending are rejected at once while the others complete"""
+    release = threading.Event()
+
+    def blocked_verify(plain_password, hashed_password):
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(hashing, "verify_password", blocked_verify)
+    hasher = PasswordHasher(workers=1, max_pending=2, executor_factory=ThreadPoolExecutor)
+
+    async def burst():
+        running = [asyncio.create_task(hasher.verify("secret", "hash")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HashingOverloaded):
+            await hasher.verify("secret", "hash")
+        release.set()
+        return await asyncio.gather(*running)
+
+    try:
+        assert asyncio.run(burst()) == [True, True]
+    finally:
+        hasher.stop()
+    stats = hasher.stats()
+    assert (stats["completed"], stats["rejected"]) == (2, 1)
+    assert stats["queue_wait_max_ms"] > 10, "The second call waited behind the only worker"
+
+
+def test_calibrated_policy_sets_the_work_factor(tmp_path):
+    """Calibration picks rounds within the scheme's bounds and the saved policy is reloaded"""
+    policy = hashing.calibrate("pbkdf2_sha256", target_ms=5)
+    assert policy["scheme"] == "pbkdf2_sha256" and policy["rounds"] >= 1
+    path = str(tmp_path / "policy.json")
+    hashing.save_policy(policy, path)
+    assert hashing.load_policy(path, "pbkdf2_sha256") == policy
+    assert hashing.load_policy(path, "sha256_crypt")["rounds"] is None, "A policy for another scheme is ignored"
+
+    context = hashing.build_context("pbkdf2_sha256", policy["rounds"])
+    assert f"${policy['rounds']}$" in context.hash("secret")
+
+
+def test_workers_share_one_calibration(tmp_path, monkeypatch):
+    """Workers starting together calibrate once and all apply the saved policy"""
+    path = str(tmp_path / "policy.json")
+    calls = []
+
+    def calibrate(scheme):
+        calls.append(scheme)
+        return {"scheme": scheme, "rounds": 1000 + len(calls)}
+
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_CALIBRATE", True)
+    monkeypatch.setattr(hashing, "calibrate", calibrate)
+    applied = []
+    monkeypatch.setattr(hashing, "apply_policy", applied.append)
+
+    workers = [threading.Thread(target=hashing.ensure_calibrated, args=(path, "pbkdf2_sha256")) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert calls == ["pbkdf2_sha256"], "Only the first worker calibrates"
+    assert applied == [{"scheme": "pbkdf2_sha256", "rounds": 1001}] * 4
+    assert hashing.load_policy(path, "pbkdf2_sha256")["rounds"] == 1001
+
+
+def test_login_rehashes_outdated_hashes(tmp_path, monkeypatch, overrides):
+    """A successful login replaces a hash in another scheme or with other rounds"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    old_hash = hashing.build_context("pbkdf2_sha256", 1000).hash("secret")
+    with Session(engine) as db:
+        db.add(User(username="listener", email="listener@example.com", hashed_password=old_hash))
+        db.commit()
+
+    monkeypatch.setattr(hashing, "pwd_context", hashing.build_context("sha256_crypt", 1000))
+    monkeypatch.setattr(utils, "password_hasher", PasswordHasher(1, 4, ThreadPoolExecutor))
+    overrides[get_async_db] = yield_async_sessions(async_session_factory(url))
+    client = TestClient(app)
+    assert client.post("/token", data={"username": "listener", "password": "wrong"}).status_code == 401
+    with Session(engine) as db:
+        assert db.scalar(select(User.hashed_password)) == old_hash, "Failed logins leave the hash alone"
+    assert client.post("/token", data={"username": "listener", "password": "secret"}).status_code == 200
+    with Session(engine) as db:
+        new_hash = db.scalar(select(User.hashed_password))
+    assert new_hash.startswith("$5$rounds=1000$")
+    assert client.post("/token", data={"username": "listener", "password": "secret"}).status_code == 200
+    with Session(engine) as db:
+        assert db.scalar(select(User.hashed_password)) == new_hash, "Current hashes are kept"
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+
+from app.models import ListeningHistory, Song, SongPopularity
+from app.recommender import popularity
+from helpers import memory_engine, session_factory
+from recommendations import get_recommendations_based_on_history
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    db.add_all([
+        Song(id=1, title="Old hit", artist="A", genre="Rock"),
+        Song(id=2, title="New hit", artist="B", genre="Pop"),
+        Song(id=3, title="Rock single", artist="C", genre="Rock"),
+        Song(id=4, title="Never played", artist="D", genre="Jazz"),
+    ])
+    db.commit()
+    return db
+
+
+def play(db, song_id, listened_at, times=1):
+    for _ in range(times):
+        db.add(ListeningHistory(user_id=1, song_id=song_id, completed=True, listened_at=listened_at))
+        popularity.record_plays(db, [(song_id, listened_at)])
+    db.commit()
+
+
+def test_recent_plays_outrank_older_plays():
+    """Decay lets a few recent plays beat many old ones"""
+    db = make_session()
+    now = datetime.now()
+    play(db, 1, now - timedelta(days=60), times=10)
+    play(db, 2, now - timedelta(hours=1), times=3)
+    play(db, 3, now - timedelta(days=1), times=1)
+
+    ranked = popularity.trending(db, 10)
+    assert [song.id for song, _ in ranked] == [2, 3, 1]
+    assert 2.5 < ranked[0][1] <= 3, f"Three fresh plays should score about 3: {ranked[0][1]}"
+    assert [song.id for song, _ in popularity.trending(db, 10, genre="Rock")] == [3, 1]
+    assert db.get(SongPopularity, 1).plays == 10
+
+
+def test_backfill_matches_incremental_updates():
+    """Rebuilding from history gives the incrementally maintained table"""
+    db = make_session()
+    now = datetime.now()
+    play(db, 1, now - timedelta(days=3), times=2)
+    play(db, 2, now, times=1)
+    incremental = {row.song_id: (row.plays, row.score) for row in db.query(SongPopularity)}
+
+    popularity.backfill(db)
+    rebuilt = {row.song_id: (row.plays, row.score) for row in db.query(SongPopularity)}
+
+    assert incremental.keys() == rebuilt.keys()
+    for song_id, (plays, score) in incremental.items():
+        assert rebuilt[song_id][0] == plays
+        assert abs(rebuilt[song_id][1] - score) < 1e-9 * score
+
+
+def test_users_without_history_get_trending_songs():
+    """Cold-start recommendations lead with trending songs"""
+    db = make_session()
+    play(db, 3, datetime.now(), times=2)
+    play(db, 2, datetime.now(), times=1)
+
+    recommended = get_recommendations_based_on_history(db, 99, 3)
+    assert [song.id for song in recommended] == [3, 2, 1]
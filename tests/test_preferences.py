@@ -0,0 +1,51 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select
+
+import auth
+from app import database, preferences
+from app.cache import TTLCache
+from app.models import UserPreferences
+from helpers import listener, memory_engine, overrides, session_factory
+from main import app
+
+
+def test_preferences_read_without_writes_and_from_cache(monkeypatch, overrides):
+    """GET builds defaults without storing them, repeats come from the cache and PUT invalidates it"""
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    monkeypatch.setattr(database, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(database, "ReadSessionLocal", SessionLocal)
+    monkeypatch.setattr(preferences, "preference_cache", TTLCache(maxsize=10, ttl=60, group=lambda key: key))
+    overrides[auth.get_current_user] = listener
+    client = TestClient(app)
+    first = client.get("/history/preferences").json()
+    second = client.get("/history/preferences").json()
+    reads = [statement for statement in statements if "preferences" in statement]
+    updated = client.put("/history/preferences", json={"genre_preference": ["Jazz"]}).json()
+    third = client.get("/history/preferences").json()
+
+    assert first == second == {"id": None, "user_id": 1, "genre_preference": None,
+                               "artist_preference": None, "language_preference": None}
+    assert len(reads) == 1 and reads[0].lstrip().upper().startswith("SELECT"), \
+        "The first GET reads once, the second is served from the cache"
+    assert third == updated and third["genre_preference"] == ["Jazz"], "PUT drops the cached defaults"
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count()).select_from(UserPreferences)) == 1
+
+
+def test_update_is_written_through_to_the_cache(monkeypatch, overrides):
+    """After a PUT, GET returns the committed row even while the replica lags behind"""
+    # The replica never receives the update
+    monkeypatch.setattr(database, "SessionLocal", session_factory(memory_engine()))
+    monkeypatch.setattr(database, "ReadSessionLocal", session_factory(memory_engine()))
+    monkeypatch.setattr(preferences, "preference_cache", TTLCache(maxsize=10, ttl=60, group=lambda key: key))
+    overrides[auth.get_current_user] = listener
+    client = TestClient(app)
+    assert client.get("/history/preferences").json()["genre_preference"] is None
+    updated = client.put("/history/preferences", json={"genre_preference": ["Jazz"]}).json()
+    after = client.get("/history/preferences").json()
+
+    assert after == updated and after["genre_preference"] == ["Jazz"]
@@ -0,0 +1,85 @@
+import time
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app import internal, principals
+from app.auth.utils import create_access_token
+from app.cache import TTLCache
+from app.database import async_database_url, get_async_read_db
+from app.models import Base, User
+from helpers import overrides, yield_async_sessions
+from main import app
+
+
+def make_database(tmp_path):
+    tmp_path.mkdir(parents=True, exist_ok=True)
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add(User(username="listener", email="listener@example.com", hashed_password="-"))
+        db.commit()
+    async_engine = create_async_engine(async_database_url(url))
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    return engine, statements, yield_async_sessions(async_sessionmaker(async_engine, expire_on_commit=False))
+
+
+def test_current_user_comes_from_the_principal_cache(tmp_path, monkeypatch, overrides):
+    """Repeated requests with a token look the user up once, until the user is deactivated"""
+    engine, statements, read_sessions = make_database(tmp_path)
+    monkeypatch.setattr(principals, "committed_principals", TTLCache(maxsize=10, ttl=60))
+    before = principals.principal_cache.stats()
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'listener'})}"}
+    overrides[get_async_read_db] = read_sessions
+    client = TestClient(app)
+    responses = [client.get("/users/me/", headers=headers) for _ in range(3)]
+    assert len(statements) == 1, "Only the first request queries the user"
+    assert [response.json()["email"] for response in responses] == ["listener@example.com"] * 3
+    assert client.get("/principal-cache").status_code == 403, "Stats are for internal callers"
+    monkeypatch.setattr(internal, "INTERNAL_API_KEY", "internal")
+    stats = client.get("/principal-cache", headers={"X-Internal-Key": "internal"}).json()
+    assert (stats["hits"] - before["hits"], stats["misses"] - before["misses"]) == (2, 1)
+
+    with Session(engine) as db:
+        db.scalar(select(User)).is_active = False
+        db.commit()
+    assert principals.principal_cache.get(("listener", headers["Authorization"][7:])) is None, \
+        "Deactivating the user drops its principals"
+    assert client.get("/users/me/", headers=headers).status_code == 401
+
+
+def test_principal_expires_with_its_token(tmp_path, monkeypatch, overrides):
+    """A principal is never cached past the token's exp claim"""
+    engine, statements, read_sessions = make_database(tmp_path)
+    monkeypatch.setattr(principals, "principal_cache", TTLCache(maxsize=10, ttl=60, group=lambda key: key[0]))
+    monkeypatch.setattr(principals, "committed_principals", TTLCache(maxsize=10, ttl=60))
+    token = create_access_token({"sub": "listener"}, expires_delta=timedelta(seconds=30))
+    overrides[get_async_read_db] = read_sessions
+    assert TestClient(app).get("/users/me/", headers={"Authorization": f"Bearer {token}"}).status_code == 200
+
+    expires_at, principal = principals.principal_cache._entries[("listener", token)]
+    assert expires_at - time.monotonic() <= 30, "The entry ends with the token rather than the cache TTL"
+    assert principal.username == "listener" and principal.is_active
+
+
+def test_deactivation_is_not_undone_by_a_lagging_replica(tmp_path, monkeypatch, overrides):
+    """After a commit on the primary, the cache refills from the committed row, not the stale replica"""
+    primary, _, _ = make_database(tmp_path / "primary")
+    _, statements, read_sessions = make_database(tmp_path / "replica")
+    monkeypatch.setattr(principals, "principal_cache", TTLCache(maxsize=10, ttl=60, group=lambda key: key[0]))
+    monkeypatch.setattr(principals, "committed_principals", TTLCache(maxsize=10, ttl=60))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'listener'})}"}
+    overrides[get_async_read_db] = read_sessions
+    client = TestClient(app)
+    assert client.get("/users/me/", headers=headers).status_code == 200
+    with Session(primary) as db:
+        db.scalar(select(User)).is_active = False
+        db.commit()
+    # The replica never sees the deactivation
+    assert client.get("/users/me/", headers=headers).status_code == 401
+    assert len(statements) == 1, "The replica is not read again"
@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, sessionmaker
+
+import auth
+from app import database
+from app.models import Base, ListeningHistory, Song
+from helpers import listener, overrides
+from main import app
+
+
+def make_database(path, song_title):
+    engine = database.create_db_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.add(Song(id=1, title=song_title, artist="Band"))
+        db.commit()
+    return engine
+
+
+def test_reads_use_the_replica_pool_and_writes_the_primary(tmp_path, monkeypatch, overrides):
+    """GET endpoints read through ReadSessionLocal while writes go to SessionLocal"""
+    primary = make_database(tmp_path / "primary.db", "Primary")
+    replica = make_database(tmp_path / "replica.db", "Replica")
+    with Session(replica) as db:
+        db.add(ListeningHistory(user_id=1, song_id=1, completed=True, listened_at=datetime(2026, 1, 1)))
+        db.commit()
+
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autoflush=False, bind=primary))
+    monkeypatch.setattr(database, "ReadSessionLocal", sessionmaker(autoflush=False, bind=replica))
+    overrides[auth.get_current_user] = listener
+    client = TestClient(app)
+    assert client.post("/history/", json={"song_id": 1, "completed": False}).status_code == 200
+    listed = client.get("/history/").json()
+    trending = client.get("/songs/trending").json()
+
+    assert [(item["listened_at"], item["completed"]) for item in listed] == [("2026-01-01T00:00:00", True)], \
+        "The list comes from the replica, which has not seen the new play"
+    assert [song["title"] for song in trending] == [], "Only the primary has counted the play"
+    with Session(primary) as db:
+        assert db.scalar(select(func.count()).select_from(ListeningHistory)) == 1
+    with Session(replica) as db:
+        assert db.scalar(select(func.count()).select_from(ListeningHistory)) == 1
+
+
+def test_default_read_engine_is_read_only(tmp_path):
+    """Without DATABASE_READ_URL, SQLite reads go through a read-only connection to the same file"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    make_database(tmp_path / "app.db", "Song")
+    read_engine = database.create_db_engine(database.read_database_url(url), pragmas=database.READ_PRAGMAS)
+    with read_engine.connect() as connection:
+        assert connection.execute(text("SELECT title FROM songs")).scalar() == "Song"
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.execute(text("DELETE FROM songs"))
+    assert database.read_database_url("sqlite://") == "sqlite://"
+    assert database.read_database_url("postgresql://u:p@db/music") == "postgresql://u:p@db/music"
@@ -0,0 +1,78 @@
+from sqlalchemy import event
+
+from app.models import ListeningHistory, Song, User
+from helpers import memory_engine, session_factory
+from recommendations import RecommendationEngine, get_recommendations_based_on_history
+
+
+def make_session():
+    engine = memory_engine()
+    return engine, session_factory(engine)()
+
+
+def seed(db, plays):
+    genres = ["Rock", "Pop", "Jazz", None]
+    db.add_all([
+        Song(id=i, title=f"Song {i}", artist=f"Artist {i % 7}", genre=genres[i % 4])
+        for i in range(1, 201)
+    ])
+    db.add_all([User(id=1, username="light"), User(id=2, username="heavy"), User(id=3, username="new")])
+    db.add_all([
+        ListeningHistory(user_id=1, song_id=song_id, completed=True)
+        for song_id in (1, 2, 5, 9, 4)
+    ])
+    db.add_all([
+        ListeningHistory(user_id=2, song_id=(i % 150) + 1, completed=i % 2 == 0)
+        for i in range(plays)
+    ])
+    db.commit()
+
+
+def count_queries(engine, fn):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        result = fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return result, len(statements)
+
+
+def test_set_based_engine_matches_history_engine():
+    """The set-based engine returns the same songs as the original engine"""
+    engine, db = make_session()
+    seed(db, plays=400)
+
+    for user_id in (1, 2, 3):
+        for limit in (5, 10, 100):
+            expected = get_recommendations_based_on_history(
+                db, user_id, limit, engine=RecommendationEngine.HISTORY
+            )
+            actual = get_recommendations_based_on_history(
+                db, user_id, limit, engine=RecommendationEngine.SET_BASED
+            )
+            assert [s.id for s in actual] == [s.id for s in expected], \
+                f"Engines disagree for user {user_id} with limit {limit}"
+
+
+def test_set_based_query_count_is_independent_of_history_size():
+    """The number of queries must not grow with the size of the history"""
+    small_engine, small_db = make_session()
+    seed(small_db, plays=10)
+    large_engine, large_db = make_session()
+    seed(large_db, plays=2000)
+
+    _, small_count = count_queries(
+        small_engine, lambda: get_recommendations_based_on_history(small_db, 2, 10)
+    )
+    _, large_count = count_queries(
+        large_engine, lambda: get_recommendations_based_on_history(large_db, 2, 10)
+    )
+
+    assert small_count == large_count, \
+        f"Query count grew with history size: {small_count} -> {large_count}"
+    assert large_count <= 3, f"Expected at most 3 queries, got {large_count}"
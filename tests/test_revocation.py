@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import principals, revocation
+from app.cache import TTLCache
+from app.auth import utils
+from app.auth.utils import create_access_token, create_refresh_token, token_claims
+from app.database import async_database_url, get_async_db, get_async_read_db
+from app.models import Base, RevokedToken, User
+from app.revocation import RevocationList
+from helpers import async_session_factory, memory_engine, overrides, session_factory, yield_async_sessions
+from main import app
+
+
+def add_user(url, **fields):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(id=7, username="listener", is_active=True, **fields))
+        db.commit()
+    return engine
+
+
+def test_stateless_tokens_skip_the_database_until_revoked(tmp_path, monkeypatch, overrides):
+    """Verify and refresh read only the token, and logout revokes it"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    add_user(url)
+    # Another worker created the user
+    monkeypatch.setattr(principals, "committed_principals", TTLCache(maxsize=10, ttl=60))
+    async_engine = create_async_engine(async_database_url(url))
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    sessions = yield_async_sessions(async_sessionmaker(async_engine, expire_on_commit=False))
+
+    monkeypatch.setattr(utils, "AUTH_STATELESS", True)
+    monkeypatch.setattr(utils, "revocation_list", RevocationList())
+    token = create_access_token(token_claims(User(id=7, username="listener", is_active=True)))
+    headers = {"Authorization": f"Bearer {token}"}
+    overrides[get_async_db] = overrides[get_async_read_db] = sessions
+    client = TestClient(app)
+    assert client.get("/auth/verify", headers=headers).json() == {"msg": "Success", "user": "listener"}
+    assert statements == [], "Stateless checks never query the database"
+    assert client.get("/auth/refresh", headers=headers).status_code == 200
+    assert len(statements) == 1, "Refreshing looks the user up"
+
+    assert client.get("/auth/logout", headers=headers).status_code == 200
+    assert client.get("/auth/verify", headers=headers).status_code == 401
+    refreshed = client.get("/auth/refresh", headers=headers)
+    assert refreshed.status_code == 401, "A revoked token can't be refreshed"
+
+    assert utils.revocation_list.stats()["revoked_tokens"] == 1
+    other_worker = RevocationList()
+    with sessionmaker(bind=create_engine(url))() as db:
+        assert other_worker.refresh(db) == 1
+    assert other_worker.is_revoked(jwt.decode(token, utils.SECRET_KEY, algorithms=[utils.ALGORITHM])), \
+        "Other workers pick the revocation up on their next poll"
+
+
+def test_refresh_loads_new_rows_and_forgets_expired_ones():
+    """Polls only read rows past the last id, and revocations end with their tokens"""
+    SessionLocal = session_factory(memory_engine())
+    revocations = RevocationList()
+    now = time.time()
+    with SessionLocal() as db:
+        db.add_all([
+            RevokedToken(jti="live", revoked_at=now, expires_at=now + 60),
+            RevokedToken(jti="expired", revoked_at=now - 120, expires_at=now - 60),
+            RevokedToken(user_id=3, revoked_at=now, expires_at=now + 60),
+        ])
+        db.commit()
+        assert revocations.refresh(db) == 2
+        assert revocations.refresh(db) == 0, "Rows already loaded are not read again"
+
+        db.add(RevokedToken(jti="soon", revoked_at=now, expires_at=time.time() + 0.05))
+        db.commit()
+        assert revocations.refresh(db) == 1
+        assert revocations.is_revoked({"jti": "soon", "uid": 1, "iat": now})
+        time.sleep(0.1)
+        revocations.refresh(db)
+
+    assert revocations.is_revoked({"jti": "live", "uid": 1, "iat": now})
+    assert not revocations.is_revoked({"jti": "expired", "uid": 1, "iat": now})
+    assert not revocations.is_revoked({"jti": "soon", "uid": 1, "iat": now}), "Expired entries are pruned"
+    assert revocations.is_revoked({"jti": "other", "uid": 3, "iat": now - 1}), "Older tokens of a revoked user"
+    assert not revocations.is_revoked({"jti": "other", "uid": 3, "iat": now + 1}), "Tokens issued afterwards"
+    assert revocations.stats()["revoked_tokens"] == 1
+
+
+def test_ids_of_purged_rows_are_not_reused(tmp_path):
+    """A revocation made after expired rows were purged still reaches workers past their ids"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(bind=engine)
+    AsyncSessionLocal = async_session_factory(url)
+    worker_a, worker_b = RevocationList(), RevocationList()
+
+    async def revoke(jti, expires_at):
+        async with AsyncSessionLocal() as db:
+            await worker_a.revoke(db, expires_at, jti=jti)
+
+    asyncio.run(revoke("t1", time.time() + 0.05))
+    with SessionLocal() as db:
+        assert worker_b.refresh(db) == 1
+    time.sleep(0.1)
+    # Purges t1, the only row, before inserting t2
+    asyncio.run(revoke("t2", time.time() + 60))
+    with SessionLocal() as db:
+        assert worker_b.refresh(db) == 1
+    assert worker_b.stats()["last_id"] == 2, "The new row got an id past the one worker B loaded"
+    assert worker_b.is_revoked({"jti": "t2"})
+
+
+def test_refresh_tokens_are_revocable(tmp_path, monkeypatch, overrides):
+    """A refresh token renews access until logout revokes it, and never passes for an access token"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    add_user(url)
+    sessions = yield_async_sessions(async_session_factory(url))
+
+    monkeypatch.setattr(utils, "AUTH_STATELESS", True)
+    monkeypatch.setattr(utils, "revocation_list", RevocationList())
+    refresh_token = create_refresh_token(token_claims(User(id=7, username="listener", is_active=True)))
+    overrides[get_async_db] = overrides[get_async_read_db] = sessions
+    client = TestClient(app)
+    as_access = client.get("/auth/verify", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert as_access.status_code == 401, "Refresh tokens are not access tokens"
+
+    client.cookies.set("refresh_token", refresh_token)
+    assert client.get("/auth/refresh").status_code == 200
+    assert client.get("/auth/logout").status_code == 200
+    client.cookies.set("refresh_token", refresh_token)
+    assert client.get("/auth/refresh").status_code == 401, "Logout revokes the refresh token"
+
+
+def test_deactivating_a_user_revokes_its_tokens(tmp_path, monkeypatch, overrides):
+    """Stateless access tokens and refresh tokens stop working once the user is deactivated"""
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = add_user(url)
+    sessions = yield_async_sessions(async_session_factory(url))
+
+    monkeypatch.setattr(utils, "AUTH_STATELESS", True)
+    revocations = RevocationList()
+    monkeypatch.setattr(utils, "revocation_list", revocations)
+    monkeypatch.setattr(revocation, "revocation_list", revocations)
+    claims = token_claims(User(id=7, username="listener", is_active=True))
+    access_token, refresh_token = create_access_token(claims), create_refresh_token(claims)
+    # Issued strictly before the deactivation
+    time.sleep(0.01)
+    overrides[get_async_db] = overrides[get_async_read_db] = sessions
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {access_token}"}
+    assert client.get("/auth/verify", headers=headers).status_code == 200
+    with sessionmaker(bind=engine)() as db:
+        db.get(User, 7).is_active = False
+        db.commit()
+    assert client.get("/auth/verify", headers=headers).status_code == 401, "This worker applies it at once"
+    client.cookies.set("refresh_token", refresh_token)
+    assert client.get("/auth/refresh").status_code == 401
+
+    other_worker = RevocationList()
+    with sessionmaker(bind=engine)() as db:
+        assert other_worker.refresh(db) == 1
+    assert other_worker.is_revoked(jwt.decode(refresh_token, utils.SECRET_KEY, algorithms=[utils.ALGORITHM]))
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+import auth
+import history
+from app.database import get_read_db
+from app.models import ListeningHistory, Song, UserDailyRollup
+from app.recommender import rollups
+from helpers import listener, memory_engine, overrides, session_factory, yield_sessions
+from main import app
+
+
+def make_session():
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    with SessionLocal() as db:
+        db.add_all([
+            Song(id=1, title="One", artist="Band", genre="Rock", duration=200),
+            Song(id=2, title="Two", artist="Band", genre="Jazz", duration=100),
+            Song(id=3, title="Three", artist="Trio", genre=None, duration=None),
+        ])
+        db.commit()
+    return SessionLocal
+
+
+def plays(now):
+    return [
+        {"user_id": user_id, "song_id": song_id, "completed": completed, "listened_at": now - timedelta(days=days)}
+        for user_id in (1, 2)
+        for song_id, completed, days in [(1, True, 0), (1, False, 0), (2, True, 1), (3, True, 1), (2, False, 40)]
+    ]
+
+
+def test_incremental_rollups_match_backfill_and_check():
+    """Rollups written with the plays equal a rebuild, and the checker spots drift"""
+    SessionLocal = make_session()
+    now = datetime(2026, 3, 1, 18)
+    with SessionLocal() as db:
+        history.insert_plays(db, plays(now)[:4])
+        db.commit()
+        history.insert_plays(db, plays(now)[4:])
+        db.commit()
+        incremental = sorted(tuple(row) for row in db.execute(select(UserDailyRollup.__table__)))
+        assert rollups.check(db)["mismatched"] == 0
+
+        rock = db.get(UserDailyRollup, (1, now.date(), "genre", "Rock"))
+        assert (rock.plays, rock.completed_plays, rock.seconds) == (2, 1, 300.0)
+        assert db.get(UserDailyRollup, (1, now.date() - timedelta(days=1), "genre", "")).plays == 1
+
+        rock.plays = 5
+        db.delete(db.get(UserDailyRollup, (2, now.date(), "artist", "Band")))
+        db.commit()
+        report = rollups.check(db)
+        assert report["mismatched"] == 2, report
+        assert ((2, str(now.date()), "artist", "Band"), (2, 1, 300.0), None) in report["examples"]
+        assert rollups.check(db, user_id=1)["mismatched"] == 1
+
+        rollups.backfill(db)
+        assert sorted(tuple(row) for row in db.execute(select(UserDailyRollup.__table__))) == incremental
+        assert rollups.check(db)["mismatched"] == 0
+
+
+def test_stats_endpoint_reads_rollups(overrides):
+    """Daily totals and top genres and artists come from the rollups"""
+    SessionLocal = make_session()
+    now = datetime.now()
+    with SessionLocal() as db:
+        db.add(ListeningHistory(user_id=1, song_id=1, completed=True, listened_at=now - timedelta(days=2)))
+        db.commit()
+        history.insert_plays(db, [play for play in plays(now) if play["user_id"] == 1])
+        db.commit()
+
+    overrides[get_read_db] = yield_sessions(SessionLocal)
+    overrides[auth.get_current_user] = listener
+    stats = TestClient(app).get("/history/stats?days=7").json()
+
+    assert [day["plays"] for day in stats["days"]] == [2, 2], "Plays outside the window or the rollups are left out"
+    assert stats["top_genres"][0] == {"value": "Rock", "plays": 2, "seconds": 300.0}
+    assert [artist["value"] for artist in stats["top_artists"]] == ["Band", "Trio"]
@@ -0,0 +1,126 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.models import Song, UserPreferences
+from app.recommender import affinity
+from app.recommender.catalog import UNKNOWN, SongCatalog
+from helpers import memory_engine, session_factory
+
+START = datetime(2026, 1, 1)
+
+
+def make_session():
+    engine = memory_engine()
+    db = session_factory(engine)()
+    db.add_all([
+        Song(id=i, title=f"Song {i}", artist=f"Artist {i % 3}", genre=["Rock", "Jazz", None][i % 3],
+             duration=None if i == 4 else 100 + i, created_at=START + timedelta(hours=i))
+        for i in range(2, 12, 2)
+    ])
+    db.commit()
+    return db
+
+
+def test_refresh_adds_songs_past_the_watermark():
+    """A refresh reads only newer songs, keeps the columns sorted by id and publishes a new snapshot"""
+    db = make_session()
+    catalog = SongCatalog(refresh_interval=0)
+    catalog.load(db)
+    old = catalog.snapshot
+    assert old.song_ids.tolist() == [2, 4, 6, 8, 10]
+    assert old.genre_codes.dtype == np.int32 and old.durations[1] == UNKNOWN
+    assert old.watermark == 10
+    old_shape = old.features.shape
+
+    db.add_all([
+        Song(id=3, title="Late", artist="Newcomer", genre="Folk", duration=90, created_at=datetime.now()),
+        Song(id=12, title="Later", artist="Artist 0", genre="rock", duration=80, created_at=START + timedelta(days=2)),
+    ])
+    db.commit()
+    snapshot = catalog.ensure_loaded(db)
+
+    assert snapshot is catalog.snapshot and snapshot is not old
+    assert snapshot.song_ids.tolist() == [2, 3, 4, 6, 8, 10, 12]
+    position = snapshot.positions(np.array([3]))[0]
+    assert snapshot.genres.labels[snapshot.genre_codes[position]] == "folk"
+    assert snapshot.durations[position] == 90
+    assert snapshot.genre_codes[-1] == snapshot.genres.codes["rock"], "Labels already known keep their code"
+    assert snapshot.watermark == 12
+    assert snapshot.features.shape == (7, len(snapshot.genres) + len(snapshot.artists))
+
+    # Readers holding the old snapshot are unaffected, vocabularies included
+    assert old.song_ids.tolist() == [2, 4, 6, 8, 10] and "folk" not in old.genres.codes
+    assert old.features.shape == old_shape == (5, len(old.genres) + len(old.artists))
+    affinity = np.ones(old.features.shape[1])
+    assert len(old.features @ affinity) == len(old), "The old matrix still matches the old vocabularies"
+    assert catalog.refresh(db) == 0
+
+
+def test_refresh_adds_songs_committed_out_of_order():
+    """Songs behind the created_at of newer ones are still picked up"""
+    db = make_session()
+    catalog = SongCatalog(refresh_interval=0)
+    catalog.load(db)
+
+    # An import carrying a historical timestamp, and a song whose id was taken before 10's but committed after it
+    db.add_all([
+        Song(id=14, title="Imported", artist="Artist 0", genre="Rock", created_at=START - timedelta(days=365)),
+        Song(id=9, title="Slow commit", artist="Artist 1", genre="Jazz", created_at=datetime.now()),
+    ])
+    db.commit()
+
+    assert catalog.refresh(db) == 2
+    assert catalog.snapshot.song_ids.tolist() == [2, 4, 6, 8, 9, 10, 14]
+    assert catalog.snapshot.watermark == 14
+    assert catalog.refresh(db) == 0, "Songs in the overlap window are only added once"
+
+
+def test_recommend_during_concurrent_refreshes():
+    """Scoring stays consistent while refreshes add genres and artists"""
+    engine = memory_engine()
+    SessionLocal = session_factory(engine)
+    with SessionLocal() as db:
+        db.add(Song(id=1, title="First", artist="Band", genre="Rock", duration=100, created_at=START))
+        db.add(UserPreferences(user_id=1, genre_preference=["rock"], artist_preference=["band"]))
+        db.commit()
+    catalog = SongCatalog(refresh_interval=0)
+    with SessionLocal() as db:
+        catalog.load(db)
+    stop, errors = threading.Event(), []
+
+    def refresh():
+        with SessionLocal() as db:
+            for i in range(2, 200):
+                db.add(Song(id=i, title=f"Song {i}", artist=f"Artist {i}", genre=f"Genre {i}", duration=100,
+                            created_at=START + timedelta(minutes=i)))
+                db.commit()
+                catalog.refresh(db)
+        stop.set()
+
+    thread = threading.Thread(target=refresh)
+    thread.start()
+    with SessionLocal() as db:
+        while not stop.is_set():
+            try:
+                assert affinity.recommend(db, catalog, 1, 5, now=START) == [1]
+            except Exception as e:
+                errors.append(e)
+                break
+    thread.join()
+    assert errors == []
+    assert len(catalog.snapshot) == 199
+
+
+def test_memory_usage_reports_every_column():
+    """The report covers each column and the vocabularies"""
+    db = make_session()
+    catalog = SongCatalog()
+    catalog.load(db)
+    snapshot = catalog.snapshot
+    usage = snapshot.memory_usage()
+    assert usage["song_ids"] == 5 * 8 and usage["genre_codes"] == 5 * 4 and usage["created_at"] == 5 * 8
+    assert usage["artist_vocabulary"] > 0 and "features" not in usage
+    snapshot.features
+    assert "features" in snapshot.memory_usage()
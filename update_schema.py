@@ -1,4 +1,5 @@
-from app.session import engine
+from app.models import ListeningHistory, Song
+from app.database import engine
 from sqlalchemy import text
 import sqlite3
 
@@ -81,5 +82,19 @@ def update_schema():
         return False
 
 
+def add_history_index():
+    """Create the listening history and song catalog indexes on existing databases."""
+    print("Adding listening history and song indexes...")
+    try:
+        for index in ListeningHistory.__table__.indexes | Song.__table__.indexes:
+            index.create(bind=engine, checkfirst=True)
+        print("Indexes ready!")
+        return True
+    except Exception as e:
+        print(f"Error adding index: {e}")
+        return False
+
+
 if __name__ == "__main__":
-    update_schema()
\ No newline at end of file
+    update_schema()
+    add_history_index()
\ No newline at end of file